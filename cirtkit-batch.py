@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# This file is part of Cirtkit - https://github.com/cirtkit-framework/cirtkit
+
+import sys
+import time
+import argparse
+from collections import Counter
+
+from lib.common.out import print_info, print_error, print_warning, print_success, table
+from lib.core.investigation import __project__
+from lib.core.database import Database
+from lib.core.plugins import __scripts__
+from lib.core.batch import check_commands, get_samples, get_done, run_batch
+
+# Progress is printed every this many samples.
+PROGRESS_INTERVAL = 100
+
+parser = argparse.ArgumentParser(description='Run modules on the stored files, without the console')
+parser.add_argument('-i', '--investigation', help='Specify a new or existing investigation', action='store', required=False)
+parser.add_argument('-c', '--command', action='append', default=[], help='Module command line to run on each file, e.g. "pe imphash" (can be repeated)')
+parser.add_argument('-s', '--script', help='Run the commands of a script from the scripts folder')
+parser.add_argument('-l', '--list', action='store_true', help='List the available scripts')
+parser.add_argument('-t', '--tag', help='Only run on the files with this tag')
+parser.add_argument('-f', '--find', nargs='+', metavar=('KEY', 'VALUE'), help='Only run on the files matching the find query, e.g. "-f name *.exe"')
+parser.add_argument('-o', '--output', help='JSON Lines file to write the results to')
+parser.add_argument('-j', '--jobs', type=int, help='Number of worker processes (default is the number of CPUs)')
+parser.add_argument('--timeout', type=int, help='Seconds after which a command is interrupted')
+parser.add_argument('--resume', action='store_true', help='Skip the files already processed successfully in the output with the same commands')
+parser.add_argument('--no-cache', action='store_true', help='Analyze the files again instead of using the cached results')
+args = parser.parse_args()
+
+if args.list:
+    rows = [[cmd, script['description']] for cmd, script in sorted(__scripts__.items())]
+    print(table(header=['Script', 'Description'], rows=rows))
+    sys.exit(0)
+
+commands = list(args.command)
+key, value = 'all', None
+if args.script:
+    if args.script not in __scripts__:
+        print_error("Unknown script {0}, use --list to see the available ones".format(args.script))
+        sys.exit(1)
+
+    script = __scripts__[args.script]['obj']
+    commands = list(script.commands) + commands
+    key, value = script.key, script.value
+
+if not commands:
+    print_error("Specify at least one command or a script")
+    sys.exit(1)
+
+invalid = check_commands(commands)
+if invalid:
+    print_error("Only modules can be run in batch: {0}".format(', '.join(invalid)))
+    sys.exit(1)
+
+if not args.output:
+    print_error("Specify the output file with --output")
+    sys.exit(1)
+
+if args.tag:
+    key, value = 'tag', args.tag
+elif args.find:
+    key, value = args.find[0], ' '.join(args.find[1:]) or None
+
+if args.investigation:
+    __project__.open(args.investigation, Database())
+
+samples = get_samples(key, value)
+
+if args.resume:
+    done = get_done(args.output, commands)
+    samples = [sample for sample in samples if sample[0] not in done]
+    print_info("Resuming, {0} files already done".format(len(done)))
+
+print_info("Running {0} on {1} files".format(', '.join(commands), len(samples)))
+
+start = time.time()
+statuses = Counter()
+with open(args.output, 'a' if args.resume else 'w') as handle:
+    try:
+        for sha256, status in run_batch(samples, commands, handle, args.jobs, args.timeout, args.no_cache):
+            statuses[status] += 1
+            if status != 'ok':
+                print_warning("{0} on {1}".format(status.capitalize(), sha256))
+
+            count = sum(statuses.values())
+            if count % PROGRESS_INTERVAL == 0:
+                print_info("Processed {0}/{1} files".format(count, len(samples)))
+    except KeyboardInterrupt:
+        print_warning("Interrupted, run again with --resume to continue")
+        sys.exit(1)
+
+print_success("Processed {0} files in {1:.1f}s ({2}), results written to {3}".format(
+    sum(statuses.values()), time.time() - start,
+    ', '.join('{0} {1}'.format(count, status) for status, count in sorted(statuses.items())) or 'none',
+    args.output))
@@ -1,8 +1,57 @@
 # This file is part of Viper - https://github.com/viper-framework/viper
 # See the file 'LICENSE' for copying permission.
 
+import os
+import json
+import hashlib
+import inspect
 import argparse
 
+from lib.common.constants import CIRTKIT_ROOT
+from lib.common.sinks import get_sink, redirect_output, RecordSink
+from lib.core.session import __sessions__
+from lib.core.database import Database, ANALYSIS_ENTRY_SIZE
+
+# Source digest of each module class and of the files it depends on, used as
+# the version of their results in the analysis cache.
+_versions = {}
+
+
+def get_dependency_files(path):
+    # Returns the sorted list of the files of a dependency, a single file or
+    # all the files under a folder.
+    if not os.path.isdir(path):
+        return [path]
+
+    paths = []
+    for folder, folders, files in os.walk(path):
+        folders[:] = [name for name in folders if name != '__pycache__']
+        paths.extend(os.path.join(folder, name) for name in files if not name.endswith('.pyc'))
+    return sorted(paths)
+
+
+def get_version(cls):
+    if cls not in _versions:
+        digest = hashlib.sha1()
+        try:
+            with open(inspect.getsourcefile(cls), 'rb') as handle:
+                digest.update(handle.read())
+        except (IOError, TypeError):
+            pass
+
+        for dependency in cls.cache_dependencies:
+            for path in get_dependency_files(os.path.join(CIRTKIT_ROOT, dependency)):
+                digest.update(os.path.relpath(path, CIRTKIT_ROOT).encode('utf-8'))
+                try:
+                    with open(path, 'rb') as handle:
+                        digest.update(handle.read())
+                except IOError:
+                    digest.update(b'missing')
+
+        _versions[cls] = digest.hexdigest()
+
+    return _versions[cls]
+
 
 class ArgumentErrorCallback(Exception):
 
@@ -39,7 +88,16 @@ class Module(object):
     command_line = []
     args = None
     authors = []
-    output = []
+    # Modules whose output only depends on the opened file and the arguments
+    # set this, so that it's cached in the investigation database. The
+    # arguments with side effects, or looking at the rest of the repository,
+    # are listed in uncached_args and disable the cache when set.
+    cacheable = False
+    uncached_args = ()
+    # Files and folders, relative to the root of CIRTKIT, that the output
+    # also depends on: helper modules, signatures, rules. Their content is
+    # part of the version of the cached results.
+    cache_dependencies = ()
 
     def __init__(self):
         self.parser = ArgumentParser(prog=self.cmd, description=self.description)
@@ -48,7 +106,8 @@ class Module(object):
         self.command_line = command
 
     def log(self, event_type, event_data):
-        self.output.append(dict(
+        # The events are streamed to the output sink as they are logged.
+        get_sink().write(dict(
             type=event_type,
             data=event_data
         ))
@@ -65,6 +124,68 @@ class Module(object):
         except ArgumentErrorCallback as e:
             self.log(*e.get())
 
+    def is_cacheable(self):
+        for name in self.uncached_args:
+            if getattr(self.args, name, None):
+                return False
+        return True
+
+    def get_cache_key(self):
+        # Returns a tuple (sha256, arguments, version) identifying the
+        # results of this run, or None if they can't be cached.
+        if not self.cacheable:
+            return None
+
+        if not __sessions__.is_set() or not __sessions__.current.file:
+            return None
+
+        try:
+            self.args = self.parser.parse_args(self.command_line)
+        except ArgumentErrorCallback:
+            # run() will report the error.
+            return None
+
+        if not self.is_cacheable():
+            return None
+
+        # The parsed arguments, so that the order of the options or their
+        # short and long forms don't matter.
+        args = json.dumps(sorted(vars(self.args).items()), default=str)
+        return __sessions__.current.file.sha256, args, get_version(type(self))
+
+    def execute(self):
+        # Run the module, or show its cached output if it already ran on the
+        # same file with the same arguments. --no-cache runs it again.
+        no_cache = '--no-cache' in self.command_line
+        self.command_line = [arg for arg in self.command_line if arg != '--no-cache']
+
+        key = self.get_cache_key()
+
+        if key and not no_cache:
+            cached = Database().get_analysis(key[0], self.cmd, key[1], key[2])
+            if cached:
+                events, created_at = cached
+                sink = get_sink()
+                for event in events:
+                    sink.write(event)
+                self.log('info', "Cached result from {0}, use --no-cache to analyze the file again".format(
+                    created_at.strftime('%Y-%m-%d %H:%M:%S')))
+                return
+
+        if not key:
+            self.run()
+            return
+
+        # Keep a copy of the output to cache it, unless it gets too large.
+        recorder = RecordSink(get_sink(), ANALYSIS_ENTRY_SIZE)
+        with redirect_output(recorder):
+            self.run()
+
+        events = recorder.events
+        # Errors might be transient, like a missing dependency.
+        if not recorder.overflow and events and not any(event['type'] == 'error' for event in events):
+            Database().add_analysis(key[0], self.cmd, key[1], key[2], events)
+
 
 class Integration(object):
     cmd = ''
@@ -72,7 +193,6 @@ class Integration(object):
     command_line = []
     args = None
     authors = []
-    output = []
 
     def __init__(self):
         self.parser = ArgumentParser(prog=self.cmd, description=self.description)
@@ -81,7 +201,8 @@ class Integration(object):
         self.command_line = command
 
     def log(self, event_type, event_data):
-        self.output.append(dict(
+        # The events are streamed to the output sink as they are logged.
+        get_sink().write(dict(
             type=event_type,
             data=event_data
         ))
@@ -100,4 +221,11 @@ class Integration(object):
 
 
 class Script(object):
-    pass
+    # A pipeline of module command lines, run by cirtkit-batch.py on each of
+    # the stored files matching the find key and value.
+    cmd = ''
+    description = ''
+    authors = []
+    commands = []
+    key = 'all'
+    value = None
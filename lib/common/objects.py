@@ -2,8 +2,10 @@
 # See the file 'LICENSE' for copying permission.
 
 import os
+import mmap
 import hashlib
 import binascii
+from collections import OrderedDict
 
 try:
     import pydeep
@@ -11,11 +13,76 @@ try:
 except ImportError:
     HAVE_SSDEEP = False
 
+# The ssdeep bindings expose an incremental hasher, which lets us compute the
+# fuzzy hash from the same read used for the other digests.
+try:
+    import ssdeep
+    HAVE_SSDEEP_STREAM = hasattr(ssdeep, 'Hash')
+except ImportError:
+    HAVE_SSDEEP_STREAM = False
+
 try:
     import magic
 except ImportError:
     pass
 
+# Size of the reads used when hashing files.
+CHUNK_SIZE = 1024 * 1024
+
+# Loading the magic database is expensive, so we keep one handle per process
+# and per kind instead of opening a new one for each file.
+_magic_handles = {}
+
+
+def get_magic(mime=False):
+    key = (os.getpid(), mime)
+    if key not in _magic_handles:
+        try:
+            handle = magic.open(magic.MIME if mime else magic.MAGIC_NONE)
+            handle.load()
+        except AttributeError:
+            # python-magic instead of the bindings shipped with libmagic.
+            handle = magic.Magic(mime=mime)
+
+        _magic_handles[key] = handle
+
+    return _magic_handles[key]
+
+
+def magic_from_file(path, mime=False):
+    handle = get_magic(mime)
+    if hasattr(handle, 'from_file'):
+        return handle.from_file(path)
+
+    return handle.file(path)
+
+
+def magic_from_buffer(data, mime=False):
+    handle = get_magic(mime)
+    if hasattr(handle, 'from_buffer'):
+        return handle.from_buffer(data)
+
+    return handle.buffer(data)
+
+# Results of the expensive File attributes, keyed by the identity of the file
+# on disk, so that a new File object on an unchanged file doesn't compute them
+# again. The ctime is part of it, as the mtime can be restored after a write.
+_file_cache = OrderedDict()
+FILE_CACHE_SIZE = 256
+
+
+def lazy_attribute(name, loader):
+    def getter(self):
+        if name not in self._cache:
+            loader(self)
+
+        return self._cache[name]
+
+    def setter(self, value):
+        self._cache[name] = value
+
+    return property(getter, setter)
+
 class Singleton(type):
     _instances = {}
     def __call__(cls, *args, **kwargs):
@@ -31,39 +98,91 @@ class MispEvent(object):
 
 class File(object):
 
+    # Hashes and magic are only computed when first accessed.
+    type = lazy_attribute('type', lambda self: setattr(self, 'type', self.get_type()))
+    mime = lazy_attribute('mime', lambda self: setattr(self, 'mime', self.get_mime()))
+    md5 = lazy_attribute('md5', lambda self: self.get_hashes())
+    sha1 = lazy_attribute('sha1', lambda self: self.get_hashes())
+    sha256 = lazy_attribute('sha256', lambda self: self.get_hashes())
+    sha512 = lazy_attribute('sha512', lambda self: self.get_hashes())
+    crc32 = lazy_attribute('crc32', lambda self: self.get_hashes())
+    ssdeep = lazy_attribute('ssdeep', lambda self: self.get_hashes())
+
     def __init__(self, path):
         self.path = path
         self.name = ''
         self.size = 0
-        self.type = ''
-        self.mime = ''
-        self.md5 = ''
-        self.sha1 = ''
-        self.sha256 = ''
-        self.sha512 = ''
-        self.crc32 = ''
-        self.ssdeep = ''
         self.tags = ''
-        
+        self._buffer = None
+
         if self.is_valid():
             self.name = os.path.basename(self.path)
-            self.size = os.path.getsize(self.path)
-            self.type = self.get_type()
-            self.mime = self.get_mime()
-            self.get_hashes()
-            self.ssdeep = self.get_ssdeep()
+
+            stat = os.stat(self.path)
+            self.size = stat.st_size
+
+            key = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime, stat.st_ctime)
+            if key in _file_cache:
+                self._cache = _file_cache.pop(key)
+            else:
+                self._cache = {}
+
+            _file_cache[key] = self._cache
+            while len(_file_cache) > FILE_CACHE_SIZE:
+                _file_cache.popitem(last=False)
+        else:
+            self._cache = dict(type='', mime='', md5='', sha1='', sha256='',
+                               sha512='', crc32='', ssdeep='')
+
+    def compute(self):
+        # Force the computation of all the lazy attributes, for example
+        # before sending the object to another process.
+        for name in ('type', 'mime', 'sha256'):
+            getattr(self, name)
+
+    def __getstate__(self):
+        # Memory maps can't be pickled, the copy will map the file again.
+        state = self.__dict__.copy()
+        state['_buffer'] = None
+        return state
 
     @property
     def data(self):
+        # This returns a private copy of the whole content. Modules which
+        # only need to search or slice the file should use buffer instead.
         return open(self.path, 'rb').read()
 
+    @property
+    def buffer(self):
+        # Read-only memory map of the file, created once and shared by all
+        # the modules running on this File object.
+        if self._buffer is None:
+            if not self.size:
+                return b''
+
+            with open(self.path, 'rb') as fd:
+                self._buffer = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return self._buffer
+
+    def get_view(self, offset=0, size=None):
+        # Slice of the memory map which doesn't copy the data.
+        if size is None:
+            size = max(self.size - offset, 0)
+
+        try:
+            return memoryview(self.buffer)[offset:offset + size]
+        except TypeError:
+            # Python 2 memory maps only support the old buffer interface.
+            return buffer(self.buffer, offset, size)
+
     def is_valid(self):
         return os.path.exists(self.path) and os.path.isfile(self.path)# and os.path.getsize(self.path) != 0
 
     def get_chunks(self):
         fd = open(self.path, 'rb')
         while True:
-            chunk = fd.read(16 * 1024)
+            chunk = fd.read(CHUNK_SIZE)
             if not chunk:
                 break
 
@@ -72,18 +191,23 @@ class File(object):
         fd.close()
 
     def get_hashes(self):
+        # All the digests, and the fuzzy hash when the bindings allow it, are
+        # fed from a single read of the file.
         crc = 0
         md5 = hashlib.md5()
         sha1 = hashlib.sha1()
         sha256 = hashlib.sha256()
         sha512 = hashlib.sha512()
-        
+        fuzzy = ssdeep.Hash() if HAVE_SSDEEP_STREAM else None
+
         for chunk in self.get_chunks():
             crc = binascii.crc32(chunk, crc)
             md5.update(chunk)
             sha1.update(chunk)
             sha256.update(chunk)
             sha512.update(chunk)
+            if fuzzy:
+                fuzzy.update(chunk)
 
         self.crc32 = ''.join('%02X' % ((crc>>i)&0xff) for i in [24, 16, 8, 0])
         self.md5 = md5.hexdigest()
@@ -91,6 +215,14 @@ class File(object):
         self.sha256 = sha256.hexdigest()
         self.sha512 = sha512.hexdigest()
 
+        if fuzzy:
+            try:
+                self.ssdeep = fuzzy.digest()
+            except Exception:
+                self.ssdeep = ''
+        else:
+            self.ssdeep = self.get_ssdeep()
+
     def get_ssdeep(self):
         if not HAVE_SSDEEP:
             return ''
@@ -102,37 +234,21 @@ class File(object):
 
     def get_type(self):
         try:
-            ms = magic.open(magic.MAGIC_NONE)
-            ms.load()
-            file_type = ms.file(self.path)
+            file_type = magic_from_file(self.path)
         except:
             try:
-                file_type = magic.from_file(self.path)
-            except:
-                try:
-                    import subprocess
-                    file_process = subprocess.Popen(['file', '-b', self.path], stdout = subprocess.PIPE)
-                    file_type = file_process.stdout.read().strip()
-                except:
-                    return ''
-        finally:
-            try:
-                ms.close()
+                import subprocess
+                file_process = subprocess.Popen(['file', '-b', self.path], stdout = subprocess.PIPE)
+                file_type = file_process.stdout.read().strip()
             except:
-                pass
+                return ''
 
         return file_type
 
     def get_mime(self):
         try:
-            ms = magic.open(magic.MIME)
-            ms.load()
-            mime_type = ms.file(self.path)
+            mime_type = magic_from_file(self.path, mime=True)
         except:
-            try:
-                mime = magic.Magic(mime=True)
-                mime_type = mime.from_file(self.path)
-            except:
-                return ''
+            return ''
 
         return mime_type
@@ -1,24 +1,47 @@
 # This file is part of Viper - https://github.com/viper-framework/viper
 # See the file 'LICENSE' for copying permission.
 
+import re
+from itertools import islice
+
 from prettytable import PrettyTable
 
 from lib.common.colors import *
 
+# Large tables are rendered this many rows at a time.
+TABLE_CHUNK_SIZE = 1000
+
+ANSI_ESCAPE = re.compile(r'\x1b\[[0-9;]*m')
+
+def format_info(message):
+    return bold(cyan("[*]")) + " {0}".format(message)
+
+def format_item(message, tabs=0):
+    return " {0}".format("  " * tabs) + cyan("-") + " {0}".format(message)
+
+def format_warning(message):
+    return bold(yellow("[!]")) + " {0}".format(message)
+
+def format_error(message):
+    return bold(red("[!]")) + " {0}".format(message)
+
+def format_success(message):
+    return bold(green("[+]")) + " {0}".format(message)
+
 def print_info(message):
-    print(bold(cyan("[*]")) + " {0}".format(message))
+    print(format_info(message))
 
 def print_item(message, tabs=0):
-    print(" {0}".format("  " * tabs) + cyan("-") + " {0}".format(message))
+    print(format_item(message, tabs))
 
 def print_warning(message):
-    print(bold(yellow("[!]")) + " {0}".format(message))
+    print(format_warning(message))
 
 def print_error(message):
-    print(bold(red("[!]")) + " {0}".format(message))
+    print(format_error(message))
 
 def print_success(message):
-    print(bold(green("[+]")) + " {0}".format(message))
+    print(format_success(message))
 
 def table(header, rows):
     table = PrettyTable(header)
@@ -29,3 +52,63 @@ def table(header, rows):
         table.add_row(row)
 
     return table
+
+def to_unicode(value):
+    if isinstance(value, unicode):
+        return value
+    if not isinstance(value, str):
+        value = str(value)
+    return value.decode('utf-8', 'replace')
+
+def iter_table(header, rows):
+    # Yields the lines of the same table as table(), rendering the rows one
+    # chunk at a time, so that large tables or rows coming from a generator
+    # are never held in memory at once. Columns are widened when a chunk
+    # needs it, starting with a new border line.
+    def get_width(value):
+        return max(len(ANSI_ESCAPE.sub('', line)) for line in value.split('\n'))
+
+    def get_border(widths):
+        return '+' + '+'.join('-' * (width + 2) for width in widths) + '+'
+
+    def get_lines(cells, widths):
+        cells = [cell.split('\n') for cell in cells]
+        for index in range(max(len(cell) for cell in cells)):
+            line = []
+            for cell, width in zip(cells, widths):
+                value = cell[index] if index < len(cell) else ''
+                line.append(value + ' ' * (width - get_width(value)))
+            yield '| ' + ' | '.join(line) + ' |'
+
+    header = [to_unicode(value) for value in header]
+    widths = [get_width(value) for value in header]
+
+    rows = iter(rows)
+    first = True
+    while True:
+        chunk = [[to_unicode(value) for value in row] for row in islice(rows, TABLE_CHUNK_SIZE)]
+        if not chunk and not first:
+            break
+
+        new_widths = list(widths)
+        for row in chunk:
+            new_widths = [max(width, get_width(value)) for width, value in zip(new_widths, row)]
+
+        if first:
+            yield get_border(new_widths)
+            for line in get_lines(header, new_widths):
+                yield line
+            yield get_border(new_widths)
+        elif new_widths != widths:
+            yield get_border(new_widths)
+
+        widths = new_widths
+        for row in chunk:
+            for line in get_lines(row, widths):
+                yield line
+
+        first = False
+        if len(chunk) < TABLE_CHUNK_SIZE:
+            break
+
+    yield get_border(widths)
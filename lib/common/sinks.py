@@ -0,0 +1,271 @@
+# This file is part of Viper - https://github.com/viper-framework/viper
+# See the file 'LICENSE' for copying permission.
+
+import os
+import re
+import sys
+import json
+import errno
+import subprocess
+from itertools import islice
+from contextlib import contextmanager
+
+from lib.common.out import TABLE_CHUNK_SIZE, iter_table, print_success
+from lib.common.out import format_info, format_item, format_warning, format_error, format_success
+
+# Terminal colors added by the modules to their output, as escaped in JSON.
+JSON_ANSI_ESCAPE = re.compile(r'\\u001b\[[0-9;]*m')
+
+# Output events are written to the sink on top of the stack, or to the
+# terminal if there's none.
+_sinks = []
+
+
+class OutputClosed(Exception):
+    # The reader of the output went away, e.g. the pager was quit.
+    pass
+
+
+def to_json(value):
+    # Modules might output binary strings, which aren't valid UTF-8.
+    try:
+        line = json.dumps(value, default=str)
+    except UnicodeDecodeError:
+        line = json.dumps(value, default=str, encoding='latin-1')
+
+    return JSON_ANSI_ESCAPE.sub('', line)
+
+
+class Sink(object):
+    # Receives the output events, dicts with a type and data, as they are
+    # logged. The rows of a table event can be any iterable, and are only
+    # read once.
+    def write(self, event):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class TextSink(Sink):
+    # Renders the events as text to a stream, stdout by default.
+    formats = dict(
+        info=format_info,
+        item=format_item,
+        warning=format_warning,
+        error=format_error,
+        success=format_success
+    )
+    plain_formats = dict(
+        info='[*] {0}',
+        item='  [-] {0}',
+        warning='[!] {0}',
+        error='[!] {0}',
+        success='[+] {0}'
+    )
+
+    def __init__(self, stream=None, colors=True):
+        self.stream = stream
+        self.colors = colors
+
+    def get_stream(self):
+        # The stream is looked up on each write, as stdout is replaced in
+        # the background jobs.
+        return self.stream or sys.stdout
+
+    def write_line(self, line):
+        if isinstance(line, unicode):
+            line = line.encode('utf-8')
+        elif not isinstance(line, str):
+            line = str(line)
+
+        try:
+            self.get_stream().write(line + '\n')
+        except IOError as e:
+            if e.errno == errno.EPIPE:
+                raise OutputClosed()
+            raise
+
+    def write(self, event):
+        event_type = event['type']
+        data = event['data']
+
+        if event_type == 'table':
+            for line in iter_table(data['header'], data['rows']):
+                self.write_line(line)
+        elif event_type in self.formats:
+            if self.colors:
+                self.write_line(self.formats[event_type](data))
+            else:
+                self.write_line(self.plain_formats[event_type].format(data))
+        else:
+            self.write_line(data)
+
+    def close(self):
+        try:
+            self.get_stream().flush()
+        except IOError as e:
+            if e.errno != errno.EPIPE:
+                raise
+
+
+class FileSink(TextSink):
+    # Appends the events as plain text to a file.
+    def __init__(self, path):
+        super(FileSink, self).__init__(colors=False)
+        self.path = path
+
+    def get_stream(self):
+        # The file is only created if there's something to write.
+        if self.stream is None:
+            self.stream = open(self.path, 'a')
+        return self.stream
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+            print_success("Output written to {0}".format(self.path))
+
+
+class PipeSink(TextSink):
+    # Writes the events to the input of a shell command, the pager by
+    # default, as they are logged.
+    def __init__(self, command=None):
+        super(PipeSink, self).__init__()
+        self.command = command or os.environ.get('PAGER', 'less -R')
+        self.process = None
+
+    def get_stream(self):
+        if self.process is None:
+            self.process = subprocess.Popen(self.command, shell=True, stdin=subprocess.PIPE)
+        return self.process.stdin
+
+    def close(self):
+        if self.process is not None:
+            try:
+                self.process.stdin.close()
+            except IOError:
+                pass
+            self.process.wait()
+            self.process = None
+
+
+class JsonSink(Sink):
+    # Appends the events to a file as JSON Lines. Large tables are split in
+    # several table events with the same header.
+    def __init__(self, path):
+        self.path = path
+        self.handle = None
+
+    def write_value(self, value):
+        if self.handle is None:
+            self.handle = open(self.path, 'a')
+        self.handle.write(to_json(value) + '\n')
+
+    def write(self, event):
+        if event['type'] != 'table':
+            self.write_value(event)
+            return
+
+        header = event['data']['header']
+        rows = iter(event['data']['rows'])
+        first = True
+        while True:
+            chunk = list(islice(rows, TABLE_CHUNK_SIZE))
+            if chunk or first:
+                self.write_value(dict(type='table', data=dict(header=header, rows=chunk)))
+            if len(chunk) < TABLE_CHUNK_SIZE:
+                break
+            first = False
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+            print_success("Output written to {0}".format(self.path))
+
+
+class ListSink(Sink):
+    # Keeps the events in a list.
+    def __init__(self):
+        self.events = []
+
+    def write(self, event):
+        if event['type'] == 'table' and not isinstance(event['data']['rows'], list):
+            event = dict(type='table', data=dict(event['data'], rows=list(event['data']['rows'])))
+        self.events.append(event)
+
+
+class RecordSink(Sink):
+    # Forwards the events to another sink, and keeps a copy of them as long
+    # as their size stays under the limit, in bytes. Past it, the copy is
+    # dropped and overflow is set.
+    def __init__(self, sink, limit):
+        self.sink = sink
+        self.limit = limit
+        self.size = 0
+        self.events = []
+        self.overflow = False
+
+    def record(self, value):
+        # The size is estimated from the representation of the data.
+        if not self.overflow:
+            self.size += len(repr(value))
+            if self.size > self.limit:
+                self.overflow = True
+                self.events = []
+        return not self.overflow
+
+    def record_rows(self, rows, copy):
+        for row in rows:
+            if self.record(row):
+                copy.append(row)
+            yield row
+
+    def write(self, event):
+        if self.overflow:
+            self.sink.write(event)
+        elif event['type'] == 'table' and not isinstance(event['data']['rows'], list):
+            # The rows are copied as they go through.
+            copy = []
+            self.events.append(dict(type='table', data=dict(event['data'], rows=copy)))
+            self.sink.write(dict(type='table', data=dict(
+                event['data'], rows=self.record_rows(event['data']['rows'], copy))))
+        else:
+            if self.record(event['data']):
+                self.events.append(event)
+            self.sink.write(event)
+
+
+def get_sink():
+    if _sinks:
+        return _sinks[-1]
+    return _terminal
+
+
+@contextmanager
+def redirect_output(sink):
+    # The events logged in the block go to the sink, if any.
+    if sink is not None:
+        _sinks.append(sink)
+    try:
+        yield
+    finally:
+        if sink is not None:
+            _sinks.pop()
+
+
+def open_sink(target):
+    # Returns the sink for an output redirection of the console, "> path"
+    # for a file, JSON Lines if it ends with .jsonl, or "| command" for a
+    # pipe.
+    target = target.strip()
+    if target.startswith('|'):
+        return PipeSink(target[1:].strip())
+    elif target.endswith('.jsonl'):
+        return JsonSink(target)
+    return FileSink(target)
+
+
+_terminal = TextSink()
@@ -7,10 +7,7 @@ import math
 import string
 import hashlib
 
-try:
-    import magic
-except ImportError:
-    pass
+from lib.common.objects import magic_from_buffer
 
 # Taken from the Python Cookbook.
 def path_split_all(path):
@@ -34,19 +31,9 @@ def path_split_all(path):
 # with the ones available in the File class.
 def get_type(data):
     try:
-        ms = magic.open(magic.MAGIC_NONE)
-        ms.load()
-        file_type = ms.buffer(data)
+        file_type = magic_from_buffer(data)
     except:
-        try:
-            file_type = magic.from_buffer(data)
-        except:
-            return ''
-    finally:
-        try:
-            ms.close()
-        except:
-            pass
+        return ''
 
     return file_type
 
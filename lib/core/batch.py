@@ -0,0 +1,204 @@
+# This file is part of Viper - https://github.com/viper-framework/viper
+# See the file 'LICENSE' for copying permission.
+
+import os
+import sys
+import json
+import time
+import signal
+import traceback
+import multiprocessing
+from datetime import datetime
+
+from lib.common.objects import File
+from lib.common.sinks import ListSink, redirect_output, to_json
+from lib.core.database import Database
+from lib.core.session import __sessions__, Session
+from lib.core.storage import sample_file
+from lib.core.plugins import __modules__
+
+# Workers are replaced after this many samples, so that memory leaked by the
+# modules or their parsers doesn't accumulate over a night.
+MAX_TASKS_PER_WORKER = 500
+# The results are synced to disk every this many samples.
+SYNC_INTERVAL = 100
+
+# Seconds a single command can run in the workers, None for no limit.
+_worker_timeout = None
+
+
+class CommandTimeout(Exception):
+    pass
+
+
+def parse_command(command):
+    # Split a command line like in the console, into (root, args).
+    words = command.split()
+    return words[0], words[1:]
+
+
+def check_commands(commands):
+    # Returns the list of commands which aren't modules, only those can be
+    # run headless.
+    return [command for command in commands if not command.strip() or parse_command(command)[0] not in __modules__]
+
+
+def get_samples(key='all', value=None):
+    # Returns the list of (sha256, name) of the stored files matching the
+    # search, in the order they were stored.
+    return [(row.sha256, row.name) for row in Database().find_iter(key, value, columns=['sha256', 'name'])]
+
+
+def get_done(output_path, commands):
+    # Returns the set of samples already processed successfully with the
+    # same commands, from the results of an interrupted run. The failed ones
+    # are run again, their new record comes after the old one. A record left
+    # incomplete by a crash is truncated, so that new ones can be appended.
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+
+    with open(output_path, 'rb+') as handle:
+        end = 0
+        for line in iter(handle.readline, b''):
+            if not line.endswith(b'\n'):
+                break
+
+            end += len(line)
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+
+            if record.get('commands') == commands and record.get('status') == 'ok':
+                done.add(record['sha256'])
+
+        handle.truncate(end)
+
+    return done
+
+
+def on_alarm(signum, frame):
+    raise CommandTimeout()
+
+
+def set_timeout(timeout):
+    global _worker_timeout
+    _worker_timeout = timeout
+    signal.signal(signal.SIGALRM, on_alarm)
+
+
+def init_worker(timeout):
+    set_timeout(timeout)
+    # The interruption is handled by the parent process.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Some modules print directly, which would mix with the progress.
+    sys.stdout = open(os.devnull, 'w')
+
+
+def open_session(sha256, path):
+    # Same as __sessions__.new(), without the output and without hashing the
+    # sample again.
+    session = Session()
+    session.id = 1
+    session.file = File(path)
+    session.file.sha256 = sha256
+    session.refresh()
+    __sessions__.sessions = [session]
+    __sessions__.current = session
+
+
+def run_command(command, no_cache):
+    # Returns the tuple (status, events) of the module run on the current
+    # session.
+    root, args = parse_command(command)
+    module = __modules__[root]['obj']()
+    if no_cache:
+        args = args + ['--no-cache']
+    module.set_commandline(args)
+
+    sink = ListSink()
+    status = 'ok'
+    signal.alarm(_worker_timeout or 0)
+    with redirect_output(sink):
+        try:
+            module.execute()
+        except CommandTimeout:
+            status = 'timeout'
+        except Exception:
+            status = 'error'
+            module.log('error', traceback.format_exc())
+        finally:
+            signal.alarm(0)
+
+    events = sink.events
+    if status == 'ok' and any(event['type'] == 'error' for event in events):
+        status = 'error'
+
+    return status, events
+
+
+def process_sample(task):
+    # This runs inside the worker processes. Returns the JSON record of the
+    # results of the commands on the sample.
+    sha256, name, commands, no_cache = task
+    record = dict(sha256=sha256, name=name, commands=commands,
+                  started_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'), results=[])
+
+    start = time.time()
+    # The sample is extracted to a temporary file for the time of the
+    # commands, going through the repository mustn't fill the cache.
+    with sample_file(sha256) as path:
+        if not path:
+            record.update(status='missing', duration=0)
+            return sha256, 'missing', to_json(record)
+
+        open_session(sha256, path)
+
+        failed = False
+        for command in commands:
+            command_start = time.time()
+            status, events = run_command(command, no_cache)
+            failed = failed or status != 'ok'
+            record['results'].append(dict(command=command, status=status, events=events,
+                                          duration=round(time.time() - command_start, 3)))
+
+    status = 'error' if failed else 'ok'
+    record.update(status=status, duration=round(time.time() - start, 3))
+    return sha256, status, to_json(record)
+
+
+def run_batch(samples, commands, handle, jobs=None, timeout=None, no_cache=False):
+    # Run the commands on each of the (sha256, name) samples with a pool of
+    # workers, and write one JSON record per sample to the file handle as
+    # they complete. Yields (sha256, status) for the progress.
+    tasks = [(sha256, name, commands, no_cache) for sha256, name in samples]
+
+    if jobs == 1:
+        set_timeout(timeout)
+        results = (process_sample(task) for task in tasks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(jobs, init_worker, (timeout,), MAX_TASKS_PER_WORKER)
+        # One sample at a time, as the time they take varies widely.
+        results = pool.imap_unordered(process_sample, tasks, chunksize=1)
+
+    try:
+        count = 0
+        for sha256, status, line in results:
+            handle.write(line + '\n')
+            handle.flush()
+
+            count += 1
+            if count % SYNC_INTERVAL == 0:
+                os.fsync(handle.fileno())
+
+            yield sha256, status
+
+        if pool:
+            pool.close()
+    finally:
+        os.fsync(handle.fileno())
+        if pool:
+            pool.terminate()
+            pool.join()
@@ -0,0 +1,292 @@
+# This file is part of Viper - https://github.com/viper-framework/viper
+# See the file 'LICENSE' for copying permission.
+
+import os
+from datetime import datetime
+
+from sqlalchemy import create_engine, event, MetaData, Table, Column, Integer, Float, String, Text, DateTime, Index
+from sqlalchemy import select, exists, and_, func, text
+
+from lib.common.objects import File
+
+# Number of values in a single IN clause.
+LOOKUP_CHUNK_SIZE = 500
+
+metadata = MetaData()
+
+# Every sample stored in any investigation, with the attributes needed to add
+# it to another investigation without reading it again. path, mtime, inode
+# and ctime are those of the last file the sample was imported from.
+catalog_sample = Table(
+    'catalog_sample',
+    metadata,
+    Column('sha256', String(64), primary_key=True),
+    Column('md5', String(32), nullable=False, index=True),
+    Column('sha1', String(40), nullable=False),
+    Column('sha512', String(128), nullable=False),
+    Column('crc32', String(8), nullable=False),
+    Column('ssdeep', String(255)),
+    Column('type', Text()),
+    Column('mime', String(255)),
+    Column('size', Integer(), nullable=False),
+    Column('path', Text(), index=True),
+    Column('mtime', Float()),
+    Column('inode', Integer()),
+    Column('ctime', Float()),
+    Column('first_seen', DateTime(), nullable=False),
+    Column('last_seen', DateTime(), nullable=False)
+)
+
+# Which investigations a sample is stored in, and under which name.
+catalog_entry = Table(
+    'catalog_entry',
+    metadata,
+    Column('sha256', String(64), primary_key=True),
+    Column('investigation', String(255), primary_key=True),
+    Column('name', String(255)),
+    Column('first_seen', DateTime(), nullable=False),
+    Column('last_seen', DateTime(), nullable=False),
+    Index('catalog_entry_investigation', 'investigation')
+)
+
+# The references of the investigations to the samples of the blob store. A
+# blob is deleted once it has none left.
+blob_ref = Table(
+    'blob_ref',
+    metadata,
+    Column('sha256', String(64), primary_key=True),
+    Column('investigation', String(255), primary_key=True),
+    Index('blob_ref_investigation', 'investigation')
+)
+
+# Investigations whose database has been copied into the catalog.
+catalog_investigation = Table(
+    'catalog_investigation',
+    metadata,
+    Column('name', String(255), primary_key=True),
+    Column('synced_at', DateTime(), nullable=False)
+)
+
+
+def set_sqlite_pragma(connection, record):
+    # Every stored file is a small transaction of its own, the write-ahead
+    # log makes them much cheaper.
+    cursor = connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.close()
+
+
+class Catalog(object):
+    # Global index of the samples of all the investigations, each of which
+    # has its own database otherwise.
+    def __init__(self, db_path):
+        folder = os.path.dirname(db_path)
+        if not os.path.exists(folder):
+            os.makedirs(folder, 0o750)
+
+        self.engine = create_engine('sqlite:///' + db_path)
+        event.listen(self.engine, 'connect', set_sqlite_pragma)
+        metadata.create_all(self.engine)
+        self.upgrade()
+
+    def upgrade(self):
+        # Add the columns missing from catalogs created by older versions.
+        with self.engine.begin() as connection:
+            columns = [row[1] for row in connection.execute(text("PRAGMA table_info(catalog_sample)"))]
+            for name, column_type in (('inode', 'INTEGER'), ('ctime', 'FLOAT')):
+                if name not in columns:
+                    connection.execute(text("ALTER TABLE catalog_sample ADD COLUMN {0} {1}".format(name, column_type)))
+
+    def add(self, obj, investigation, now=None):
+        # Record that the File object got stored in the investigation.
+        now = now or datetime.now()
+        path = os.path.abspath(obj.path) if obj.path and os.path.exists(obj.path) else None
+        file_values = dict(path=path, mtime=None, inode=None, ctime=None)
+        if path:
+            stat = os.stat(path)
+            file_values.update(mtime=stat.st_mtime, inode=stat.st_ino, ctime=stat.st_ctime)
+
+        with self.engine.begin() as connection:
+            connection.execute(catalog_sample.insert().prefix_with('OR IGNORE'), dict(
+                sha256=obj.sha256, md5=obj.md5, sha1=obj.sha1, sha512=obj.sha512, crc32=obj.crc32,
+                ssdeep=obj.ssdeep, type=obj.type, mime=obj.mime, size=obj.size, first_seen=now, last_seen=now,
+                **file_values))
+            values = dict(last_seen=now)
+            if path:
+                values.update(file_values)
+            connection.execute(catalog_sample.update().where(catalog_sample.c.sha256 == obj.sha256).values(**values))
+
+            connection.execute(catalog_entry.insert().prefix_with('OR IGNORE'), dict(
+                sha256=obj.sha256, investigation=investigation, name=obj.name, first_seen=now, last_seen=now))
+            connection.execute(catalog_entry.update().where(and_(
+                catalog_entry.c.sha256 == obj.sha256, catalog_entry.c.investigation == investigation
+            )).values(last_seen=now, name=obj.name))
+
+    def remove(self, sha256, investigation):
+        with self.engine.begin() as connection:
+            connection.execute(catalog_entry.delete().where(and_(
+                catalog_entry.c.sha256 == sha256, catalog_entry.c.investigation == investigation)))
+            self.remove_orphans(connection, [sha256])
+
+    def remove_investigation(self, investigation):
+        with self.engine.begin() as connection:
+            hashes = [row[0] for row in connection.execute(select([catalog_entry.c.sha256]).where(
+                catalog_entry.c.investigation == investigation))]
+            connection.execute(catalog_entry.delete().where(catalog_entry.c.investigation == investigation))
+            connection.execute(catalog_investigation.delete().where(catalog_investigation.c.name == investigation))
+            self.remove_orphans(connection, hashes)
+
+    def remove_orphans(self, connection, hashes):
+        # Forget the samples which aren't stored in any investigation anymore.
+        for start in range(0, len(hashes), LOOKUP_CHUNK_SIZE):
+            chunk = hashes[start:start + LOOKUP_CHUNK_SIZE]
+            used = exists().where(catalog_entry.c.sha256 == catalog_sample.c.sha256)
+            connection.execute(catalog_sample.delete().where(and_(
+                catalog_sample.c.sha256.in_(chunk), ~used)))
+
+    def add_refs(self, refs):
+        # refs is a list of (sha256, investigation) tuples.
+        if not refs:
+            return
+
+        with self.engine.begin() as connection:
+            for start in range(0, len(refs), LOOKUP_CHUNK_SIZE):
+                connection.execute(blob_ref.insert().prefix_with('OR IGNORE'), [
+                    dict(sha256=sha256, investigation=investigation)
+                    for sha256, investigation in refs[start:start + LOOKUP_CHUNK_SIZE]
+                ])
+
+    def has_ref(self, sha256, investigation):
+        with self.engine.connect() as connection:
+            return connection.execute(select([blob_ref.c.sha256]).where(and_(
+                blob_ref.c.sha256 == sha256, blob_ref.c.investigation == investigation))).first() is not None
+
+    def count_refs(self, sha256):
+        with self.engine.connect() as connection:
+            return connection.execute(select([func.count()]).where(blob_ref.c.sha256 == sha256)).scalar()
+
+    def remove_ref(self, sha256, investigation):
+        # Returns the number of references left to the sample.
+        with self.engine.begin() as connection:
+            connection.execute(blob_ref.delete().where(and_(
+                blob_ref.c.sha256 == sha256, blob_ref.c.investigation == investigation)))
+            return connection.execute(select([func.count()]).where(blob_ref.c.sha256 == sha256)).scalar()
+
+    def remove_refs(self, investigation):
+        # Drop all the references of the investigation. Returns the samples
+        # which have none left.
+        with self.engine.begin() as connection:
+            hashes = [row[0] for row in connection.execute(select([blob_ref.c.sha256]).where(
+                blob_ref.c.investigation == investigation))]
+            connection.execute(blob_ref.delete().where(blob_ref.c.investigation == investigation))
+
+            orphans = []
+            for start in range(0, len(hashes), LOOKUP_CHUNK_SIZE):
+                chunk = hashes[start:start + LOOKUP_CHUNK_SIZE]
+                used = set(row[0] for row in connection.execute(select([blob_ref.c.sha256]).where(
+                    blob_ref.c.sha256.in_(chunk))))
+                orphans.extend(sha256 for sha256 in chunk if sha256 not in used)
+
+        return orphans
+
+    def lookup(self, sha256):
+        # Returns the entries of the investigations storing the sample.
+        with self.engine.connect() as connection:
+            return connection.execute(select([catalog_entry]).where(
+                catalog_entry.c.sha256 == sha256).order_by(catalog_entry.c.first_seen)).fetchall()
+
+    def find(self, key, value=None):
+        # Returns the entries matching the search, along with the attributes
+        # of their sample.
+        query = select([catalog_entry, catalog_sample.c.md5, catalog_sample.c.size, catalog_sample.c.mime]).select_from(
+            catalog_entry.join(catalog_sample, catalog_entry.c.sha256 == catalog_sample.c.sha256))
+
+        if key == 'sha256':
+            query = query.where(catalog_entry.c.sha256 == value)
+        elif key == 'md5':
+            query = query.where(catalog_sample.c.md5 == value)
+        elif key == 'name':
+            if '*' in value:
+                value = value.replace('*', '%')
+            else:
+                value = '%{0}%'.format(value)
+            query = query.where(catalog_entry.c.name.like(value))
+        elif key != 'all':
+            return None
+
+        with self.engine.connect() as connection:
+            return connection.execute(query.order_by(catalog_entry.c.sha256, catalog_entry.c.first_seen)).fetchall()
+
+    def get_known_files(self, paths):
+        # Returns a dict of File objects for the given paths whose content is
+        # already in the catalog, i.e. files imported before and unchanged
+        # since. Their attributes come from the catalog, without reading
+        # them. A file is only trusted if it's still the same inode, and its
+        # ctime tells it wasn't written to since, which a restored mtime
+        # can't fake.
+        stats = {}
+        for path in paths:
+            path = os.path.abspath(path)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            stats[path] = stat
+
+        known = {}
+        keys = list(stats)
+        with self.engine.connect() as connection:
+            for start in range(0, len(keys), LOOKUP_CHUNK_SIZE):
+                rows = connection.execute(select([catalog_sample]).where(
+                    catalog_sample.c.path.in_(keys[start:start + LOOKUP_CHUNK_SIZE])))
+                for row in rows:
+                    stat = stats[row.path]
+                    if row.inode is None or row.ctime is None:
+                        continue
+                    if (row.size, row.mtime, row.inode, row.ctime) != \
+                            (stat.st_size, stat.st_mtime, stat.st_ino, stat.st_ctime):
+                        continue
+
+                    obj = File(row.path)
+                    for name in ('sha256', 'md5', 'sha1', 'sha512', 'crc32', 'ssdeep', 'type', 'mime'):
+                        setattr(obj, name, getattr(row, name))
+                    known[row.path] = obj
+
+        return known
+
+    def is_synced(self, investigation):
+        with self.engine.connect() as connection:
+            return connection.execute(select([catalog_investigation.c.name]).where(
+                catalog_investigation.c.name == investigation)).first() is not None
+
+    def sync(self, investigation, samples):
+        # Copy the samples of an investigation database into the catalog, for
+        # the ones stored before it existed.
+        def insert(connection, samples, entries):
+            if samples:
+                connection.execute(catalog_sample.insert().prefix_with('OR IGNORE'), samples)
+                connection.execute(catalog_entry.insert().prefix_with('OR IGNORE'), entries)
+
+        with self.engine.begin() as connection:
+            samples_rows = []
+            entries_rows = []
+            for sample in samples:
+                samples_rows.append(dict(
+                    sha256=sample.sha256, md5=sample.md5, sha1=sample.sha1, sha512=sample.sha512,
+                    crc32=sample.crc32, ssdeep=sample.ssdeep, type=sample.type, mime=sample.mime,
+                    size=sample.size, path=None, mtime=None, first_seen=sample.created_at,
+                    last_seen=sample.created_at))
+                entries_rows.append(dict(
+                    sha256=sample.sha256, investigation=investigation, name=sample.name,
+                    first_seen=sample.created_at, last_seen=sample.created_at))
+
+                if len(samples_rows) >= LOOKUP_CHUNK_SIZE:
+                    insert(connection, samples_rows, entries_rows)
+                    samples_rows = []
+                    entries_rows = []
+
+            insert(connection, samples_rows, entries_rows)
+
+            connection.execute(catalog_investigation.insert().prefix_with('OR IGNORE'), dict(
+                name=investigation, synced_at=datetime.now()))
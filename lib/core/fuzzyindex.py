@@ -0,0 +1,116 @@
+# This file is part of Viper - https://github.com/viper-framework/viper
+# See the file 'LICENSE' for copying permission.
+
+import re
+
+try:
+    import pydeep
+    HAVE_PYDEEP = True
+except ImportError:
+    HAVE_PYDEEP = False
+
+# Two ssdeep hashes only get a score above zero when their chunks have a
+# common substring of this length, so it's enough to compare the hashes
+# sharing one of these n-grams.
+NGRAM_SIZE = 7
+# Default minimum score for two samples to be considered similar.
+THRESHOLD = 40
+
+# ssdeep removes the sequences of more than three identical characters before
+# comparing the chunks, we need to do the same.
+_repeats = re.compile(r'(.)\1{3,}')
+
+
+def get_ngrams(ssdeep):
+    # Returns the set of (block size, n-gram) of a ssdeep hash. The double
+    # chunk is indexed with twice the block size, so that hashes with half or
+    # twice the block size of this one also share entries with it.
+    try:
+        block_size, chunk, double_chunk = ssdeep.split(':', 2)
+        block_size = int(block_size)
+    except (AttributeError, ValueError):
+        return set()
+
+    # Drop the file name that ssdeep might have appended.
+    double_chunk = double_chunk.split(',')[0]
+
+    ngrams = set()
+    for size, value in ((block_size, chunk), (block_size * 2, double_chunk)):
+        value = _repeats.sub(r'\1\1\1', value)
+        for i in range(len(value) - NGRAM_SIZE + 1):
+            ngrams.add((size, value[i:i + NGRAM_SIZE]))
+
+    return ngrams
+
+
+def index_ssdeep(db, sha256, ssdeep):
+    if not ssdeep:
+        return False
+
+    return db.add_ssdeep_chunks(sha256, get_ngrams(ssdeep))
+
+
+def update_index(db):
+    # Backfill the samples stored before the index existed. Returns the number
+    # of processed samples.
+    count = 0
+    for sample in db.get_unindexed_ssdeep_samples():
+        if index_ssdeep(db, sample.sha256, sample.ssdeep):
+            count += 1
+
+    return count
+
+
+def similar(db, ssdeep, count=10, threshold=THRESHOLD, exclude=None):
+    # Returns up to count (score, Malware) tuples for the stored samples most
+    # similar to the given ssdeep hash, best first. The sample with the
+    # sha256 given as exclude (usually the one hashed) is skipped.
+    results = []
+    for sample in db.get_ssdeep_candidates(get_ngrams(ssdeep), exclude=exclude):
+        score = pydeep.compare(ssdeep, sample.ssdeep)
+        if score > threshold:
+            results.append((score, sample))
+
+    results.sort(key=lambda result: result[0], reverse=True)
+    if count:
+        results = results[:count]
+
+    return results
+
+
+def cluster(db, threshold=THRESHOLD):
+    # Group the stored samples whose ssdeep score is above the threshold,
+    # only comparing the pairs that share an n-gram. A sample joins a cluster
+    # as soon as it's similar to any of its members.
+    samples = dict((sample[0], sample) for sample in db.get_ssdeep_samples())
+
+    parents = {}
+
+    def find(sha256):
+        parents.setdefault(sha256, sha256)
+        while parents[sha256] != sha256:
+            parents[sha256] = parents[parents[sha256]]
+            sha256 = parents[sha256]
+        return sha256
+
+    for first, second in db.get_ssdeep_candidate_pairs():
+        if first not in samples or second not in samples:
+            continue
+
+        first_root = find(first)
+        second_root = find(second)
+        # No need to compare samples which are already in the same cluster.
+        if first_root == second_root:
+            continue
+
+        if pydeep.compare(samples[first][3], samples[second][3]) > threshold:
+            parents[second_root] = first_root
+
+    clusters = {}
+    for sha256 in list(parents):
+        clusters.setdefault(find(sha256), []).append(samples[sha256])
+
+    # Returns the lists of (sha256, md5, name, ssdeep) of the clusters with
+    # more than one member, the largest first.
+    results = [sorted(members, key=lambda member: member[2]) for members in clusters.values() if len(members) > 1]
+    return sorted(results, key=len, reverse=True)
@@ -0,0 +1,62 @@
+# This file is part of Viper - https://github.com/viper-framework/viper
+# See the file 'LICENSE' for copying permission.
+
+import multiprocessing
+
+from lib.common.objects import File
+from lib.core.peindex import HAVE_PEFILE, extract_pe_features
+
+# Number of files committed to the database in a single transaction.
+BATCH_SIZE = 500
+
+
+def process_file(path):
+    # This runs inside the worker processes: it does all the expensive work
+    # (hashing, magic, ssdeep and PE parsing) so that the main process only
+    # has to write the results.
+    try:
+        obj = File(path)
+        obj.compute()
+    except Exception:
+        return None
+
+    pe_features = None
+    if HAVE_PEFILE:
+        try:
+            pe_features = extract_pe_features(path)
+        except Exception:
+            pass
+
+    return obj, pe_features
+
+
+def process_files(paths, jobs=None):
+    # Yield (File, pe_features) tuples in completion order.
+    if jobs == 1:
+        for path in paths:
+            result = process_file(path)
+            if result:
+                yield result
+        return
+
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for result in pool.imap_unordered(process_file, paths, chunksize=8):
+            if result:
+                yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def batches(iterable, size=BATCH_SIZE):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
@@ -0,0 +1,157 @@
+# This file is part of Viper - https://github.com/viper-framework/viper
+# See the file 'LICENSE' for copying permission.
+
+import os
+import sys
+import time
+import errno
+import signal
+import shutil
+import tempfile
+import multiprocessing
+from datetime import datetime
+
+# Seconds given to a killed job to exit before it's killed for good.
+KILL_TIMEOUT = 5
+
+
+def run_job(command, output_path):
+    # This runs in the job process, forked from the console. The process
+    # starts its own group, so that Ctrl-C in the console doesn't reach it
+    # and kill() also gets the workers it might start.
+    os.setpgrp()
+
+    # Everything written by the command, including its subprocesses, goes
+    # to the output file of the job.
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    handle = os.open(output_path, os.O_WRONLY | os.O_APPEND)
+    os.dup2(handle, 1)
+    os.dup2(handle, 2)
+    sys.stdout = os.fdopen(1, 'w', 0)
+    sys.stderr = os.fdopen(2, 'w', 0)
+
+    # The job gets a copy of the sessions and investigation of the console
+    # at the time it's started. The database connections of the console
+    # aren't shared, as the engines are per process.
+    from lib.core.ui.console import Console
+    Console().execute(command)
+
+
+class Job(object):
+    def __init__(self, job_id, command, process, output_path):
+        self.id = job_id
+        self.command = command
+        self.process = process
+        self.output_path = output_path
+        self.started_at = datetime.now()
+        self.ended_at = None
+        self.killed = False
+        # Whether the console has reported the end of the job.
+        self.notified = False
+
+    def is_running(self):
+        if self.ended_at:
+            return False
+
+        if self.process.is_alive():
+            return True
+
+        self.ended_at = datetime.now()
+        return False
+
+    def get_status(self):
+        if self.is_running():
+            return 'running'
+        elif self.killed:
+            return 'killed'
+        elif self.process.exitcode:
+            return 'failed ({0})'.format(self.process.exitcode)
+        return 'done'
+
+    def get_duration(self):
+        end = self.ended_at or datetime.now()
+        return int((end - self.started_at).total_seconds())
+
+    def iter_output(self):
+        with open(self.output_path, 'rb') as handle:
+            for line in handle:
+                yield line
+
+
+class Jobs(object):
+    # Commands running in the background while the console is in use.
+    def __init__(self):
+        self.jobs = []
+        self.last_id = 0
+        # Output files of the jobs, created on the first one.
+        self.path = None
+
+    def run(self, command):
+        if not self.path:
+            self.path = tempfile.mkdtemp(prefix='cirtkit-jobs-')
+
+        self.last_id += 1
+        output_path = os.path.join(self.path, '{0}.log'.format(self.last_id))
+        open(output_path, 'wb').close()
+
+        process = multiprocessing.Process(target=run_job, args=(command, output_path))
+        process.start()
+
+        job = Job(self.last_id, command, process, output_path)
+        self.jobs.append(job)
+        return job
+
+    def get(self, job_id):
+        for job in self.jobs:
+            if job.id == job_id:
+                return job
+        return None
+
+    def get_running(self):
+        return [job for job in self.jobs if job.is_running()]
+
+    def get_finished(self):
+        # Returns the jobs which ended since the last call.
+        finished = []
+        for job in self.jobs:
+            if not job.notified and not job.is_running():
+                job.notified = True
+                finished.append(job)
+        return finished
+
+    def wait(self, jobs):
+        while any(job.is_running() for job in jobs):
+            time.sleep(0.2)
+
+    def kill(self, job):
+        if not job.is_running():
+            return False
+
+        job.killed = True
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            try:
+                os.killpg(job.process.pid, sig)
+            except OSError as e:
+                # The job might not have started its group yet.
+                if e.errno != errno.ESRCH:
+                    raise
+                job.process.terminate()
+
+            job.process.join(KILL_TIMEOUT)
+            if not job.is_running():
+                break
+
+        return True
+
+    def close(self):
+        # Kill the jobs still running and remove their output.
+        for job in self.get_running():
+            self.kill(job)
+
+        if self.path:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.path = None
+
+
+__jobs__ = Jobs()
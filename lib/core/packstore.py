@@ -0,0 +1,190 @@
+# This file is part of Viper - https://github.com/viper-framework/viper
+# See the file 'LICENSE' for copying permission.
+
+import os
+import mmap
+import fcntl
+
+from sqlalchemy import create_engine, MetaData, Table, Column, Integer, BigInteger, String, Index, select, func
+
+# Samples up to this size go to the pack files when they are enabled.
+PACK_THRESHOLD = 1024 * 1024
+# A new segment is started once the current one grows above this size.
+SEGMENT_SIZE = 256 * 1024 * 1024
+# Segments with less than this ratio of live data get compacted.
+COMPACT_RATIO = 0.5
+
+metadata = MetaData()
+
+# Where each member is in the segments. The index is kept in its own SQLite
+# file, as the packs are shared by all the investigations.
+pack_member = Table(
+    'pack_member',
+    metadata,
+    Column('sha256', String(64), primary_key=True),
+    Column('segment', Integer(), nullable=False),
+    Column('offset', BigInteger(), nullable=False),
+    Column('length', Integer(), nullable=False),
+    Column('codec', String(4), nullable=False),
+    Index('pack_member_segment', 'segment')
+)
+
+
+class MemberReader(object):
+    # File-like object over the mapped bytes of a single member.
+    def __init__(self, data, offset, length):
+        self.data = data
+        self.position = offset
+        self.end = offset + length
+
+    def read(self, size=-1):
+        if size < 0 or self.position + size > self.end:
+            size = self.end - self.position
+
+        data = self.data[self.position:self.position + size]
+        self.position += size
+        return data
+
+    def close(self):
+        pass
+
+
+class PackStore(object):
+    # Append-only segment files, storage/packs/<number>.pack, holding many
+    # small compressed samples each. Deleted members are only dropped from
+    # the index, their space is reclaimed by compact().
+    def __init__(self, path):
+        self.path = path
+        self.engine = create_engine('sqlite:///' + os.path.join(path, 'index.db'))
+        metadata.create_all(self.engine)
+        # Mapped segments, by number.
+        self.maps = {}
+
+    def get_segment_path(self, segment):
+        return os.path.join(self.path, '{0}.pack'.format(segment))
+
+    def get_segments(self):
+        segments = []
+        for name in os.listdir(self.path):
+            if name.endswith('.pack'):
+                segments.append(int(name[:-5]))
+        return sorted(segments)
+
+    def get_member(self, sha256):
+        with self.engine.connect() as connection:
+            return connection.execute(select([pack_member]).where(pack_member.c.sha256 == sha256)).first()
+
+    def exists(self, sha256):
+        return self.get_member(sha256) is not None
+
+    def append(self, data):
+        # Append the data to the last segment and return a tuple (segment,
+        # offset). The segment is locked, so that concurrent processes don't
+        # interleave their writes.
+        segments = self.get_segments()
+        segment = segments[-1] if segments else 0
+        if os.path.exists(self.get_segment_path(segment)) and \
+                os.path.getsize(self.get_segment_path(segment)) >= SEGMENT_SIZE:
+            segment += 1
+
+        with open(self.get_segment_path(segment), 'ab') as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                handle.seek(0, os.SEEK_END)
+                offset = handle.tell()
+                handle.write(data)
+                handle.flush()
+                os.fsync(handle.fileno())
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+        return segment, offset
+
+    def put(self, sha256, data, codec):
+        # Store the already compressed data of a sample.
+        if self.exists(sha256):
+            return
+
+        segment, offset = self.append(data)
+        with self.engine.begin() as connection:
+            connection.execute(pack_member.insert().prefix_with('OR IGNORE'), dict(
+                sha256=sha256, segment=segment, offset=offset, length=len(data), codec=codec))
+
+    def get_map(self, segment, end):
+        # Map the segment, again if it has grown past the end of the mapping.
+        data = self.maps.get(segment)
+        if data is None or len(data) < end:
+            if data is not None:
+                data.close()
+            with open(self.get_segment_path(segment), 'rb') as handle:
+                data = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[segment] = data
+        return data
+
+    def open(self, sha256):
+        # Returns a tuple (reader, codec) for the member, or None. Reads go
+        # straight to the mapped segment, without seeking through a file.
+        member = self.get_member(sha256)
+        if not member:
+            return None
+
+        data = self.get_map(member.segment, member.offset + member.length)
+        return MemberReader(data, member.offset, member.length), member.codec
+
+    def delete(self, sha256):
+        with self.engine.begin() as connection:
+            connection.execute(pack_member.delete().where(pack_member.c.sha256 == sha256))
+
+    def close_map(self, segment):
+        data = self.maps.pop(segment, None)
+        if data is not None:
+            data.close()
+
+    def get_usage(self):
+        # Returns a dict of the number of live bytes of each segment.
+        with self.engine.connect() as connection:
+            rows = connection.execute(select([pack_member.c.segment, func.sum(pack_member.c.length)]).group_by(
+                pack_member.c.segment))
+            return dict((segment, live) for segment, live in rows)
+
+    def get_stats(self):
+        # Returns a tuple (segments, members, size, live bytes).
+        with self.engine.connect() as connection:
+            members, live = connection.execute(select([func.count(), func.sum(pack_member.c.length)])).first()
+
+        segments = self.get_segments()
+        size = sum(os.path.getsize(self.get_segment_path(segment)) for segment in segments)
+        return len(segments), members, size, live or 0
+
+    def compact(self, ratio=COMPACT_RATIO):
+        # Copy the live members of the sealed segments which are mostly
+        # garbage to the last segment, then delete them. Returns the number
+        # of reclaimed bytes.
+        segments = self.get_segments()
+        if not segments:
+            return 0
+
+        usage = self.get_usage()
+        reclaimed = 0
+        # The last segment is still being written to.
+        for segment in segments[:-1]:
+            segment_path = self.get_segment_path(segment)
+            size = os.path.getsize(segment_path)
+            live = usage.get(segment, 0)
+            if size and float(live) / size >= ratio:
+                continue
+
+            with self.engine.begin() as connection:
+                members = connection.execute(select([pack_member]).where(pack_member.c.segment == segment)).fetchall()
+                for member in members:
+                    reader = MemberReader(self.get_map(segment, member.offset + member.length),
+                                          member.offset, member.length)
+                    new_segment, offset = self.append(reader.read())
+                    connection.execute(pack_member.update().where(pack_member.c.sha256 == member.sha256).values(
+                        segment=new_segment, offset=offset))
+
+            self.close_map(segment)
+            os.remove(segment_path)
+            reclaimed += size - live
+
+        return reclaimed
@@ -0,0 +1,135 @@
+# This file is part of Viper - https://github.com/viper-framework/viper
+# See the file 'LICENSE' for copying permission.
+
+import os
+import json
+import hashlib
+
+try:
+    import pefile
+    import peutils
+    HAVE_PEFILE = True
+except ImportError:
+    HAVE_PEFILE = False
+
+try:
+    from modules.reversing.viper.pehash.pehasher import calculate_pehash
+    HAVE_PEHASH = True
+except ImportError:
+    HAVE_PEHASH = False
+
+from lib.common.constants import CIRTKIT_ROOT
+from lib.core.storage import sample_file
+
+# PEiD signatures are expensive to parse, so we only load them once.
+_signatures = None
+
+
+def get_peid_signatures():
+    global _signatures
+    if _signatures is None:
+        with open(os.path.join(CIRTKIT_ROOT, 'data/peid/UserDB.TXT'), 'rt') as f:
+            _signatures = peutils.SignatureDatabase(data=f.read())
+
+    return _signatures
+
+
+def get_certificate(pe):
+    # TODO: this only extract the raw list of certificate data.
+    # I need to parse them, extract single certificates and perhaps return
+    # the PEM data of the first certificate only.
+    pe_security_dir = pefile.DIRECTORY_ENTRY['IMAGE_DIRECTORY_ENTRY_SECURITY']
+    address = pe.OPTIONAL_HEADER.DATA_DIRECTORY[pe_security_dir].VirtualAddress
+
+    if address:
+        return pe.write()[address + 8:]
+    else:
+        return None
+
+
+def get_peid_matches(pe):
+    matches = get_peid_signatures().match_all(pe, ep_only=True)
+    if not matches:
+        return []
+
+    return [match[0] if type(match) is list else match for match in matches]
+
+
+def extract_pe_features(path):
+    # Returns the dict of features stored in the PEFeature table. Files that
+    # can't be parsed are marked as not valid, so that they don't get parsed
+    # again by every following scan.
+    features = dict(valid=False)
+
+    try:
+        pe = pefile.PE(path)
+    except Exception:
+        return features
+
+    features['valid'] = True
+    features['entrypoint'] = pe.OPTIONAL_HEADER.AddressOfEntryPoint
+    features['compiletime'] = pe.FILE_HEADER.TimeDateStamp
+
+    try:
+        features['imphash'] = pe.get_imphash() or None
+    except Exception:
+        pass
+
+    features['sections'] = json.dumps([
+        [section.Name.strip('\x00'), section.VirtualAddress, section.Misc_VirtualSize, section.SizeOfRawData]
+        for section in pe.sections
+    ])
+
+    try:
+        cert_data = get_certificate(pe)
+    except Exception:
+        cert_data = None
+
+    if cert_data:
+        features['cert_md5'] = hashlib.md5(cert_data).hexdigest()
+
+    try:
+        peid_matches = get_peid_matches(pe)
+    except Exception:
+        peid_matches = []
+
+    if peid_matches:
+        features['peid'] = json.dumps(peid_matches)
+
+    if HAVE_PEHASH:
+        pe_hash = calculate_pehash(path)
+        if pe_hash and not pe_hash.startswith('ERROR'):
+            features['pehash'] = pe_hash
+
+    return features
+
+
+def index_sample(db, sha256, path=None):
+    if not HAVE_PEFILE:
+        return False
+
+    if path is None:
+        # Called for many samples, each is extracted to a temporary file
+        # rather than to the cache.
+        with sample_file(sha256) as path:
+            if not path:
+                return False
+            features = extract_pe_features(path)
+    else:
+        features = extract_pe_features(path)
+
+    return db.add_pe_features(sha256, features)
+
+
+def update_index(db):
+    # Backfill the features of all the stored samples that haven't been
+    # indexed yet. Returns the number of processed samples.
+    if not HAVE_PEFILE:
+        return 0
+
+    count = 0
+    for sample in db.get_unindexed_pe_samples():
+        if index_sample(db, sample.sha256):
+            count += 1
+
+    return count
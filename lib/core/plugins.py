@@ -1,77 +1,160 @@
 # This file is part of Viper - https://github.com/viper-framework/viper
 # See the file 'LICENSE' for copying permission.
 
-import pkgutil
+import os
+import json
+import hashlib
 import inspect
+import importlib
 
 from lib.common.out import print_warning
-from lib.common.abstracts import Module, Integration
-
-
-def load_modules():
-    # Import modules package.
-    import modules
-
-    moduleDict = dict()
-    integrationDict = dict()
-
-    # Walk recursively through all modules and packages.
-    for loader, module_name, ispkg in pkgutil.walk_packages(modules.__path__, modules.__name__ + '.'):
-        # If current item is a package, skip.
-        if ispkg:
-            pass
-        else:
-            # Try to import the module, otherwise skip.
-            try:
-                module = __import__(module_name, globals(), locals(), ['dummy'], -1)
-            except ImportError as e:
-                print_warning("Something wrong happened while importing the module {0}: {1}".format(module_name, e))
+from lib.common.abstracts import Module, Integration, Script
+from lib.common.constants import CIRTKIT_ROOT
+
+# The commands provided by every plugin file are kept in a manifest, along
+# with the modification time of the file, so that only new or changed files
+# have to be imported to discover them. There's one manifest per checkout.
+MANIFEST_PATH = os.path.join(os.path.expanduser('~/.cirtkit'), 'plugins-{0}.json'.format(
+    hashlib.sha1(CIRTKIT_ROOT.encode('utf-8')).hexdigest()[:12]))
+# Version 1 manifests also recorded the files which failed to import.
+MANIFEST_VERSION = 2
+
+
+class Plugin(dict):
+    # Entry of the registry. Like before it has the 'obj' and 'description'
+    # keys, but the class is only imported when 'obj' is first accessed.
+    def __init__(self, module_name, class_name, description):
+        super(Plugin, self).__init__(description=description)
+        self.module_name = module_name
+        self.class_name = class_name
+
+    def __getitem__(self, key):
+        if key == 'obj' and not dict.__contains__(self, 'obj'):
+            module = importlib.import_module(self.module_name)
+            self['obj'] = getattr(module, self.class_name)
+
+        return dict.__getitem__(self, key)
+
+
+def load_manifest():
+    try:
+        with open(MANIFEST_PATH, 'r') as handle:
+            manifest = json.load(handle)
+    except (IOError, ValueError):
+        return {}
+
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return manifest
+
+
+def save_manifest(manifest):
+    manifest['version'] = MANIFEST_VERSION
+    try:
+        folder = os.path.dirname(MANIFEST_PATH)
+        if not os.path.exists(folder):
+            os.makedirs(folder, 0o700)
+
+        # Through a temporary file, so that a concurrent start never reads a
+        # partial manifest.
+        tmp_path = '{0}.{1}.tmp'.format(MANIFEST_PATH, os.getpid())
+        with open(tmp_path, 'w') as handle:
+            json.dump(manifest, handle)
+        os.rename(tmp_path, MANIFEST_PATH)
+    except (IOError, OSError):
+        pass
+
+
+def get_package_files(package_name):
+    # Returns a dict of the modification times of the python files of the
+    # package, by module name. Like pkgutil.walk_packages(), only folders
+    # with an __init__.py are packages, but nothing gets imported.
+    files = {}
+    package_path = os.path.join(CIRTKIT_ROOT, package_name)
+    for folder, folders, file_names in os.walk(package_path):
+        if '__init__.py' not in file_names:
+            # Don't descend into folders which aren't packages.
+            del folders[:]
+            continue
+
+        prefix = os.path.relpath(folder, CIRTKIT_ROOT).replace(os.sep, '.')
+        for file_name in file_names:
+            if not file_name.endswith('.py') or file_name == '__init__.py':
                 continue
 
-            # Walk through all members of currently imported modules.
-            for member_name, member_object in inspect.getmembers(module):
-                # Check if current member is a class.
-                if inspect.isclass(member_object):
-                    # Yield the class if it's a subclass of Module.
-                    if issubclass(member_object, Module) and member_object is not Module:
-                        moduleDict[member_object.cmd] = dict(obj=member_object, description=member_object.description)
-                    
-    return moduleDict
-
-
-def load_integrations():
-    import integrations
-
-    integrationDict = {}
-    # Walk recursively through all modules and packages.
-    for loader, integration_name, ispkg in pkgutil.walk_packages(integrations.__path__, integrations.__name__ + '.'):
-        # If current item is a package, skip.
-        if ispkg:
-            pass
-        else:
-            # Try to import the module, otherwise skip.
-            try:
-                module = __import__(integration_name, globals(), locals(), ['dummy'], -1)
-            except ImportError as e:
-                print_warning("Error occurred while loading the integration {0}: {1}".format(integration_name, e))
+            files['{0}.{1}'.format(prefix, file_name[:-3])] = os.path.getmtime(os.path.join(folder, file_name))
+
+    return files
+
+
+def inspect_module(module_name, base_class, warning):
+    # Import the module and returns the list of [cmd, description, module,
+    # class] of the plugins it contains, or None if it can't be imported.
+    try:
+        module = importlib.import_module(module_name)
+    except ImportError as e:
+        print_warning(warning.format(module_name, e))
+        return None
+
+    plugins = []
+    # Walk through all members of currently imported modules.
+    for member_name, member_object in inspect.getmembers(module):
+        # Check if current member is a class.
+        if inspect.isclass(member_object):
+            # Keep the class if it's a subclass of the base class.
+            if issubclass(member_object, base_class) and member_object is not base_class:
+                plugins.append([member_object.cmd, member_object.description,
+                                member_object.__module__, member_object.__name__])
+
+    return plugins
+
+
+def load_plugins(package_name, base_class, warning, refresh=False):
+    # Returns the dict of the plugins of the package, by command. Only the
+    # files changed since the manifest was written are imported, or all of
+    # them if refresh is set.
+    manifest = load_manifest()
+    known = {} if refresh else manifest.get(package_name, {})
+
+    entries = {}
+    changed = refresh or package_name not in manifest
+    for module_name, mtime in sorted(get_package_files(package_name).items()):
+        entry = known.get(module_name)
+        if entry is None or entry['mtime'] != mtime:
+            plugins = inspect_module(module_name, base_class, warning)
+            # Files which can't be imported, usually for a missing
+            # dependency, are left out of the manifest. They are tried again,
+            # and reported, on every start.
+            if plugins is None:
                 continue
 
-            # Walk through all members of currently imported modules.
-            for member_name, member_object in inspect.getmembers(module):
-                # Check if current member is a class.
-                if inspect.isclass(member_object):
-                    # Yield the class if it's a subclass of Module.
-                    if issubclass(member_object, Integration) and member_object is not Integration:
-                        integrationDict[member_object.cmd] = dict(obj=member_object, description=member_object.description)
+            entry = dict(mtime=mtime, plugins=plugins)
+            changed = True
+        entries[module_name] = entry
 
-    return integrationDict
+    # Files might have been removed as well.
+    if changed or len(entries) != len(known):
+        manifest[package_name] = entries
+        save_manifest(manifest)
 
+    plugins = {}
+    for module_name in sorted(entries):
+        for cmd, description, plugin_module, class_name in entries[module_name]['plugins']:
+            plugins[cmd] = Plugin(plugin_module, class_name, description)
 
-def load_scripts():
-    import scripts
-    scriptDict = dict()
+    return plugins
 
-    return scriptDict
+
+def load_modules(refresh=False):
+    return load_plugins('modules', Module, "Something wrong happened while importing the module {0}: {1}", refresh)
+
+
+def load_integrations(refresh=False):
+    return load_plugins('integrations', Integration, "Error occurred while loading the integration {0}: {1}", refresh)
+
+
+def load_scripts(refresh=False):
+    return load_plugins('scripts', Script, "Error occurred while loading the script {0}: {1}", refresh)
 
 
 __modules__ = load_modules()
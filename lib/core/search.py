@@ -0,0 +1,150 @@
+# This file is part of Viper - https://github.com/viper-framework/viper
+# See the file 'LICENSE' for copying permission.
+
+from sqlalchemy import MetaData, Table, Column, Integer, Text, text
+from sqlalchemy.exc import SQLAlchemyError
+
+# Search terms shorter than this can't use the trigram indexes.
+MIN_TERM_SIZE = 3
+
+# The SQLite full-text tables are created by hand rather than by create_all(),
+# so they are described in their own metadata.
+metadata = MetaData()
+
+malware_search = Table(
+    'malware_search',
+    metadata,
+    Column('rowid', Integer()),
+    Column('name', Text()),
+    Column('type', Text()),
+    Column('mime', Text()),
+    Column('tags', Text())
+)
+
+note_search = Table(
+    'note_search',
+    metadata,
+    Column('rowid', Integer()),
+    Column('title', Text()),
+    Column('body', Text())
+)
+
+SQLITE_TAGS = ("(SELECT group_concat(tag.tag, ' ') FROM tag JOIN association ON association.tag_id = tag.id "
+               "WHERE association.malware_id = {0})")
+
+# The trigram tokenizer makes LIKE '%value%' queries use the index, so the
+# find command keeps its substring semantics.
+SQLITE_SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS malware_search USING fts5(name, type, mime, tags, tokenize='trigram')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS note_search USING fts5(title, body, tokenize='trigram')",
+    # Keep the full-text tables in sync with the samples, their tags and the
+    # notes.
+    "CREATE TRIGGER IF NOT EXISTS malware_search_insert AFTER INSERT ON malware BEGIN "
+    "INSERT INTO malware_search(rowid, name, type, mime, tags) VALUES (new.id, new.name, new.type, new.mime, ''); END",
+    "CREATE TRIGGER IF NOT EXISTS malware_search_update AFTER UPDATE OF name, type, mime ON malware BEGIN "
+    "UPDATE malware_search SET name = new.name, type = new.type, mime = new.mime WHERE rowid = new.id; END",
+    "CREATE TRIGGER IF NOT EXISTS malware_search_delete AFTER DELETE ON malware BEGIN "
+    "DELETE FROM malware_search WHERE rowid = old.id; END",
+    "CREATE TRIGGER IF NOT EXISTS malware_search_tag_insert AFTER INSERT ON association BEGIN "
+    "UPDATE malware_search SET tags = " + SQLITE_TAGS.format('new.malware_id') + " WHERE rowid = new.malware_id; END",
+    "CREATE TRIGGER IF NOT EXISTS malware_search_tag_delete AFTER DELETE ON association BEGIN "
+    "UPDATE malware_search SET tags = " + SQLITE_TAGS.format('old.malware_id') + " WHERE rowid = old.malware_id; END",
+    "CREATE TRIGGER IF NOT EXISTS note_search_insert AFTER INSERT ON note BEGIN "
+    "INSERT INTO note_search(rowid, title, body) VALUES (new.id, new.title, new.body); END",
+    "CREATE TRIGGER IF NOT EXISTS note_search_update AFTER UPDATE OF title, body ON note BEGIN "
+    "UPDATE note_search SET title = new.title, body = new.body WHERE rowid = new.id; END",
+    "CREATE TRIGGER IF NOT EXISTS note_search_delete AFTER DELETE ON note BEGIN "
+    "DELETE FROM note_search WHERE rowid = old.id; END",
+]
+
+# Creating a temporary table tells whether this SQLite has FTS5 with the
+# trigram tokenizer (3.34 and later).
+SQLITE_PROBE = [
+    "CREATE VIRTUAL TABLE temp.search_probe USING fts5(value, tokenize='trigram')",
+    "DROP TABLE temp.search_probe",
+]
+
+SQLITE_TRIGGERS = [
+    'malware_search_insert', 'malware_search_update', 'malware_search_delete',
+    'malware_search_tag_insert', 'malware_search_tag_delete',
+    'note_search_insert', 'note_search_update', 'note_search_delete',
+]
+
+# Index the rows stored before the full-text tables existed, or while they
+# weren't kept in sync.
+SQLITE_BACKFILL = [
+    "DELETE FROM malware_search",
+    "DELETE FROM note_search",
+    "INSERT INTO malware_search(rowid, name, type, mime, tags) "
+    "SELECT id, name, type, mime, " + SQLITE_TAGS.format('malware.id') + " FROM malware",
+    "INSERT INTO note_search(rowid, title, body) SELECT id, title, body FROM note",
+]
+
+POSTGRES_SCHEMA = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS malware_name_trgm ON malware USING gin (name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS malware_type_trgm ON malware USING gin (type gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS malware_mime_trgm ON malware USING gin (mime gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS tag_tag_trgm ON tag USING gin (tag gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS note_title_trgm ON note USING gin (title gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS note_body_trgm ON note USING gin (body gin_trgm_ops)",
+]
+
+
+def has_trigrams(engine):
+    try:
+        with engine.begin() as connection:
+            for statement in SQLITE_PROBE:
+                connection.execute(text(statement))
+    except SQLAlchemyError:
+        return False
+
+    return True
+
+
+def drop_triggers(engine):
+    # The triggers left by a SQLite with trigram support would make every
+    # write fail with one that lacks it.
+    try:
+        with engine.begin() as connection:
+            for trigger in SQLITE_TRIGGERS:
+                connection.execute(text("DROP TRIGGER IF EXISTS {0}".format(trigger)))
+    except SQLAlchemyError:
+        pass
+
+
+def create_search_index(engine):
+    # Returns True if the search indexes are available. Without them (old
+    # SQLite without FTS5 trigrams, or no pg_trgm extension) searches fall
+    # back to plain LIKE queries.
+    if engine.name == 'sqlite' and not has_trigrams(engine):
+        drop_triggers(engine)
+        return False
+
+    try:
+        with engine.begin() as connection:
+            if engine.name == 'sqlite':
+                # The tables are only in sync with the data if the triggers
+                # were there all along.
+                synced = connection.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'trigger' "
+                                                 "AND name = 'malware_search_insert'")).first()
+                for statement in SQLITE_SCHEMA:
+                    connection.execute(text(statement))
+
+                if not synced:
+                    for statement in SQLITE_BACKFILL:
+                        connection.execute(text(statement))
+            elif engine.name == 'postgresql':
+                for statement in POSTGRES_SCHEMA:
+                    connection.execute(text(statement))
+            else:
+                return False
+    except SQLAlchemyError:
+        return False
+
+    return True
+
+
+def match_query(value):
+    # FTS5 query for the given string anywhere in the indexed columns.
+    return '"{0}"'.format(value.replace('"', '""'))
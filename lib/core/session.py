@@ -1,12 +1,14 @@
 # This file is part of Viper - https://github.com/viper-framework/viper
 # See the file 'LICENSE' for copying permission.
 
+import os
 import time
 import datetime
 
 from lib.common.out import *
 from lib.common.objects import File
 from lib.core.database import Database
+from lib.core.storage import get_sample_path
 from lib.core.investigation import __project__
 
 
@@ -20,6 +22,27 @@ class Session(object):
         self.created_at = datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d %H:%M:%S')
         # MISP event associated to the object
         self.misp_event = None
+        # Whether the file is stored in the current investigation. This is
+        # cached so that the prompt doesn't have to query the database.
+        self.stored = False
+
+    def refresh(self, db=None):
+        # Load the name and tags of the file from the database, and whether
+        # it's stored at all.
+        if self.file is None:
+            return
+
+        if db is None:
+            db = Database()
+
+        row = db.find(key='sha256', value=self.file.sha256)
+        if row:
+            self.stored = True
+            self.file.name = row[0].name
+            self.file.tags = ', '.join(tag.to_dict()['tag'] for tag in row[0].tag)
+        else:
+            self.stored = False
+            self.file.tags = ''
 
 
 class Sessions(object):
@@ -41,6 +64,8 @@ class Sessions(object):
 
     def switch(self, session):
         self.current = session
+        # The file might have been stored or deleted meanwhile.
+        self.current.refresh()
         print_info("Switched to session #{0} on {1}".format(self.current.id, self.current.file.path))
 
     def new(self, path=None, misp_event=None):
@@ -63,18 +88,22 @@ class Sessions(object):
             if self.is_set() and self.current.misp_event:
                 session.misp_event = self.current.misp_event
 
-            # Open a section on the given file.
+            # Open a section on the given file. Its hashes are only computed
+            # when needed, and reused if the file was opened before.
             session.file = File(path)
+            # Samples in the local repository are stored under their SHA256,
+            # so there's no need to hash them to look them up.
+            sha256 = os.path.basename(path)
+            if len(sha256) == 64 and get_sample_path(sha256) == path:
+                session.file.sha256 = sha256
             # Try to lookup the file in the database. If it is already present
-            # we get file name and
-            row = Database().find(key='sha256', value=session.file.sha256)
-            if row:
-                session.file.name = row[0].name
-                session.file.tags = ', '.join(tag.to_dict()['tag'] for tag in row[0].tag)
+            # we get file name and tags.
+            session.refresh()
             print_info("Session opened on {0}".format(path))
         if misp_event is not None:
             if self.is_set() and self.current.file:
                 session.file = self.current.file
+                session.stored = self.current.stored
             refresh = False
             if self.current is not None and self.current.misp_event is not None \
                     and self.current.misp_event.event_id == misp_event.event_id:
@@ -91,7 +120,7 @@ class Sessions(object):
             # duplicates in sessions.
             # NOTE: in the future we might want to remove this if sessions have
             # unique attributes (for example, an history just for each of them).
-            for entry in self.sessions:
+            for entry in list(self.sessions):
                 if entry.file is not None and entry.file.sha256 == session.file.sha256:
                     self.sessions.remove(entry)
 
@@ -2,9 +2,499 @@
 # See the file 'LICENSE' for copying permission.
 
 import os
+import time
+import zlib
+import fcntl
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import zstandard
+    HAVE_ZSTD = True
+except ImportError:
+    HAVE_ZSTD = False
+
+try:
+    import lz4.frame
+    HAVE_LZ4 = True
+except ImportError:
+    HAVE_LZ4 = False
 
 from lib.common.out import *
 from lib.core.investigation import __project__
+from lib.core.packstore import PackStore, PACK_THRESHOLD
+from lib.core.catalog import Catalog
+
+# Blobs are compressed with the first available codec of this list. Their
+# file extension tells which codec was used, so blobs written with another
+# codec can still be read.
+CODECS = ['zst', 'lz4', 'zz']
+# Size of the chunks read from and written to the blobs.
+CHUNK_SIZE = 1024 * 1024
+# The decompressed copies of the files opened in a session are kept in a
+# cache, whose least recently used files are evicted once it grows above this
+# size. Code going through the whole repository uses temporary copies
+# instead, see sample_file().
+CACHE_SIZE = 1024 * 1024 * 1024
+# The space of the samples deleted from the packs is reclaimed at most this
+# often, as their deletion goes.
+COMPACT_INTERVAL = 24 * 3600
+
+
+class LZ4Compressor(object):
+    # Gives the lz4 frame compressor the same interface as the other ones.
+    def __init__(self):
+        self.compressor = lz4.frame.LZ4FrameCompressor()
+        self.header = self.compressor.begin()
+
+    def compress(self, data):
+        header, self.header = self.header, b''
+        return header + self.compressor.compress(data)
+
+    def flush(self):
+        return self.header + self.compressor.flush()
+
+
+def get_codec():
+    if HAVE_ZSTD:
+        return 'zst'
+    elif HAVE_LZ4:
+        return 'lz4'
+    return 'zz'
+
+
+def get_compressor(codec):
+    if codec == 'zst':
+        return zstandard.ZstdCompressor(level=3).compressobj()
+    elif codec == 'lz4':
+        return LZ4Compressor()
+    # Fast zlib compression, for when neither zstd nor lz4 are installed.
+    return zlib.compressobj(1)
+
+
+def get_decompressor(codec):
+    if codec == 'zst':
+        if not HAVE_ZSTD:
+            raise IOError("Missing dependency, install zstandard to read {0} blobs".format(codec))
+        return zstandard.ZstdDecompressor().decompressobj()
+    elif codec == 'lz4':
+        if not HAVE_LZ4:
+            raise IOError("Missing dependency, install lz4 to read {0} blobs".format(codec))
+        return lz4.frame.LZ4FrameDecompressor()
+    elif codec == 'raw':
+        return None
+    return zlib.decompressobj()
+
+
+def compress(data):
+    # Returns a tuple (data, codec) with the data compressed, or as it is if
+    # it doesn't compress.
+    codec = get_codec()
+    compressor = get_compressor(codec)
+    compressed = compressor.compress(data) + compressor.flush()
+    if len(compressed) >= len(data):
+        return data, 'raw'
+    return compressed, codec
+
+
+class BlobReader(object):
+    # Read-only file-like object decompressing a blob on the fly.
+    def __init__(self, handle, codec):
+        self.handle = handle
+        self.decompressor = get_decompressor(codec)
+        self.buffer = b''
+        self.eof = False
+
+    def fill(self, size):
+        while not self.eof and (size < 0 or len(self.buffer) < size):
+            data = self.handle.read(CHUNK_SIZE)
+            if data:
+                if self.decompressor:
+                    data = self.decompressor.decompress(data)
+                self.buffer += data
+            else:
+                if hasattr(self.decompressor, 'flush'):
+                    self.buffer += self.decompressor.flush()
+                self.eof = True
+
+    def read(self, size=-1):
+        self.fill(size)
+        if size < 0:
+            data, self.buffer = self.buffer, b''
+        else:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def close(self):
+        self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class BlobStore(object):
+    # Content-addressed store shared by all the investigations. Every sample
+    # is kept once, compressed, under its SHA256:
+    #
+    #   storage/blobs/a/b/<sha256>.<codec>  compressed content
+    #   storage/cache/<sha256>  decompressed copies of the session files
+    #   storage/tmp/  temporary copies, removed after use
+    #
+    # When the storage/packs folder exists, small samples are appended to pack
+    # files instead of getting a file each.
+    #
+    # The references of the investigations to the blobs are kept in the
+    # catalog, a blob is deleted when the last investigation referencing it
+    # drops it.
+    def __init__(self, path, catalog):
+        self.path = path
+        self.catalog = catalog
+        self.cache_size = None
+        self.packs = None
+
+        packs_path = os.path.join(path, 'packs')
+        if os.path.exists(packs_path):
+            self.packs = PackStore(packs_path)
+
+        self.import_refs()
+
+    def import_refs(self):
+        # The references used to be empty files, storage/refs/<investigation>/
+        # <sha256>, which took an inode each.
+        refs_path = os.path.join(self.path, 'refs')
+        if not os.path.exists(refs_path):
+            return
+
+        refs = []
+        for investigation in os.listdir(refs_path):
+            refs.extend((sha256, investigation) for sha256 in os.listdir(os.path.join(refs_path, investigation)))
+
+        self.catalog.add_refs(refs)
+        shutil.rmtree(refs_path, ignore_errors=True)
+
+    def enable_packs(self):
+        packs_path = os.path.join(self.path, 'packs')
+        if not os.path.exists(packs_path):
+            os.makedirs(packs_path, 0o750)
+        if not self.packs:
+            self.packs = PackStore(packs_path)
+
+    def get_blob_path(self, sha256, codec):
+        return os.path.join(self.path, 'blobs', sha256[0], sha256[1], '{0}.{1}'.format(sha256, codec))
+
+    def get_cache_path(self, sha256):
+        return os.path.join(self.path, 'cache', sha256)
+
+    def find_blob(self, sha256):
+        # Returns a tuple (path, codec) of the blob, or None.
+        for codec in CODECS:
+            blob_path = self.get_blob_path(sha256, codec)
+            if os.path.exists(blob_path):
+                return blob_path, codec
+        return None
+
+    def exists(self, sha256):
+        if self.find_blob(sha256) is not None:
+            return True
+        return self.packs is not None and self.packs.exists(sha256)
+
+    def put(self, sha256, chunks, size=None):
+        # Stream the chunks into a compressed blob, unless it's already there.
+        if self.exists(sha256):
+            return
+
+        if self.packs and size is not None and size <= PACK_THRESHOLD:
+            self.packs.put(sha256, *compress(b''.join(chunks)))
+            return
+
+        codec = get_codec()
+        blob_path = self.get_blob_path(sha256, codec)
+        folder = os.path.dirname(blob_path)
+        if not os.path.exists(folder):
+            os.makedirs(folder, 0o750)
+
+        # Write through a temporary file, so that a blob is either complete or
+        # not there at all.
+        tmp_path = '{0}.{1}.tmp'.format(blob_path, os.getpid())
+        compressor = get_compressor(codec)
+        try:
+            with open(tmp_path, 'wb') as blob:
+                for chunk in chunks:
+                    blob.write(compressor.compress(chunk))
+                blob.write(compressor.flush())
+            os.rename(tmp_path, blob_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def get_location(self, sha256):
+        # Returns where the sample is stored, for display.
+        blob = self.find_blob(sha256)
+        if blob:
+            return blob[0]
+
+        if self.packs:
+            member = self.packs.get_member(sha256)
+            if member:
+                return '{0}@{1}'.format(self.packs.get_segment_path(member.segment), member.offset)
+
+        return None
+
+    def open(self, sha256):
+        blob = self.find_blob(sha256)
+        if blob:
+            blob_path, codec = blob
+            return BlobReader(open(blob_path, 'rb'), codec)
+
+        if self.packs:
+            member = self.packs.open(sha256)
+            if member:
+                return BlobReader(*member)
+
+        return None
+
+    def read_member(self, sha256):
+        # Returns the content of a packed sample, decompressed in memory
+        # straight from the mapped segment, or None if it isn't in the packs.
+        if not self.packs:
+            return None
+
+        member = self.packs.open(sha256)
+        if not member:
+            return None
+
+        with BlobReader(*member) as reader:
+            return reader.read()
+
+    def add_ref(self, investigation, sha256):
+        self.catalog.add_refs([(sha256, investigation)])
+
+    def has_ref(self, investigation, sha256):
+        return self.catalog.has_ref(sha256, investigation)
+
+    def get_refcount(self, sha256):
+        return self.catalog.count_refs(sha256)
+
+    def release(self, investigation, sha256):
+        # Drop the reference of the investigation, and the blob if it was the
+        # last one. Returns True if the blob was deleted.
+        if self.catalog.remove_ref(sha256, investigation) > 0:
+            return False
+
+        self.delete(sha256)
+        self.compact_if_due()
+        return True
+
+    def release_all(self, investigation):
+        # Drop all the references of a deleted investigation.
+        for sha256 in self.catalog.remove_refs(investigation):
+            self.delete(sha256)
+
+        self.compact_if_due()
+
+    def compact_if_due(self):
+        # Reclaim the space of the deleted members if the packs weren't
+        # compacted for COMPACT_INTERVAL. The marker file is locked, so that
+        # only one process compacts them. Returns the number of reclaimed
+        # bytes, or None if it wasn't due.
+        if not self.packs:
+            return None
+
+        marker = os.path.join(self.packs.path, 'compacted')
+        if os.path.exists(marker) and time.time() - os.path.getmtime(marker) < COMPACT_INTERVAL:
+            return None
+
+        with open(marker, 'a') as handle:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                return None
+
+            try:
+                reclaimed = self.packs.compact()
+                os.utime(marker, None)
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+        return reclaimed
+
+    def delete(self, sha256):
+        for path in (self.get_cache_path(sha256), (self.find_blob(sha256) or [None])[0]):
+            if path and os.path.exists(path):
+                os.remove(path)
+
+        if self.packs:
+            self.packs.delete(sha256)
+
+    def pack(self):
+        # Move the small blobs stored as separate files to the packs. They are
+        # copied as they are, without compressing them again. Returns the
+        # number of moved blobs.
+        self.enable_packs()
+
+        count = 0
+        for folder, folders, files in os.walk(os.path.join(self.path, 'blobs')):
+            for file_name in files:
+                sha256, codec = os.path.splitext(file_name)
+                blob_path = os.path.join(folder, file_name)
+                if codec[1:] not in CODECS or os.path.getsize(blob_path) > PACK_THRESHOLD:
+                    continue
+
+                with open(blob_path, 'rb') as blob:
+                    self.packs.put(sha256, blob.read(), codec[1:])
+                os.remove(blob_path)
+                count += 1
+
+        return count
+
+    def get_stats(self):
+        # Returns a dict of (files, size) tuples for the blobs, the packs and
+        # the cache.
+        stats = {}
+        for name in ('blobs', 'cache'):
+            files = 0
+            size = 0
+            for folder, folders, file_names in os.walk(os.path.join(self.path, name)):
+                for file_name in file_names:
+                    files += 1
+                    size += os.path.getsize(os.path.join(folder, file_name))
+            stats[name] = (files, size)
+
+        if self.packs:
+            segments, members, size, live = self.packs.get_stats()
+            stats['packs'] = (members, size)
+
+        return stats
+
+    def extract(self, sha256, path):
+        # Write the decompressed content of the blob to the given path.
+        with self.open(sha256) as reader, open(path, 'wb') as handle:
+            while True:
+                data = reader.read(CHUNK_SIZE)
+                if not data:
+                    break
+                handle.write(data)
+
+    def get_temp_path(self, sha256):
+        # Returns the path of a temporary decompressed copy of the blob, to be
+        # removed by the caller, or None.
+        if not self.exists(sha256):
+            return None
+
+        folder = os.path.join(self.path, 'tmp')
+        if not os.path.exists(folder):
+            os.makedirs(folder, 0o750)
+
+        fd, tmp_path = tempfile.mkstemp(prefix=sha256 + '.', dir=folder)
+        os.close(fd)
+        try:
+            self.extract(sha256, tmp_path)
+        except Exception as e:
+            os.remove(tmp_path)
+            print_error("Unable to extract sample {0}: {1}".format(sha256, e))
+            return None
+
+        return tmp_path
+
+    def get_path(self, sha256):
+        # Returns the path of a decompressed copy of the blob in the cache,
+        # extracting it if needed.
+        cache_path = self.get_cache_path(sha256)
+        if os.path.exists(cache_path):
+            # Keep track of the last use for the cache eviction.
+            os.utime(cache_path, None)
+            return cache_path
+
+        if not self.exists(sha256):
+            return None
+
+        folder = os.path.dirname(cache_path)
+        if not os.path.exists(folder):
+            os.makedirs(folder, 0o750)
+
+        tmp_path = '{0}.{1}.tmp'.format(cache_path, os.getpid())
+        try:
+            self.extract(sha256, tmp_path)
+            os.rename(tmp_path, cache_path)
+        except Exception as e:
+            print_error("Unable to extract sample {0}: {1}".format(sha256, e))
+            return None
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        self.add_cache_size(cache_path)
+        return cache_path
+
+    def add_cache_size(self, added_path):
+        cache_path = os.path.join(self.path, 'cache')
+        # The size of the cache is only computed once per process, and kept
+        # up to date as files are extracted.
+        if self.cache_size is None:
+            self.cache_size = sum(os.path.getsize(os.path.join(cache_path, name)) for name in os.listdir(cache_path))
+        else:
+            self.cache_size += os.path.getsize(added_path)
+
+        if self.cache_size > CACHE_SIZE:
+            self.trim_cache(keep=added_path)
+
+    def trim_cache(self, size=CACHE_SIZE * 3 / 4, keep=None):
+        # Evict the least recently used files, except the one just extracted,
+        # until the cache is below the given size. A session still using an
+        # evicted file keeps its open handle or mapping.
+        cache_path = os.path.join(self.path, 'cache')
+        entries = []
+        for name in os.listdir(cache_path):
+            path = os.path.join(cache_path, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        self.cache_size = sum(entry[1] for entry in entries)
+        for mtime, file_size, path in sorted(entries):
+            if self.cache_size <= size:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                self.cache_size -= file_size
+            except OSError:
+                pass
+
+
+_stores = {}
+_catalogs = {}
+
+
+def get_store():
+    # The store lives next to the investigations folder. Forked processes
+    # get their own, as the connections to its index can't be shared.
+    key = (os.getpid(), os.path.join(os.getcwd(), 'storage'))
+    if key not in _stores:
+        _stores[key] = BlobStore(key[1], get_catalog())
+    return _stores[key]
+
+
+def get_catalog():
+    # The catalog of the samples of all the investigations, kept along with
+    # the store they share.
+    key = (os.getpid(), os.path.join(os.getcwd(), 'storage', 'catalog.db'))
+    if key not in _catalogs:
+        _catalogs[key] = Catalog(key[1])
+    return _catalogs[key]
+
+
+def get_legacy_path(sha256):
+    # Samples stored before the blob store existed are kept uncompressed in
+    # the folder of their investigation.
+    return os.path.join(__project__.get_path(), 'binaries', sha256[0], sha256[1], sha256[2], sha256[3], sha256)
 
 
 def store_sample(file_object):
@@ -19,26 +509,110 @@ def store_sample(file_object):
     if not sha256:
         print_error("No hash")
         return None
-    
-    folder = os.path.join(__project__.get_path(), 'binaries', sha256[0], sha256[1], sha256[2], sha256[3])
-    if not os.path.exists(folder):
-        os.makedirs(folder, 0o750)
-
-    file_path = os.path.join(folder, sha256)
 
-    if not os.path.exists(file_path):
-        with open(file_path, 'wb') as stored:
-            for chunk in file_object.get_chunks():
-                stored.write(chunk)
-    else:
+    store = get_store()
+    if store.has_ref(__project__.name, sha256) or os.path.exists(get_legacy_path(sha256)):
         print_warning("File exists already")
         return None
 
-    return file_path
+    # The blob is only written if no other investigation stored it already.
+    try:
+        store.put(sha256, file_object.get_chunks(), file_object.size)
+    except (IOError, OSError) as e:
+        print_error("Unable to store file: {0}".format(e))
+        return None
+
+    store.add_ref(__project__.name, sha256)
+    get_catalog().add(file_object, __project__.name)
+
+    # Only tell where the sample went, extracting a copy right away would
+    # double the I/O of large imports.
+    return store.get_location(sha256)
+
+
+def is_sample_stored(sha256):
+    # Whether the current investigation stores the sample, without reading it.
+    if os.path.exists(get_legacy_path(sha256)):
+        return True
+    return bool(__project__.name) and get_store().has_ref(__project__.name, sha256)
 
 
 def get_sample_path(sha256):
-    path = os.path.join(__project__.get_path(), 'binaries', sha256[0], sha256[1], sha256[2], sha256[3], sha256)
-    if not os.path.exists(path):
+    # Returns the path of a decompressed copy of a sample of the current
+    # investigation, or None if it isn't stored. The copy is kept in the
+    # cache, this is meant for the file opened in a session.
+    path = get_legacy_path(sha256)
+    if os.path.exists(path):
+        return path
+
+    store = get_store()
+    if not __project__.name or not store.has_ref(__project__.name, sha256):
+        return None
+    return store.get_path(sha256)
+
+
+@contextmanager
+def sample_file(sha256):
+    # Same as get_sample_path(), for the code going through many samples: the
+    # path is one of a temporary copy, removed at the end of the block, so
+    # nothing accumulates on disk.
+    path = get_legacy_path(sha256)
+    if os.path.exists(path):
+        yield path
+        return
+
+    store = get_store()
+    if not __project__.name or not store.has_ref(__project__.name, sha256):
+        yield None
+        return
+
+    tmp_path = store.get_temp_path(sha256)
+    try:
+        yield tmp_path
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def read_packed_sample(sha256):
+    # Returns the content of a sample of the current investigation if it's
+    # kept in the packs, or None. Packed samples are small, so they can be
+    # handed to the code going through the repository in memory, without
+    # writing a temporary copy.
+    if not __project__.name or os.path.exists(get_legacy_path(sha256)):
+        return None
+
+    store = get_store()
+    if not store.packs or not store.has_ref(__project__.name, sha256):
         return None
-    return path
+    return store.read_member(sha256)
+
+
+def open_sample(sha256):
+    # Returns a file-like object streaming the content of a sample of the
+    # current investigation, or None if it isn't stored.
+    path = get_legacy_path(sha256)
+    if os.path.exists(path):
+        return open(path, 'rb')
+
+    store = get_store()
+    if not __project__.name or not store.has_ref(__project__.name, sha256):
+        return None
+    return store.open(sha256)
+
+
+def delete_sample(sha256):
+    # Remove a sample from the current investigation. Its blob is only
+    # deleted once no other investigation references it.
+    path = get_legacy_path(sha256)
+    if os.path.exists(path):
+        os.remove(path)
+
+    if __project__.name:
+        get_store().release(__project__.name, sha256)
+        get_catalog().remove(sha256, __project__.name)
+
+
+def delete_investigation_samples(name):
+    get_store().release_all(name)
+    get_catalog().remove_investigation(name)
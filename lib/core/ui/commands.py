@@ -7,8 +7,8 @@ import time
 import fnmatch
 import tempfile
 import shutil
+from itertools import chain
 from zipfile import ZipFile
-from collections import defaultdict
 
 try:
     from scandir import walk
@@ -16,14 +16,19 @@ except ImportError:
     from os import walk
 
 from lib.common.out import *
+from lib.common.sinks import get_sink
 from lib.common.utils import convert_size
-from lib.common.objects import File
 from lib.common.network import download
 from lib.core.session import __sessions__
 from lib.core.investigation import __project__
+from lib.core.jobs import __jobs__
 from lib.core.plugins import __modules__, __integrations__, __scripts__
 from lib.core.database import Database
-from lib.core.storage import store_sample, get_sample_path
+from lib.core.storage import store_sample, get_sample_path, is_sample_stored, delete_sample, delete_investigation_samples, get_store
+from lib.core.storage import get_catalog
+from lib.core.peindex import index_sample
+from lib.core.fuzzyindex import index_ssdeep
+from lib.core.ingest import process_files, batches
 
 # For python2 & 3 compat, a bit dirty, but it seems to be the least bad one
 try:
@@ -34,8 +39,6 @@ except NameError:
 
 class Commands(object):
 
-    output = []
-    
     def __init__(self):
         # Open connection to the database.
         self.db = Database()
@@ -60,11 +63,14 @@ class Commands(object):
             modules=dict(obj=self.cmd_modules, description="List available modules"),
             integrate=dict(obj=self.cmd_integrate, description="Interact with available integrations"),
             tokens=dict(obj=self.cmd_tokens, description="Store and retrieve API tokens for integrations and modules"),
+            storage=dict(obj=self.cmd_storage, description="Show and maintain the sample storage"),
+            jobs=dict(obj=self.cmd_jobs, description="Run commands in the background"),
         )
         
     # Output Logging
     def log(self, event_type, event_data):
-        self.output.append(dict(
+        # The events are streamed to the output sink as they are logged.
+        get_sink().write(dict(
             type=event_type,
             data=event_data
         ))
@@ -114,7 +120,10 @@ class Commands(object):
 
         if args.reload:
             from lib.core.plugins import load_modules
-            moduleDict = load_modules()
+            # Import all the modules again to rebuild the manifest, and update
+            # the registry in place so that the console picks up the changes.
+            moduleDict.clear()
+            moduleDict.update(load_modules(refresh=True))
 
         rows = []
         for module_name, module_item in moduleDict.items():
@@ -287,9 +296,9 @@ class Commands(object):
         elif args.last:
             if __sessions__.find:
                 count = 1
-                for item in __sessions__.find:
+                for sha256 in __sessions__.find:
                     if count == int(target):
-                        __sessions__.new(get_sample_path(item.sha256))
+                        __sessions__.new(get_sample_path(sha256))
                         break
 
                     count += 1
@@ -366,9 +375,6 @@ class Commands(object):
         group.add_argument('-e', '--edit', metavar='NOTE', type=int, help="Edit an existing note")
         group.add_argument('-d', '--delete', metavar='NOTE', type=int, help="Delete an existing note")
 
-        notepath = __project__.path + '/notes'
-        notelist = os.listdir(__project__.path + '/notes')
-
         try:
             args = parser.parse_args(args)
         except:
@@ -378,20 +384,21 @@ class Commands(object):
             print_error('Cannot store notes in the default investigation. Please open a new case.')
             return
 
-        if args.list:
-            # Retrieve all notes for the currently opened investigation.
-            pass
+        # The note files are the notes, bring the index used by "find note"
+        # up to date with them so that both show the same IDs.
+        notepath = __project__.path + '/notes'
+        notes = self.db.sync_notes(notepath)
+        notes_by_id = dict((note.id, note) for note in notes)
 
-            if len(notelist) < 1:
+        if args.list:
+            if len(notes) < 1:
                 self.log('info', "No notes available for this investigation yet")
                 return
 
             # Build table of existing case notes
             rows = []
-            notecount = 1
-            for note in notelist:
-                rows.append([notecount, note])
-                notecount += 1
+            for note in notes:
+                rows.append([note.id, note.title])
 
             # Display list of existing notes.
             self.log('table', dict(header=['ID', 'Title'], rows=rows))
@@ -411,6 +418,7 @@ class Commands(object):
                 note.write(body)
 
             # store note in the database
+            self.db.sync_notes(notepath)
 
             # Finally, remove the temporary file.
             os.remove(tmp.name)
@@ -418,8 +426,10 @@ class Commands(object):
             self.log('info', "Note with title \"{0}\" added to the current investigation".format(bold(title)))
 
         elif args.view:
-            # Retrieve note wth the specified ID and print it.
+            # Retrieve note with the specified ID or title and print it.
             title = args.view
+            if title.isdigit() and int(title) in notes_by_id:
+                title = notes_by_id[int(title)].title
             note = notepath + '/' + title
             if os.path.exists(note):
                 self.log('info', bold('Title: ') + title)
@@ -433,27 +443,44 @@ class Commands(object):
 
         elif args.edit:
             # Retrieve note with the specified ID.
-            note = Database().get_note(args.edit)
-            if note:
-                # Create a new temporary file.
-                tmp = tempfile.NamedTemporaryFile(delete=False)
-                # Write the old body to the temporary file.
-                tmp.write(note.body)
-                tmp.close()
-                # Open the old body with the text editor.
-                os.system('"${EDITOR:-nano}" ' + tmp.name)
-                # Read the new body from the temporary file.
-                body = open(tmp.name, 'r').read()
-                # Update the note entry with the new body.
-                Database().edit_note(args.edit, body)
-                # Remove the temporary file.
-                os.remove(tmp.name)
+            note = notes_by_id.get(args.edit)
+            if not note:
+                self.log('info', "There is no note with ID {0}".format(args.edit))
+                return
 
-                self.log('info', "Updated note with ID {0}".format(args.edit))
+            # Create a new temporary file.
+            tmp = tempfile.NamedTemporaryFile(delete=False)
+            # Write the old body to the temporary file.
+            tmp.write(note.body)
+            tmp.close()
+            # Open the old body with the text editor.
+            os.system('"${EDITOR:-nano}" ' + tmp.name)
+            # Read the new body from the temporary file.
+            body = open(tmp.name, 'r').read()
+            # Update the note file and its entry with the new body.
+            with open(notepath + '/' + note.title, 'w') as notehndle:
+                notehndle.write(body)
+            self.db.edit_note(args.edit, body)
+            # Remove the temporary file.
+            os.remove(tmp.name)
+
+            self.log('info', "Updated note with ID {0}".format(args.edit))
 
         elif args.delete:
             # Delete the note with the specified ID.
-            Database().delete_note(args.delete)
+            note = notes_by_id.get(args.delete)
+            if not note:
+                self.log('info', "There is no note with ID {0}".format(args.delete))
+                return
+
+            try:
+                os.remove(notepath + '/' + note.title)
+            except OSError as e:
+                print_error("Could not delete note {0}: {1}".format(note.title, e))
+                return
+            self.db.delete_note(args.delete)
+
+            self.log('info', "Deleted note with ID {0}".format(args.delete))
         else:
             parser.print_usage()
 
@@ -470,6 +497,7 @@ class Commands(object):
         parser.add_argument('-y', '--file-type', type=str, help="Specify a file type pattern")
         parser.add_argument('-n', '--file-name', type=str, help="Specify a file name pattern")
         parser.add_argument('-t', '--tags', type=str, nargs='+', help="Specify a list of comma-separated tags")
+        parser.add_argument('-j', '--jobs', type=int, help="Number of worker processes used to import a folder (defaults to the number of CPUs)")
 
         try:
             args = parser.parse_args(args)
@@ -485,7 +513,7 @@ class Commands(object):
             args.tags = "".join(args.tags)
 
         def add_file(obj, tags=None):
-            if get_sample_path(obj.sha256):
+            if is_sample_stored(obj.sha256):
                 self.log('warning', "Skip, file \"{0}\" appears to be already stored".format(obj.name))
                 return False
 
@@ -504,6 +532,10 @@ class Commands(object):
                 # associated database record.
                 new_path = store_sample(obj)
                 self.log("success", "Stored file \"{0}\" to {1}".format(obj.name, new_path))
+                # Extract the PE features now, so that the repository-wide
+                # pe scans don't have to parse the sample again.
+                index_sample(self.db, obj.sha256, obj.path)
+                index_ssdeep(self.db, obj.sha256, obj.ssdeep)
             else:
                 return False
 
@@ -519,10 +551,21 @@ class Commands(object):
         # If the user specified the --folder flag, we walk recursively and try
         # to add all contained files to the local repository.
         # This is not going to open a new session.
+        # The expensive part (hashing, magic, ssdeep, PE parsing) is spread
+        # across a pool of worker processes, while the results are written to
+        # the database in batches.
         # TODO: perhaps disable or make recursion optional?
         if args.folder is not None:
             # Check if the specified folder is valid.
-            if os.path.isdir(args.folder):
+            if not os.path.isdir(args.folder):
+                self.log('error', "You specified an invalid folder: {0}".format(args.folder))
+                return
+
+            if not __project__.name:
+                print_error("Must open an investigation to store files")
+                return
+
+            def collect():
                 # Walk through the folder and subfolders.
                 for dir_name, dir_names, file_names in walk(args.folder):
                     # Add each collected file.
@@ -532,34 +575,85 @@ class Commands(object):
                         if not os.path.exists(file_path):
                             continue
                         # Check if file is not zero.
-                        if not os.path.getsize(file_path) > 0:
+                        file_size = os.path.getsize(file_path)
+                        if not file_size > 0:
                             continue
 
                         # Check if the file name matches the provided pattern.
                         if args.file_name:
                             if not fnmatch.fnmatch(file_name, args.file_name):
-                                # self.log('warning', "Skip, file \"{0}\" doesn't match the file name pattern".format(file_path))
-                                continue
-
-                        # Check if the file type matches the provided pattern.
-                        if args.file_type:
-                            if args.file_type not in File(file_path).type:
-                                # self.log('warning', "Skip, file \"{0}\" doesn't match the file type".format(file_path))
                                 continue
 
                         # Check if file exceeds maximum size limit.
                         if args.file_size:
-                            # Obtain file size.
-                            if os.path.getsize(file_path) > args.file_size:
+                            if file_size > args.file_size:
                                 self.log('warning', "Skip, file \"{0}\" is too big".format(file_path))
                                 continue
 
-                        file_obj = File(file_path)
+                        yield file_path
+
+            def candidates():
+                # Files already imported in any investigation, and unchanged
+                # since, get their attributes from the catalog instead of
+                # being read and hashed again.
+                paths = list(collect())
+                known = get_catalog().get_known_files(paths)
+                unknown = [path for path in paths if os.path.abspath(path) not in known]
+                if known:
+                    self.log('info', "{0} files are already known, skipping their analysis".format(len(known)))
+
+                results = chain(((obj, None) for obj in known.values()), process_files(unknown, jobs=args.jobs))
+                for obj, pe_features in results:
+                    # Check if the file type matches the provided pattern.
+                    if args.file_type:
+                        if args.file_type not in obj.type:
+                            continue
 
-                        # Add file.
-                        add_file(file_obj, args.tags)
-            else:
-                self.log('error', "You specified an invalid folder: {0}".format(args.folder))
+                    if is_sample_stored(obj.sha256):
+                        self.log('warning', "Skip, file \"{0}\" appears to be already stored".format(obj.name))
+                        continue
+
+                    yield obj, pe_features
+
+            start = time.time()
+            total_count = 0
+            total_size = 0
+
+            for batch in batches(candidates()):
+                pe_features = dict((obj.sha256, features) for obj, features in batch)
+                # Store the file objects of the batch into the database.
+                for obj in self.db.add_many([obj for obj, features in batch], tags=args.tags):
+                    # Only store the files which made it into the database.
+                    new_path = store_sample(obj)
+                    if not new_path:
+                        continue
+
+                    self.log("success", "Stored file \"{0}\" to {1}".format(obj.name, new_path))
+
+                    if pe_features[obj.sha256]:
+                        self.db.add_pe_features(obj.sha256, pe_features[obj.sha256])
+                    index_ssdeep(self.db, obj.sha256, obj.ssdeep)
+
+                    # Delete the file if requested to do so.
+                    if args.delete:
+                        try:
+                            os.unlink(obj.path)
+                        except Exception as e:
+                            self.log('warning', "Failed deleting file: {0}".format(e))
+
+                    total_count += 1
+                    total_size += obj.size
+
+                elapsed = time.time() - start
+                print_info("Stored {0} files ({1}) in {2:.1f}s, {3:.1f} files/s".format(
+                    total_count, convert_size(total_size), elapsed, total_count / max(elapsed, 0.001)))
+
+            self.log('info', "Stored {0} files ({1}) in {2:.1f}s".format(
+                total_count, convert_size(total_size), time.time() - start))
+
+            # The opened file might have been part of the folder.
+            if __sessions__.is_set() and not __sessions__.current.stored:
+                __sessions__.current.refresh(self.db)
         # Otherwise we try to store the currently opened file, if there is any.
         else:
             if __sessions__.is_set():
@@ -593,10 +687,19 @@ class Commands(object):
                 malware_id = rows[0].id
                 if self.db.delete_file(malware_id):
                     self.log("success", "File deleted")
+                    # Other sessions might still be open on the same file.
+                    for session in __sessions__.sessions:
+                        if session.file is not None and session.file.sha256 == __sessions__.current.file.sha256:
+                            session.stored = False
                 else:
                     self.log('error', "Unable to delete file")
 
-            os.remove(__sessions__.current.file.path)
+            if get_sample_path(__sessions__.current.file.sha256) == __sessions__.current.file.path:
+                # The blob is only removed once no other investigation
+                # references it.
+                delete_sample(__sessions__.current.file.sha256)
+            else:
+                os.remove(__sessions__.current.file.path)
             __sessions__.close()
         else:
             self.log('error', "No session opened")
@@ -609,30 +712,31 @@ class Commands(object):
         parser = argparse.ArgumentParser(prog='find', description="Find a file")
         group = parser.add_mutually_exclusive_group()
         group.add_argument('-t', '--tags', action='store_true', help="List available tags and quit")
-        group.add_argument('type', nargs='?', choices=["all", "latest", "name", "type", "mime", "md5", "sha256", "tag", "note"], help="Where to search.")
+        group.add_argument('type', nargs='?', choices=["all", "latest", "name", "type", "mime", "md5", "sha256", "tag", "note", "search"], help="Where to search.")
         parser.add_argument("value", nargs='?', help="String to search.")
+        parser.add_argument('-g', '--global', dest='all_investigations', action='store_true', help="Search the files of all the investigations (all, name, md5 and sha256 only)")
         try:
             args = parser.parse_args(args)
         except:
             return
 
+        if args.all_investigations:
+            self.find_global(args.type, args.value)
+            return
+
         # One of the most useful search terms is by tag. With the --tags
         # argument we first retrieve a list of existing tags and the count
         # of files associated with each of them.
         if args.tags:
-            # Retrieve list of tags.
-            tags = self.db.list_tags()
+            # Retrieve list of tags, with the count of files associated with
+            # each of them.
+            tags = self.db.get_tag_counts()
 
             if tags:
-                rows = []
-                # For each tag, retrieve the count of files associated with it.
-                for tag in tags:
-                    count = len(self.db.find('tag', tag.tag))
-                    rows.append([tag.tag, count])
+                rows = [[tag, count] for tag, count in tags]
 
                 # Generate the table with the results.
                 header = ['Tag', '# Entries']
-                rows.sort(key=lambda x: x[1], reverse=True)
                 self.log('table', dict(header=header, rows=rows))
             else:
                 self.log('warning', "No tags available")
@@ -655,31 +759,101 @@ class Commands(object):
         else:
             value = None
 
-        # Search all the files matching the given parameters.
-        items = self.db.find(key, value)
-        if not items:
+        if key in ('note', 'search') and not value:
+            self.log('error', "You need to include a search term.")
             return
 
-        # Populate the list of search results.
-        rows = []
-        count = 1
-        for item in items:
-            tag = ', '.join([t.tag for t in item.tag if t.tag])
-            row = [count, item.name, item.mime, item.md5, tag]
-            if key == 'latest':
-                row.append(item.created_at)
+        # Notes aren't attached to files, so they get their own table.
+        if key == 'note':
+            if __project__.name:
+                self.db.sync_notes(__project__.path + '/notes')
+            notes = self.db.search_notes(value)
+            if not notes:
+                return
 
-            rows.append(row)
-            count += 1
+            rows = []
+            for note in notes:
+                # Show the beginning of the body, from the first match if any.
+                start = max(note.body.lower().find(value.lower()), 0)
+                excerpt = ' '.join(note.body[start:start + 60].split())
+                rows.append([note.id, note.title, excerpt])
+
+            self.log("table", dict(header=['ID', 'Title', 'Excerpt'], rows=rows))
+            return
+
+        # Search all the files matching the given parameters. Except for the
+        # latest ones and the full-text search, the results are loaded and
+        # output one page at a time.
+        if key == 'search':
+            items = self.db.search(value)
+        elif key == 'latest':
+            items = self.db.find(key, value)
+        else:
+            items = self.db.find_iter(key, value, load_tags=True)
+
+        items = iter(items or [])
+        first = next(items, None)
+        if first is None:
+            return
+
+        # Update find results in current session. Only the hashes are kept,
+        # to open the files with open --last.
+        found = []
+        __sessions__.find = found
+
+        # Populate the list of search results as the table is output.
+        def get_rows():
+            count = 1
+            for item in chain([first], items):
+                found.append(item.sha256)
+                tag = ', '.join([t.tag for t in item.tag if t.tag])
+                row = [count, item.name, item.mime, item.md5, tag]
+                if key == 'latest':
+                    row.append(item.created_at)
 
-        # Update find results in current session.
-        __sessions__.find = items
+                yield row
+                count += 1
 
         # Generate a table with the results.
         header = ['#', 'Name', 'Mime', 'MD5', 'Tags']
         if key == 'latest':
             header.append('Created At')
 
+        self.log("table", dict(header=header, rows=get_rows()))
+
+    def find_global(self, key, value):
+        if key not in ('all', 'name', 'md5', 'sha256'):
+            self.log('error', "Only all, name, md5 and sha256 can be searched in all the investigations")
+            return
+
+        if key != 'all' and not value:
+            self.log('error', "You need to include a search term.")
+            return
+
+        catalog = get_catalog()
+
+        # Copy the investigations created before the catalog into it, which
+        # only needs to be done once.
+        projects_path = os.path.join(os.getcwd(), 'investigations')
+        if os.path.exists(projects_path):
+            for name in sorted(os.listdir(projects_path)):
+                db_path = os.path.join(projects_path, name, name + '.db')
+                if os.path.exists(db_path) and not catalog.is_synced(name):
+                    catalog.sync(name, Database(db_path).find_iter(columns=[
+                        'sha256', 'md5', 'sha1', 'sha512', 'crc32', 'ssdeep', 'type', 'mime', 'size', 'name',
+                        'created_at']))
+
+        items = catalog.find(key, value)
+        if not items:
+            return
+
+        rows = []
+        count = 1
+        for item in items:
+            rows.append([count, item.investigation, item.name, item.mime, item.md5, item.first_seen, item.last_seen])
+            count += 1
+
+        header = ['#', 'Investigation', 'Name', 'Mime', 'MD5', 'First Seen', 'Last Seen']
         self.log("table", dict(header=header, rows=rows))
 
     ##
@@ -711,7 +885,7 @@ class Commands(object):
         # TODO: handle situation where addition or deletion of a tag fail.
 
         db = Database()
-        if not db.find(key='sha256', value=__sessions__.current.file.sha256):
+        if not __sessions__.current.stored:
             self.log('error', "The opened file is not stored in the database. "
                 "If you want to add it use the `store` command.")
             return
@@ -727,7 +901,7 @@ class Commands(object):
             # needs to be re-generated, or it wouldn't show the new tags
             # until the existing session is closed a new one is opened.
             self.log('info', "Refreshing session to update attributes...")
-            __sessions__.new(__sessions__.current.file.path)
+            __sessions__.current.refresh(db)
 
         if args.delete:
             # Delete the tag from the database.
@@ -735,7 +909,7 @@ class Commands(object):
             # Refresh the session so that the attributes of the file are
             # updated.
             self.log('info', "Refreshing session to update attributes...")
-            __sessions__.new(__sessions__.current.file.path)
+            __sessions__.current.refresh(db)
 
     ###
     # SESSION
@@ -833,7 +1007,11 @@ class Commands(object):
                 __sessions__.close()
                 self.log('info', "Closed opened session")
 
+            path = self.db.get_investigation_path(args.delete)
             __project__.delete(args.delete, self.db)
+            # Release the samples of the investigation from the shared storage.
+            if path:
+                delete_investigation_samples(os.path.basename(path))
             self.log('info', "Deleted investigation {0}".format(bold(args.delete)))
 
             # Need to re-initialize the Database to open the new SQLite file.
@@ -841,6 +1019,111 @@ class Commands(object):
         else:
             self.log('info', parser.print_usage())
 
+    ##
+    # STORAGE
+    #
+    # This command shows the disk usage of the sample storage, shared by all
+    # the investigations, and runs its maintenance tasks.
+    def cmd_storage(self, *args):
+        parser = argparse.ArgumentParser(prog='storage', description="Show and maintain the sample storage")
+        parser.add_argument('-p', '--pack', action='store_true', help="Store small samples in pack files, moving the existing ones")
+        parser.add_argument('-c', '--compact', action='store_true', help="Reclaim the space of the samples deleted from the pack files")
+
+        try:
+            args = parser.parse_args(args)
+        except:
+            return
+
+        store = get_store()
+
+        if args.pack:
+            count = store.pack()
+            self.log('info', "Moved {0} samples to the pack files".format(count))
+
+        if args.compact:
+            if store.packs:
+                reclaimed = store.packs.compact()
+                self.log('info', "Reclaimed {0} from the pack files".format(convert_size(reclaimed)))
+            else:
+                self.log('error', "The pack files are not enabled, use --pack")
+
+        rows = []
+        for name, (files, size) in sorted(store.get_stats().items()):
+            rows.append([name, files, convert_size(size)])
+
+        self.log('table', dict(header=['Storage', 'Files', 'Size'], rows=rows))
+
+    ##
+    # JOBS
+    #
+    # This command runs other commands in background processes, so that the
+    # console can be used while they complete, and manages them.
+    def cmd_jobs(self, *args):
+        parser = argparse.ArgumentParser(prog='jobs', description="Run commands in the background")
+        subparsers = parser.add_subparsers(dest='subname')
+        parser_run = subparsers.add_parser('run', help="Run a command in the background")
+        parser_run.add_argument('command', nargs=argparse.REMAINDER, help="Command to run, e.g. yara scan --all")
+        subparsers.add_parser('list', help="List the jobs")
+        parser_wait = subparsers.add_parser('wait', help="Wait for a job to end, or all of them")
+        parser_wait.add_argument('id', type=int, nargs='?', help="Job ID")
+        parser_kill = subparsers.add_parser('kill', help="Kill a running job")
+        parser_kill.add_argument('id', type=int, help="Job ID")
+        parser_output = subparsers.add_parser('output', help="Show the output of a job")
+        parser_output.add_argument('id', type=int, help="Job ID")
+
+        try:
+            args = parser.parse_args(args or ['list'])
+        except:
+            return
+
+        job = None
+        if args.subname in ('kill', 'output') or (args.subname == 'wait' and args.id is not None):
+            job = __jobs__.get(args.id)
+            if not job:
+                self.log('error', "There is no job with ID {0}".format(args.id))
+                return
+
+        if args.subname == 'run':
+            if not args.command:
+                self.log('error', "Specify the command to run")
+                return
+
+            if args.command[0] in ('jobs', 'exit', 'quit'):
+                self.log('error', "The command {0} can't run in the background".format(args.command[0]))
+                return
+
+            job = __jobs__.run(' '.join(args.command))
+            self.log('info', "Started job {0} ({1}), process {2}".format(job.id, job.command, job.process.pid))
+        elif args.subname == 'list':
+            if not __jobs__.jobs:
+                self.log('info', "There are no jobs")
+                return
+
+            rows = []
+            for job in __jobs__.jobs:
+                rows.append([job.id, job.command, job.get_status(), job.started_at.strftime('%H:%M:%S'),
+                             '{0}s'.format(job.get_duration())])
+
+            self.log('table', dict(header=['#', 'Command', 'Status', 'Started', 'Duration'], rows=rows))
+        elif args.subname == 'wait':
+            jobs = [job] if job else __jobs__.get_running()
+            if jobs:
+                self.log('info', "Waiting for {0} jobs, Ctrl-C to stop waiting".format(len(jobs)))
+            __jobs__.wait(jobs)
+            for job in jobs:
+                self.log('info', "Job {0} ({1}) {2}".format(job.id, job.command, job.get_status()))
+                job.notified = True
+        elif args.subname == 'kill':
+            if __jobs__.kill(job):
+                self.log('info', "Killed job {0}".format(job.id))
+            else:
+                self.log('warning', "The job {0} is not running".format(job.id))
+        elif args.subname == 'output':
+            for line in job.iter_output():
+                self.log('', line.rstrip('\n'))
+            if job.is_running():
+                self.log('info', "The job {0} is still running".format(job.id))
+
     ##
     # EXPORT
     #
@@ -904,6 +1187,7 @@ class Commands(object):
     def cmd_stats(self, *args):
         parser = argparse.ArgumentParser(prog='stats', description="Display Database File Statistics")
         parser.add_argument('-t', '--top', type=int, help='Top x Items')
+        parser.add_argument('-d', '--database', action='store_true', help='Show the database connection latency')
 
         try:
             args = parser.parse_args(args)
@@ -914,39 +1198,32 @@ class Commands(object):
         arg_top = args.top
         db = Database()
 
-        # Set all Counters Dict
-        extension_dict = defaultdict(int)
-        mime_dict = defaultdict(int)
-        tags_dict = defaultdict(int)
-        size_list = []
-        
-        # Find all
-        items = self.db.find('all')
-        
-        if len(items) < 1:
+        if args.database:
+            latency = db.get_latency()
+            self.log('info', "Database engine: {0}".format(db.engine.url.drivername))
+            self.log('item', "Setup (connect and create tables)  {0:.1f} ms".format(latency['setup'] * 1000))
+            self.log('item', "Connection from pool  {0:.2f} ms".format(latency['connect'] * 1000))
+            self.log('item', "Query  {0:.2f} ms".format(latency['query'] * 1000))
+            return
+
+        # The counters are computed by the database, rather than by loading
+        # all the samples and their tags.
+        size_stats = db.get_size_stats()
+
+        if size_stats['count'] < 1:
             self.log('info', "No items in database to generate stats")
             return
-        
-        # Sort in to stats
-        for item in items:
-            if '.' in item.name:
-                ext = item.name.split('.')
-                extension_dict[ext[-1]] += 1
-            mime_dict[item.mime] += 1
-            size_list.append(item.size)
-            for t in item.tag:
-                if t.tag:
-                    tags_dict[t.tag] += 1
-        
-        avg_size = sum(size_list) / len(size_list)
-        all_stats = {'Total':len(items), 'File Extension':extension_dict, 'Mime':mime_dict, 'Tags':tags_dict, 'Avg Size':avg_size, 'Largest':max(size_list), 'Smallest':min(size_list)}
+
+        extension_dict = db.get_extension_counts()
+        mime_dict = dict(db.get_mime_counts())
+        tags_dict = dict((tag, count) for tag, count in db.get_tag_counts() if tag and count)
 
         # Counter for top x
         if arg_top:
             counter = arg_top
             prefix = 'Top {0} '.format(counter)
         else:
-            counter = len(items)
+            counter = size_stats['count']
             prefix = ''
         
         # Project Stats Last as i have it iterate them all
@@ -954,7 +1231,7 @@ class Commands(object):
         # Print all the results
         
         self.log('info', "Projects")
-        self.log('table', dict(header=['Name', 'Count'], rows=[['Main', len(items)], ['Next', '10']]))
+        self.log('table', dict(header=['Name', 'Count'], rows=[['Main', size_stats['count']], ['Next', '10']]))
         
         # For Current Project
         self.log('info', "Current Project")
@@ -987,7 +1264,7 @@ class Commands(object):
         
         # Size
         self.log('info', "Size Stats")
-        self.log('item', "Largest  {0}".format(convert_size(max(size_list))))
-        self.log('item', "Smallest  {0}".format(convert_size(min(size_list))))
-        self.log('item', "Average  {0}".format(convert_size(avg_size)))
+        self.log('item', "Largest  {0}".format(convert_size(size_stats['largest'])))
+        self.log('item', "Smallest  {0}".format(convert_size(size_stats['smallest'])))
+        self.log('item', "Average  {0}".format(convert_size(size_stats['average'])))
                 
@@ -2,14 +2,17 @@
 
 import os
 import glob
+import shlex
 import atexit
 import readline
 import traceback
 
 from lib.common.out import *
+from lib.common.sinks import redirect_output, open_sink, OutputClosed
 from lib.core.session import __sessions__
 from lib.core.plugins import __modules__, __integrations__, __scripts__
 from lib.core.investigation import __project__
+from lib.core.jobs import __jobs__
 from lib.core.ui.commands import Commands
 from lib.core.storage import get_sample_path
 from lib.core.database import Database
@@ -61,8 +64,13 @@ class Console(object):
         root = ''
         args = []
 
-        # Split words by white space.
-        words = data.split()
+        # Split words like a shell would, so that quotes and backslashes
+        # can protect spaces and the | of the output pipe. Lines with
+        # unbalanced quotes are split by white space.
+        try:
+            words = shlex.split(data)
+        except ValueError:
+            words = data.split()
         # First word is the root command.
         root = words[0]
 
@@ -72,6 +80,34 @@ class Console(object):
 
         return (root, args)
 
+    def split_pipe(self, data):
+        # Returns a tuple (command, target) split on the first | which isn't
+        # quoted or escaped, target being None if there's no such pipe. This
+        # way patterns with a | can still be given to the modules.
+        quote = None
+        escaped = False
+        for index, char in enumerate(data):
+            if escaped:
+                escaped = False
+            elif char == '\\' and quote != "'":
+                # Like in a shell, backslashes are literal in single quotes.
+                escaped = True
+            elif quote:
+                if char == quote:
+                    quote = None
+            elif char in ('"', "'"):
+                quote = char
+            elif char == '|':
+                return data[:index], data[index + 1:]
+
+        return data, None
+
+    def is_system_command(self, command):
+        # Whether the command isn't one of CIRTKIT, in which case the line is
+        # left to the shell.
+        root = self.parse(command)[0]
+        return root not in self.cmd.commands and root not in __modules__ and root not in ('exit', 'quit')
+
     def keywords(self, data):
         # Check if $self is in the user input data.
         if '$self' in data:
@@ -86,50 +122,36 @@ class Console(object):
 
         return data
 
-    def print_output(self, output, filename):
-        if not output:
-            return
-        if filename:
-            with open(filename.strip(), 'a') as out:
-                for entry in output:
-                    if entry['type'] == 'info':
-                        out.write('[*] {0}\n'.format(entry['data']))
-                    elif entry['type'] == 'item':
-                        out.write('  [-] {0}\n'.format(entry['data']))
-                    elif entry['type'] == 'warning':
-                        out.write('[!] {0}\n'.format(entry['data']))
-                    elif entry['type'] == 'error':
-                        out.write('[!] {0}\n'.format(entry['data']))
-                    elif entry['type'] == 'success':
-                        out.write('[+] {0}\n'.format(entry['data']))
-                    elif entry['type'] == 'table':
-                        out.write(str(table(
-                            header=entry['data']['header'],
-                            rows=entry['data']['rows']
-                        )))
-                        out.write('\n')
-                    else:
-                        out.write('{0}\n'.format(entry['data']))
-            print_success("Output written to {0}".format(filename))
-        else:
-            for entry in output:
-                if entry['type'] == 'info':
-                    print_info(entry['data'])
-                elif entry['type'] == 'item':
-                    print_item(entry['data'])
-                elif entry['type'] == 'warning':
-                    print_warning(entry['data'])
-                elif entry['type'] == 'error':
-                    print_error(entry['data'])
-                elif entry['type'] == 'success':
-                    print_success(entry['data'])
-                elif entry['type'] == 'table':
-                    print(table(
-                        header=entry['data']['header'],
-                        rows=entry['data']['rows']
-                    ))
-                else:
-                    print(entry['data'])
+    def execute(self, command, sink=None):
+        # Run a single command, which isn't an exit. Its output is streamed to
+        # the sink, the terminal by default. This is also used by the
+        # background jobs.
+        root, args = self.parse(command)
+
+        try:
+            # If the root command is part of the embedded commands list we
+            # execute it.
+            if root in self.cmd.commands:
+                with redirect_output(sink):
+                    self.cmd.commands[root]['obj'](*args)
+            # If the root command is part of loaded modules, we initialize
+            # the module and execute it.
+            elif root in __modules__:
+                module = __modules__[root]['obj']()
+                module.set_commandline(args)
+                with redirect_output(sink):
+                    module.execute()
+            else:
+                try:
+                    print_warning('Running {0} as system command'.format(root))
+                    os.system(command)
+                except:
+                    print_error('Error. Unknown command')
+        except (KeyboardInterrupt, OutputClosed):
+            pass
+        except Exception as e:
+            print_error("The command {0} raised an exception:".format(bold(root)))
+            traceback.print_exc()
 
     def stop(self):
         # Stop main loop.
@@ -183,6 +205,11 @@ class Console(object):
 
         # Main loop.
         while self.active:
+            # Report the background jobs which ended since the last prompt.
+            for job in __jobs__.get_finished():
+                print_info("Job {0} ({1}) {2}, use \"jobs output {0}\" to see its output".format(
+                    job.id, job.command, job.get_status()))
+
             # If there is an open session, we include the path to the opened
             # file in the shell prompt.
             # TODO: perhaps this block should be moved into the session so that
@@ -197,7 +224,7 @@ class Console(object):
                 filename = ''
                 if __sessions__.current.file:
                     filename = __sessions__.current.file.name
-                    if not Database().find(key='sha256', value=__sessions__.current.file.sha256):
+                    if not __sessions__.current.stored:
                         stored = magenta(' [not stored]', True)
                 misp = ''
                 if __sessions__.current.misp_event:
@@ -227,12 +254,6 @@ class Console(object):
                 if not data:
                     continue
                 
-                # Check for output redirection
-                # If there is a > in the string, we assume the user wants to output to file.
-                filename = False
-                if '>' in data:
-                    data, filename = data.split('>')
-
                 # If the input starts with an exclamation mark, we treat the
                 # input as a bash command and execute it.
                 # At this point the keywords should be replaced.
@@ -240,6 +261,27 @@ class Console(object):
                     os.system(data[1:])
                     continue
 
+                # Lines which don't start with a command or module of CIRTKIT
+                # are run by the shell as they are, with their own pipes and
+                # redirections.
+                first_command = self.split_pipe(data)[0].split(';')[0].strip()
+                if first_command and self.is_system_command(first_command):
+                    print_warning('Running {0} as system command'.format(self.parse(first_command)[0]))
+                    os.system(data)
+                    continue
+
+                # Check for output redirection
+                # If there is a > in the string, we assume the user wants to output to file,
+                # as JSON Lines if its name ends with .jsonl. With a | outside of quotes the
+                # output is piped to the command that follows, or to the pager if there's none.
+                sink = None
+                data, target = self.split_pipe(data)
+                if target is not None:
+                    sink = open_sink('|' + target)
+                elif '>' in data:
+                    data, filename = data.split('>')
+                    sink = open_sink(filename)
+
                 # Try to split commands by ; so that you can sequence multiple
                 # commands at once.
                 # For example:
@@ -247,44 +289,28 @@ class Console(object):
                 # This will automatically search for all PDF files, open the first entry
                 # and run the pdf module against it.
                 split_commands = data.split(';')
-                for split_command in split_commands:
-                    split_command = split_command.strip()
-                    if not split_command:
-                        continue
-
-                    # If it's an internal command, we parse the input and split it
-                    # between root command and arguments.
-                    root, args = self.parse(split_command)
-
-                    # Check if the command instructs to terminate.
-                    if root in ('exit', 'quit'):
-                        self.stop()
-                        continue
-
-                    try:
-                        # If the root command is part of the embedded commands list we
-                        # execute it.
-                        if root in self.cmd.commands:
-                            self.cmd.commands[root]['obj'](*args)
-                            self.print_output(self.cmd.output, filename)
-                            del(self.cmd.output[:])
-                        # If the root command is part of loaded modules, we initialize
-                        # the module and execute it.
-                        elif root in __modules__:
-                            module = __modules__[root]['obj']()
-                            module.set_commandline(args)
-                            module.run()
-
-                            self.print_output(module.output, filename)
-                            del(module.output[:])
-                        else:
-                            try:
-                                print_warning('Running {0} as system command'.format(root))
-                                os.system(data)
-                            except:
-                                print_error('Error. Unknown command')
-                    except KeyboardInterrupt:
-                        pass
-                    except Exception as e:
-                        print_error("The command {0} raised an exception:".format(bold(root)))
-                        traceback.print_exc()
+                try:
+                    for split_command in split_commands:
+                        split_command = split_command.strip()
+                        if not split_command:
+                            continue
+
+                        # If it's an internal command, we parse the input and split it
+                        # between root command and arguments.
+                        root, args = self.parse(split_command)
+
+                        # Check if the command instructs to terminate.
+                        if root in ('exit', 'quit'):
+                            self.stop()
+                            continue
+
+                        self.execute(split_command, sink)
+                finally:
+                    # All the commands of the line go to the same file or pager.
+                    if sink:
+                        sink.close()
+
+        running = __jobs__.get_running()
+        if running:
+            print_warning("Killing {0} running jobs".format(len(running)))
+        __jobs__.close()
@@ -0,0 +1,203 @@
+# This file is part of Viper - https://github.com/viper-framework/viper
+# See the file 'LICENSE' for copying permission.
+
+import os
+import re
+import binascii
+import hashlib
+import tempfile
+import multiprocessing
+
+try:
+    import yara
+    HAVE_YARA = True
+except ImportError:
+    HAVE_YARA = False
+
+from lib.common.constants import CIRTKIT_ROOT
+from lib.core.storage import sample_file, read_packed_sample
+
+RULES_PATH = os.path.join(CIRTKIT_ROOT, 'data/yara')
+# Compiled rulesets are saved here, named after the hash of their sources.
+CACHE_PATH = os.path.expanduser('~/.cirtkit/yara')
+
+# Rulesets already loaded by this process.
+_rules = {}
+# Ruleset used by the scan workers.
+_worker_rules = None
+
+INCLUDE_REGEX = re.compile(r'^\s*include\s+"([^"]+)"', re.MULTILINE)
+
+
+def get_rule_files(rule_path=RULES_PATH):
+    rule_files = []
+    for rule_file in sorted(os.listdir(rule_path)):
+        # Skip if the extension is not right, could cause problems.
+        if not rule_file.endswith('.yar') and not rule_file.endswith('.yara'):
+            continue
+        # Skip if it's the index itself.
+        if rule_file == 'index.yara':
+            continue
+
+        rule_files.append(os.path.join(rule_path, rule_file))
+
+    return rule_files
+
+
+def get_ruleset_version(rule_files):
+    # The version of a ruleset is the hash of the names and contents of all
+    # its files, and of the files they include, so any change to the rules
+    # gives a new version.
+    digest = hashlib.sha256()
+    seen = set()
+
+    def add_file(rule_file):
+        rule_file = os.path.abspath(rule_file)
+        if rule_file in seen:
+            return
+        seen.add(rule_file)
+
+        digest.update(os.path.basename(rule_file).encode('utf-8'))
+        try:
+            with open(rule_file, 'rb') as handle:
+                data = handle.read()
+        except IOError:
+            # The compilation will report it.
+            digest.update(b'missing')
+            return
+
+        digest.update(hashlib.sha256(data).digest())
+        # Included paths are relative to the including file.
+        for include in INCLUDE_REGEX.findall(data):
+            add_file(os.path.join(os.path.dirname(rule_file), include))
+
+    for rule_file in rule_files:
+        add_file(rule_file)
+
+    return digest.hexdigest()
+
+
+def rule_index(rule_files):
+    # This means users can just drop or remove rule files without
+    # having to worry about maintaining the index. Each compilation gets its
+    # own index, as several processes might compile at once.
+    fd, tmp_path = tempfile.mkstemp(prefix='index-', suffix='.yara')
+    with os.fdopen(fd, 'w') as rules_index:
+        for rule_file in rule_files:
+            # Add the rule to the index.
+            rules_index.write('include "{0}"\n'.format(rule_file))
+
+    return tmp_path
+
+
+def compile_rules(rule_files, version):
+    if len(rule_files) == 1:
+        rules = yara.compile(rule_files[0])
+    else:
+        index_path = rule_index(rule_files)
+        try:
+            rules = yara.compile(index_path)
+        finally:
+            os.remove(index_path)
+
+    # Save the compiled rules, through a temporary file so that a concurrent
+    # process never loads a partially written ruleset.
+    try:
+        if not os.path.exists(CACHE_PATH):
+            os.makedirs(CACHE_PATH, 0o700)
+
+        cache_file = os.path.join(CACHE_PATH, version + '.yarc')
+        tmp_file = '{0}.{1}.tmp'.format(cache_file, os.getpid())
+        rules.save(tmp_file)
+        os.rename(tmp_file, cache_file)
+    except (OSError, IOError, yara.Error):
+        pass
+
+    return rules
+
+
+def get_rules(rule_file=None):
+    # Returns a tuple (rules, version) for the given ruleset file, or for all
+    # the rules in data/yara if none is specified. Rules are only compiled
+    # again when their sources have changed.
+    if rule_file:
+        rule_files = [os.path.abspath(rule_file)]
+    else:
+        rule_files = get_rule_files()
+
+    version = get_ruleset_version(rule_files)
+
+    if version not in _rules:
+        cache_file = os.path.join(CACHE_PATH, version + '.yarc')
+        rules = None
+        if os.path.exists(cache_file):
+            try:
+                rules = yara.load(cache_file)
+            except yara.Error:
+                rules = None
+
+        if rules is None:
+            rules = compile_rules(rule_files, version)
+
+        _rules[version] = rules
+
+    return _rules[version], version
+
+
+def get_matches(matches):
+    # Turn the matches returned by yara into plain dicts, so that they can be
+    # sent back from the workers and stored in the database.
+    results = []
+    for match in matches:
+        results.append(dict(
+            rule=match.rule,
+            tags=match.meta.get('tags'),
+            strings=[[offset, identifier, binascii.hexlify(data)] for offset, identifier, data in match.strings]
+        ))
+
+    return results
+
+
+def init_worker(rule_file):
+    global _worker_rules
+    _worker_rules = get_rules(rule_file)[0]
+
+
+def scan_sample(sha256):
+    # This runs inside the worker processes, which get the samples from the
+    # store themselves. Returns a tuple (sha256, matches, error), error being
+    # None if the file could be scanned.
+    data = read_packed_sample(sha256)
+    if data is not None:
+        try:
+            return sha256, get_matches(_worker_rules.match(data=data)), None
+        except yara.Error as e:
+            return sha256, None, "Unable to scan {0}: {1}".format(sha256, e)
+
+    with sample_file(sha256) as path:
+        if not path:
+            return sha256, None, "The file does not exist for sample {0}".format(sha256)
+
+        try:
+            return sha256, get_matches(_worker_rules.match(path)), None
+        except yara.Error as e:
+            return sha256, None, "Unable to scan {0}: {1}".format(sha256, e)
+
+
+def scan_samples(samples, rule_file=None, jobs=None):
+    # Scan a list of sha256 with a pool of workers, each one loading the
+    # ruleset once. Results are yielded in completion order.
+    if jobs == 1:
+        init_worker(rule_file)
+        for sha256 in samples:
+            yield scan_sample(sha256)
+        return
+
+    pool = multiprocessing.Pool(jobs, init_worker, (rule_file,))
+    try:
+        for result in pool.imap_unordered(scan_sample, samples, chunksize=4):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
@@ -18,10 +18,8 @@ class Editdistance(Module):
 
     def edit(self):
         db = Database()
-        samples = db.find(key='all')
-
         filenames = []
-        for sample in samples:
+        for sample in db.find_iter(columns=['sha256', 'name']):
             if sample.sha256 == __sessions__.current.file.sha256:
                 continue
 
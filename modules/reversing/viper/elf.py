@@ -21,6 +21,7 @@ class ELF(Module):
     cmd = 'elf'
     description = 'Extract information from ELF headers'
     authors = ['emdel']
+    cacheable = True
 
     def __init__(self):
         super(ELF, self).__init__()
@@ -16,6 +16,8 @@ class EmailParse(Module):
     cmd = 'email'
     description = 'Parse eml and msg email files'
     authors = ['Kevin Breen', 'nex']
+    cacheable = True
+    uncached_args = ('open',)
 
     def __init__(self):
         super(EmailParse, self).__init__()
@@ -16,6 +16,7 @@ class Exif(Module):
     cmd = 'exif'
     description = 'Extract Exif MetaData'
     authors = ['Kevin Breen']
+    cacheable = True
 
     def __init__(self):
         super(Exif, self).__init__()
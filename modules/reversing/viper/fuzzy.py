@@ -1,19 +1,12 @@
 # This file is part of Viper - https://github.com/viper-framework/viper
 # See the file 'LICENSE' for copying permission.
 
-import collections
-
-from lib.common.out import bold, print_info
+from lib.common.out import bold
 from lib.common.abstracts import Module
 from lib.core.database import Database
+from lib.core.fuzzyindex import HAVE_PYDEEP, THRESHOLD, cluster, similar, update_index
 from lib.core.session import __sessions__
 
-try:
-    import pydeep
-    HAVE_PYDEEP = True
-except ImportError:
-    HAVE_PYDEEP = False
-
 
 class Fuzzy(Module):
     cmd = 'fuzzy'
@@ -26,6 +19,10 @@ class Fuzzy(Module):
             help="Prints verbose logging")
         self.parser.add_argument('-c', '--cluster', action='store_true',
             help="Cluster all available samples by ssdeep")
+        self.parser.add_argument('-k', '--top', type=int,
+            help="Only show the given number of most similar samples")
+        self.parser.add_argument('-t', '--threshold', type=int, default=THRESHOLD,
+            help="Minimum ssdeep score of the matches (default {0})".format(THRESHOLD))
 
     def run(self):
         super(Fuzzy, self).run()
@@ -43,67 +40,27 @@ class Fuzzy(Module):
                 arg_cluster = self.args.cluster
 
             db = Database()
-            samples = db.find(key='all')
 
             # Check if we're operating in cluster mode, otherwise we run on the
             # currently opened file.
             if arg_cluster:
                 self.log('info', "Generating clusters, this might take a while...")
 
-                clusters = dict()
-                for sample in samples:
-                    if not sample.ssdeep:
-                        continue
+                # Make sure the samples stored before the index existed are
+                # part of it.
+                count = update_index(db)
+                if arg_verbose:
+                    self.log('info', "Indexed {0} new samples".format(count))
 
-                    if arg_verbose:
-                        self.log('info', "Testing file {0} with ssdeep {1}".format(
-                            sample.md5, sample.ssdeep))
-
-                    clustered = False
-                    for cluster_name, cluster_members in clusters.items():
-                        # Check if sample is already in the cluster.
-                        if sample.md5 in cluster_members:
-                            continue
-
-                        if arg_verbose:
-                            self.log('info', "Testing {0} in cluser {1}".format(
-                                sample.md5, cluster_name))
-                        
-                        for member in cluster_members:
-                            if sample.md5 == member[0]:
-                                continue
-
-                            member_hash = member[0]
-                            member_name = member[1]
-
-                            member_ssdeep = db.find(key='md5', value=member_hash)[0].ssdeep
-                            if pydeep.compare(sample.ssdeep, member_ssdeep) > 40:
-                                if arg_verbose:
-                                    self.log('info', "Found home for {0} in cluster {1}".format(
-                                        sample.md5, cluster_name))
-
-                                clusters[cluster_name].append([sample.md5, sample.name])
-                                clustered = True
-                                break
-
-                    if not clustered:
-                        cluster_id = len(clusters) + 1
-                        clusters[cluster_id] = [[sample.md5, sample.name],]
-
-                ordered_clusters = collections.OrderedDict(sorted(clusters.items()))
+                clusters = cluster(db, threshold=self.args.threshold)
 
                 self.log('info', "Following are the identified clusters with more than one member")
 
-                for cluster_name, cluster_members in ordered_clusters.items():
-                    # We include in the results only clusters with more than just
-                    # one member.
-                    if len(cluster_members) <= 1:
-                        continue
-
-                    self.log('info', "Ssdeep cluster {0}".format(bold(cluster_name)))
+                for cluster_id, cluster_members in enumerate(clusters, 1):
+                    self.log('info', "Ssdeep cluster {0}".format(bold(cluster_id)))
 
                     self.log('table', dict(header=['MD5', 'Name'],
-                        rows=cluster_members))
+                        rows=[[member[1], member[2]] for member in cluster_members]))
 
             # We're running against the already opened file.
             else:
@@ -115,20 +72,15 @@ class Fuzzy(Module):
                     self.log('error', "No ssdeep hash available for opened file")
                     return
 
-                matches = []
-                for sample in samples:
-                    if sample.sha256 == __sessions__.current.file.sha256:
-                        continue
-
-                    if not sample.ssdeep:
-                        continue
+                # Make sure the samples stored before the index existed are
+                # part of it.
+                update_index(db)
 
-                    score = pydeep.compare(__sessions__.current.file.ssdeep,
-                        sample.ssdeep)
-
-                    if score > 40:
-                        matches.append(['{0}%'.format(score), sample.name,
-                            sample.sha256])
+                matches = []
+                for score, sample in similar(db, __sessions__.current.file.ssdeep, count=self.args.top,
+                                             threshold=self.args.threshold, exclude=__sessions__.current.file.sha256):
+                    matches.append(['{0}%'.format(score), sample.name,
+                        sample.sha256])
 
                     if arg_verbose:
                         self.log('info', "Match {0}%: {2} [{1}]".format(score,
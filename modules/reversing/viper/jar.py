@@ -12,6 +12,8 @@ class Jar(Module):
     cmd = 'jar'
     description = 'Parse Java JAR archives'
     authors = ['Kevin Breen']
+    cacheable = True
+    uncached_args = ('dump',)
 
     def __init__(self):
         super(Jar, self).__init__()
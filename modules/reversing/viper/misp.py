@@ -242,29 +242,18 @@ class MISP(Module):
             self.log('error', result.get('message'))
 
     def search_local_hashes(self, event):
-        local = []
+        hashes = []
         samples_count = 0
         for a in event['Event']['Attribute']:
-            row = None
             if a['type'] == 'malware-sample':
                 samples_count += 1
-            if a['type'] in ('malware-sample', 'filename|md5', 'md5'):
+            if a['type'] in ('malware-sample', 'filename|md5', 'md5', 'sha1', 'filename|sha1', 'sha256', 'filename|sha256'):
                 h = a['value']
                 if '|' in a['type']:
                     h = a['value'].split('|')[1]
-                row = Database().find(key='md5', value=h)
-            elif a['type'] in ('sha1', 'filename|sha1'):
-                h = a['value']
-                if '|' in a['type']:
-                    h = a['value'].split('|')[1]
-                row = Database().find(key='sha1', value=h)
-            elif a['type'] in ('sha256', 'filename|sha256'):
-                h = a['value']
-                if '|' in a['type']:
-                    h = a['value'].split('|')[1]
-                row = Database().find(key='sha256', value=h)
-            if row:
-                local.append(row[0])
+                hashes.append(h)
+        # Look up all the hashes of the event at once.
+        local = Database().lookup_hashes(hashes).values()
         self.log('info', 'This event contains {} samples.'.format(samples_count))
         shas = set([l.sha256 for l in local])
         if len(shas) == 1:
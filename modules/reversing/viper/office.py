@@ -29,6 +29,8 @@ class Office(Module):
     cmd = 'office'
     description = 'Office Document Parser'
     authors = ['Kevin Breen', 'nex']
+    cacheable = True
+    uncached_args = ('export', 'code')
 
     def __init__(self):
         super(Office, self).__init__()
@@ -17,6 +17,9 @@ class PDF(Module):
     cmd = 'pdf'
     description = 'Parse and analyze PDF documents'
     authors = ['Kevin Breen', 'nex']
+    cacheable = True
+    uncached_args = ('dump', 'open')
+    cache_dependencies = ('modules/reversing/viper/pdftools', 'modules/reversing/viper/peepdf')
 
     def __init__(self):
         super(PDF, self).__init__()
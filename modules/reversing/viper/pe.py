@@ -3,21 +3,19 @@
 
 import os
 import re
+import json
 import datetime
 import tempfile
 import time
 
-from lib.common.constants import CIRTKIT_ROOT
-
 try:
     import pefile
-    import peutils
     HAVE_PEFILE = True
 except ImportError:
     HAVE_PEFILE = False
 
 try:
-    from modules.pehash.pehasher import calculate_pehash
+    from modules.reversing.viper.pehash.pehasher import calculate_pehash
     HAVE_PEHASH = True
 except ImportError:
     HAVE_PEHASH = False
@@ -33,7 +31,8 @@ from lib.common.out import bold, table
 from lib.common.abstracts import Module
 from lib.common.utils import get_type, get_md5
 from lib.core.database import Database
-from lib.core.storage import get_sample_path
+from lib.core.peindex import update_index, get_peid_matches, get_certificate
+from lib.core.storage import open_sample
 from lib.core.session import __sessions__
 
 
@@ -41,6 +40,9 @@ class PE(Module):
     cmd = 'pe'
     description = 'Extract information from PE32 headers'
     authors = ['nex', 'Statixs']
+    cacheable = True
+    uncached_args = ('all', 'cluster', 'scan', 'dump', 'open')
+    cache_dependencies = ('lib/core/peindex.py', 'data/peid/UserDB.TXT', 'modules/reversing/viper/pehash')
 
     def __init__(self):
         super(PE, self).__init__()
@@ -84,8 +86,15 @@ class PE(Module):
         parser_peh.add_argument('-c', '--cluster', action='store_true', help='Calculate and cluster all files in the project')
         parser_peh.add_argument('-s', '--scan', action='store_true', help='Scan repository for matching samples')
 
+        parser_idx = subparsers.add_parser('index', help='Build the PE feature index used by the scan and cluster options')
+        parser_idx.add_argument('-r', '--rebuild', action='store_true', help='Drop the existing index and parse all samples again')
+
         self.pe = None
 
+    def is_cacheable(self):
+        # The index is about the whole repository.
+        return self.args.subname != 'index' and super(PE, self).is_cacheable()
+
     def __check_session(self):
         if not __sessions__.is_set():
             self.log('error', "No session opened")
@@ -100,6 +109,25 @@ class PE(Module):
 
         return True
 
+    def __get_index(self):
+        # Make sure that all stored samples are present in the PE feature
+        # index before querying it.
+        db = Database()
+        count = update_index(db)
+        if count:
+            self.log('info', "Indexed {0} new samples".format(count))
+
+        return db
+
+    def index(self):
+        db = Database()
+        if self.args.rebuild:
+            db.clear_pe_features()
+
+        self.log('info', "Indexing the repository...")
+        count = update_index(db)
+        self.log('info', "{0} samples indexed".format(bold(count)))
+
     def imports(self):
         if not self.__check_session():
             return
@@ -128,55 +156,25 @@ class PE(Module):
             return
 
         if self.args.all:
-            db = Database()
-            samples = db.find(key='all')
+            db = self.__get_index()
 
             rows = []
-            for sample in samples:
-                sample_path = get_sample_path(sample.sha256)
-                if not os.path.exists(sample_path):
-                    continue
-
-                try:
-                    cur_ep = pefile.PE(sample_path).OPTIONAL_HEADER.AddressOfEntryPoint
-                except:
-                    continue
-
-                rows.append([sample.md5, sample.name, cur_ep])
+            for sample, features in db.find_pe_features('entrypoint'):
+                rows.append([sample.md5, sample.name, features.entrypoint])
 
             self.log('table', dict(header=['MD5', 'Name', 'AddressOfEntryPoint'], rows=rows))
 
             return
 
         if self.args.cluster:
-            db = Database()
-            samples = db.find(key='all')
-
-            cluster = {}
-            for sample in samples:
-                sample_path = get_sample_path(sample.sha256)
-                if not os.path.exists(sample_path):
-                    continue
-
-                try:
-                    cur_ep = pefile.PE(sample_path).OPTIONAL_HEADER.AddressOfEntryPoint
-                except:
-                    continue
-
-                if cur_ep not in cluster:
-                    cluster[cur_ep] = []
-
-                cluster[cur_ep].append([sample.md5, sample.name])
-
-            for cluster_name, cluster_members in cluster.items():
-                # Skipping clusters with only one entry.
-                if len(cluster_members) == 1:
-                    continue
+            db = self.__get_index()
 
+            # Clusters with only one entry are already skipped by the query.
+            for cluster_name, cluster_members in db.cluster_pe_features('entrypoint').items():
                 self.log('info', "AddressOfEntryPoint cluster {0}".format(bold(cluster_name)))
 
                 self.log('table', dict(header=['MD5', 'Name'],
-                    rows=cluster_members))
+                    rows=[[sample.md5, sample.name] for sample in cluster_members]))
 
             return
 
@@ -188,25 +186,11 @@ class PE(Module):
         self.log('info', "AddressOfEntryPoint: {0}".format(ep))
 
         if self.args.scan:
-            db = Database()
-            samples = db.find(key='all')
+            db = self.__get_index()
 
             rows = []
-            for sample in samples:
-                if sample.sha256 == __sessions__.current.file.sha256:
-                    continue
-
-                sample_path = get_sample_path(sample.sha256)
-                if not os.path.exists(sample_path):
-                    continue
-
-                try:
-                    cur_ep = pefile.PE(sample_path).OPTIONAL_HEADER.AddressOfEntryPoint
-                except:
-                    continue
-
-                if ep == cur_ep:
-                    rows.append([sample.md5, sample.name])
+            for sample, features in db.find_pe_features('entrypoint', ep, exclude=__sessions__.current.file.sha256):
+                rows.append([sample.md5, sample.name])
 
             self.log('info', "Following are samples with AddressOfEntryPoint {0}".format(bold(ep)))
 
@@ -227,36 +211,19 @@ class PE(Module):
         if self.args.scan:
             self.log('info', "Scanning the repository for matching samples...")
 
-            db = Database()
-            samples = db.find(key='all')
-
-            matches = []
-            for sample in samples:
-                if sample.sha256 == __sessions__.current.file.sha256:
-                    continue
-
-                sample_path = get_sample_path(sample.sha256)
-                if not os.path.exists(sample_path):
-                    continue
-
-                try:
-                    cur_pe = pefile.PE(sample_path)
-                    cur_compile_time = get_compiletime(cur_pe)
-                except:
-                    continue
+            db = self.__get_index()
 
-                if compile_time == cur_compile_time:
-                    matches.append([sample.name, sample.md5, cur_compile_time])
-                else:
-                    if self.args.window:
-                        if cur_compile_time > compile_time:
-                            delta = (cur_compile_time - compile_time)
-                        elif cur_compile_time < compile_time:
-                            delta = (compile_time - cur_compile_time)
+            timestamp = self.pe.FILE_HEADER.TimeDateStamp
+            if self.args.window:
+                window = self.args.window * 60
+                value = (timestamp - window, timestamp + window)
+            else:
+                value = timestamp
 
-                        delta_minutes = int(delta.total_seconds()) / 60
-                        if delta_minutes <= self.args.window:
-                            matches.append([sample.name, sample.md5, cur_compile_time])
+            matches = []
+            for sample, features in db.find_pe_features('compiletime', value, exclude=__sessions__.current.file.sha256):
+                cur_compile_time = datetime.datetime.fromtimestamp(features.compiletime)
+                matches.append([sample.name, sample.md5, cur_compile_time])
 
             self.log('info', "{0} relevant matches found".format(bold(len(matches))))
 
@@ -264,58 +231,26 @@ class PE(Module):
                 self.log('table', dict(header=['Name', 'MD5', 'Compile Time'], rows=matches))
 
     def peid(self):
-
-        def get_signatures():
-            with file(os.path.join(CIRTKIT_ROOT, 'data/peid/UserDB.TXT'), 'rt') as f:
-                sig_data = f.read()
-
-            signatures = peutils.SignatureDatabase(data=sig_data)
-
-            return signatures
-
-        def get_matches(pe, signatures):
-            matches = signatures.match_all(pe, ep_only=True)
-            return matches
-
         if not self.__check_session():
             return
 
-        signatures = get_signatures()
-        peid_matches = get_matches(self.pe, signatures)
+        peid_matches = get_peid_matches(self.pe)
 
         if peid_matches:
             self.log('info', "PEiD Signatures:")
             for sig in peid_matches:
-                if type(sig) is list:
-                    self.log('item', sig[0])
-                else:
-                    self.log('item', sig)
+                self.log('item', sig)
         else:
             self.log('info', "No PEiD signatures matched.")
 
         if self.args.scan and peid_matches:
             self.log('info', "Scanning the repository for matching samples...")
 
-            db = Database()
-            samples = db.find(key='all')
+            db = self.__get_index()
 
             matches = []
-            for sample in samples:
-                if sample.sha256 == __sessions__.current.file.sha256:
-                    continue
-
-                sample_path = get_sample_path(sample.sha256)
-                if not os.path.exists(sample_path):
-                    continue
-
-                try:
-                    cur_pe = pefile.PE(sample_path)
-                    cur_peid_matches = get_matches(cur_pe, signatures)
-                except:
-                    continue
-
-                if peid_matches == cur_peid_matches:
-                    matches.append([sample.name, sample.sha256])
+            for sample, features in db.find_pe_features('peid', json.dumps(peid_matches), exclude=__sessions__.current.file.sha256):
+                matches.append([sample.name, sample.sha256])
 
             self.log('info', "{0} relevant matches found".format(bold(len(matches))))
 
@@ -411,7 +346,7 @@ class PE(Module):
             # Retrieve list of samples stored locally and available in the
             # database.
             db = Database()
-            samples = db.find(key='all')
+            samples = db.find_iter(columns=['sha256', 'name', 'md5'])
 
             matches = []
             for sample in samples:
@@ -419,14 +354,17 @@ class PE(Module):
                 if sample.sha256 == __sessions__.current.file.sha256:
                     continue
 
-                # Obtain path to the binary.
-                sample_path = get_sample_path(sample.sha256)
-                if not os.path.exists(sample_path):
+                # Read the binary straight from the store.
+                handle = open_sample(sample.sha256)
+                if not handle:
                     continue
 
+                with handle:
+                    data = handle.read()
+
                 # Open PE instance.
                 try:
-                    cur_pe = pefile.PE(sample_path)
+                    cur_pe = pefile.PE(data=data)
                 except:
                     continue
 
@@ -459,34 +397,14 @@ class PE(Module):
         if self.args.cluster:
             self.log('info', "Clustering all samples by imphash...")
 
-            db = Database()
-            samples = db.find(key='all')
-
-            cluster = {}
-            for sample in samples:
-                sample_path = get_sample_path(sample.sha256)
-                if not os.path.exists(sample_path):
-                    continue
-
-                try:
-                    cur_imphash = pefile.PE(sample_path).get_imphash()
-                except:
-                    continue
-
-                if cur_imphash not in cluster:
-                    cluster[cur_imphash] = []
-
-                cluster[cur_imphash].append([sample.sha256, sample.name])
-
-            for cluster_name, cluster_members in cluster.items():
-                # Skipping clusters with only one entry.
-                if len(cluster_members) == 1:
-                    continue
+            db = self.__get_index()
 
+            # Clusters with only one entry are already skipped by the query.
+            for cluster_name, cluster_members in db.cluster_pe_features('imphash').items():
                 self.log('info', "Imphash cluster {0}".format(bold(cluster_name)))
 
                 self.log('table', dict(header=['MD5', 'Name'],
-                    rows=cluster_members))
+                    rows=[[sample.md5, sample.name] for sample in cluster_members]))
 
             return
 
@@ -502,25 +420,11 @@ class PE(Module):
             if self.args.scan:
                 self.log('info', "Scanning the repository for matching samples...")
 
-                db = Database()
-                samples = db.find(key='all')
+                db = self.__get_index()
 
                 matches = []
-                for sample in samples:
-                    if sample.sha256 == __sessions__.current.file.sha256:
-                        continue
-
-                    sample_path = get_sample_path(sample.sha256)
-                    if not os.path.exists(sample_path):
-                        continue
-
-                    try:
-                        cur_imphash = pefile.PE(sample_path).get_imphash()
-                    except:
-                        continue
-
-                    if imphash == cur_imphash:
-                        matches.append([sample.name, sample.sha256])
+                for sample, features in db.find_pe_features('imphash', imphash, exclude=__sessions__.current.file.sha256):
+                    matches.append([sample.name, sample.sha256])
 
                 self.log('info', "{0} relevant matches found".format(bold(len(matches))))
 
@@ -529,53 +433,15 @@ class PE(Module):
 
     def security(self):
 
-        def get_certificate(pe):
-            # TODO: this only extract the raw list of certificate data.
-            # I need to parse them, extract single certificates and perhaps return
-            # the PEM data of the first certificate only.
-            pe_security_dir = pefile.DIRECTORY_ENTRY['IMAGE_DIRECTORY_ENTRY_SECURITY']
-            address = pe.OPTIONAL_HEADER.DATA_DIRECTORY[pe_security_dir].VirtualAddress
-            #  size = pe.OPTIONAL_HEADER.DATA_DIRECTORY[pe_security_dir].Size
-
-            if address:
-                return pe.write()[address + 8:]
-            else:
-                return None
-
         def get_signed_samples(current=None, cert_filter=None):
-            db = Database()
-            samples = db.find(key='all')
+            db = self.__get_index()
 
             results = []
-            for sample in samples:
-                # Skip if it's the same file.
-                if current:
-                    if sample.sha256 == current:
-                        continue
-
-                # Obtain path to the binary.
-                sample_path = get_sample_path(sample.sha256)
-                if not os.path.exists(sample_path):
-                    continue
-
-                # Open PE instance.
-                try:
-                    cur_pe = pefile.PE(sample_path)
-                except:
-                    continue
-
-                cur_cert_data = get_certificate(cur_pe)
-
-                if not cur_cert_data:
-                    continue
-
-                cur_cert_md5 = get_md5(cur_cert_data)
-
+            for sample, features in db.find_pe_features('cert_md5', cert_filter, exclude=current):
                 if cert_filter:
-                    if cur_cert_md5 == cert_filter:
-                        results.append([sample.name, sample.md5])
+                    results.append([sample.name, sample.sha256])
                 else:
-                    results.append([sample.name, sample.md5, cur_cert_md5])
+                    results.append([sample.name, sample.md5, features.cert_md5])
 
             return results
 
@@ -801,7 +667,7 @@ class PE(Module):
         language = find_language(
             get_iat(self.pe),
             __sessions__.current.file,
-            __sessions__.current.file.data
+            __sessions__.current.file.buffer
         )
 
         if language:
@@ -814,20 +680,22 @@ class PE(Module):
             self.log('info', "Scanning the repository for matching samples...")
 
             db = Database()
-            samples = db.find(key='all')
+            samples = db.find_iter(columns=['sha256', 'name', 'md5'])
 
             matches = []
             for sample in samples:
                 if sample.sha256 == __sessions__.current.file.sha256:
                     continue
 
-                sample_path = get_sample_path(sample.sha256)
-
-                if not os.path.exists(sample_path):
+                handle = open_sample(sample.sha256)
+                if not handle:
                     continue
 
+                with handle:
+                    data = handle.read()
+
                 try:
-                    cur_pe = pefile.PE(sample_path)
+                    cur_pe = pefile.PE(data=data)
                 except pefile.PEFormatError as e:
                     continue
 
@@ -838,7 +706,7 @@ class PE(Module):
                 cur_language = find_language(
                     get_iat(cur_pe),
                     sample,
-                    open(sample_path, 'rb').read()
+                    data
                 )
 
                 if not cur_language:
@@ -879,18 +747,13 @@ class PE(Module):
             current_pehash = calculate_pehash(__sessions__.current.file.path)
             self.log('info', "PEhash: {0}".format(bold(current_pehash)))
 
-        if self.args.all or self.args.cluster or self.args.scan:
-            db = Database()
-            samples = db.find(key='all')
+        if self.args.all:
+            db = self.__get_index()
 
             rows = []
-            for sample in samples:
-                sample_path = get_sample_path(sample.sha256)
-                pe_hash = calculate_pehash(sample_path)
-                if pe_hash:
-                    rows.append((sample.name, sample.md5, pe_hash))
+            for sample, features in db.find_pe_features('pehash'):
+                rows.append([sample.name, sample.md5, features.pehash])
 
-        if self.args.all:
             self.log('info', "PEhash for all files:")
             header = ['Name', 'MD5', 'PEhash']
             self.log('table', dict(header=header, rows=rows))
@@ -898,26 +761,21 @@ class PE(Module):
         elif self.args.cluster:
             self.log('info', "Clustering files by PEhash...")
 
-            cluster = {}
-            for sample_name, sample_md5, pe_hash in rows:
-                cluster.setdefault(pe_hash, []).append([sample_name, sample_md5])
-
-            for item in cluster.items():
-                if len(item[1]) > 1:
-                    self.log('info', "PEhash cluster {0}:".format(bold(item[0])))
-                    self.log('table', dict(header=['Name', 'MD5'], rows=item[1]))
+            db = self.__get_index()
+            for cluster_name, cluster_members in db.cluster_pe_features('pehash').items():
+                self.log('info', "PEhash cluster {0}:".format(bold(cluster_name)))
+                self.log('table', dict(header=['Name', 'MD5'],
+                    rows=[[sample.name, sample.md5] for sample in cluster_members]))
 
         elif self.args.scan:
             if __sessions__.is_set() and current_pehash:
                 self.log('info', "Finding matching samples...")
 
-                matches = []
-                for row in rows:
-                    if row[1] == __sessions__.current.file.md5:
-                        continue
+                db = self.__get_index()
 
-                    if row[2] == current_pehash:
-                        matches.append([row[0], row[1]])
+                matches = []
+                for sample, features in db.find_pe_features('pehash', current_pehash, exclude=__sessions__.current.file.sha256):
+                    matches.append([sample.name, sample.md5])
 
                 if matches:
                     self.log('table', dict(header=['Name', 'MD5'], rows=matches))
@@ -955,3 +813,5 @@ class PE(Module):
             self.pehash()
         elif self.args.subname == 'entrypoint':
             self.entrypoint()
+        elif self.args.subname == 'index':
+            self.index()
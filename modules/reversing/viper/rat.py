@@ -14,16 +14,14 @@ try:
 except ImportError:
     from os import walk
 
-try:
-    import yara
-    HAVE_YARA = True
-except ImportError:
-    HAVE_YARA = False
+from lib.core.yararules import HAVE_YARA, get_rules
 
 class RAT(Module):
     cmd = 'rat'
     description = 'Extract information from known RAT families'
     authors = ['Kevin Breen', 'nex']
+    cacheable = True
+    cache_dependencies = ('modules/rats', 'data/yara/rats.yara')
 
     def __init__(self):
         super(RAT, self).__init__()
@@ -76,7 +74,7 @@ class RAT(Module):
             self.log('error', "No session opened")
             return
 
-        rules = yara.compile(os.path.join(CIRTKIT_ROOT, 'data/yara/rats.yara'))
+        rules, version = get_rules(os.path.join(CIRTKIT_ROOT, 'data/yara/rats.yara'))
         for match in rules.match(__sessions__.current.file.path):
             if 'family' in match.meta:
                 self.log('info', "Automatically detected supported RAT {0}".format(match.rule))
@@ -13,6 +13,7 @@ class Shellcode(Module):
     cmd = 'shellcode'
     description = 'Search for known shellcode patterns'
     authors = ['Kevin Breen', 'nex']
+    cacheable = True
 
     def __init__(self):
         super(Shellcode, self).__init__()
@@ -84,8 +85,8 @@ class Shellcode(Module):
 
         for entry in collection:
             for pattern in entry['patterns']:
-                match = re.search(pattern, __sessions__.current.file.data)
+                match = re.search(pattern, __sessions__.current.file.buffer)
                 if match:
                     offset = match.start()
                     self.log('info', "{0} pattern matched at offset {1}".format(entry['description'], offset))
-                    self.log('', cyan(hexdump(__sessions__.current.file.data[offset:], maxlines=15)))
+                    self.log('', cyan(hexdump(bytes(__sessions__.current.file.get_view(offset, 16 * 15)), maxlines=15)))
@@ -69,6 +69,7 @@ class Strings(Module):
     cmd = 'strings'
     description = 'Extract strings from file'
     authors = ['nex', 'Brian Wallace']
+    cacheable = True
 
     def __init__(self):
         super(Strings, self).__init__()
@@ -113,7 +114,9 @@ class Strings(Module):
 
         if os.path.exists(__sessions__.current.file.path):
             regexp = '[\x20\x30-\x39\x41-\x5a\x61-\x7a\-\.:]{4,}'
-            strings = re.findall(regexp, __sessions__.current.file.data)
+            # The strings are output as they are found, rather than all
+            # collected first.
+            strings = (match.group(0) for match in re.finditer(regexp, __sessions__.current.file.buffer))
 
         if arg_all:
             for entry in strings:
@@ -1,25 +1,234 @@
 # This file is part of Viper - https://github.com/viper-framework/viper
 # See the file 'LICENSE' for copying permission.
 
-# TODO
-# ROL, ROR
-
 import os
+import string
+import binascii
+
+try:
+    import numpy
+    HAVE_NUMPY = True
+except ImportError:
+    HAVE_NUMPY = False
 
 from lib.common.abstracts import Module
 from lib.core.session import __sessions__
 
+# The file is processed in chunks of this size, so that memory usage stays
+# bounded on large samples.
+CHUNK_SIZE = 16 * 1024 * 1024
+# Minimum number of bytes of a term left once the key is cancelled out.
+# Shorter terms would match almost anywhere.
+MIN_DELTA = 3
+
+
+def get_chunks(data, overlap):
+    start = 0
+    while start < len(data):
+        yield start, data[start:start + CHUNK_SIZE + overlap]
+        start += CHUNK_SIZE
+
+
+def find_all(haystack, needle):
+    offset = haystack.find(needle)
+    while offset != -1:
+        yield offset
+        offset = haystack.find(needle, offset + 1)
+
+
+def to_int(data):
+    return int(binascii.hexlify(data), 16)
+
+
+def from_int(value, size):
+    return binascii.unhexlify('%0*x' % (2 * size, value))
+
+
+def xor_delta(data, lag):
+    # Returns data[i] ^ data[i + lag] for each position. XORing the data with
+    # any key of length lag doesn't change this stream, so all the keys can be
+    # searched at once by looking for the stream of the plain term.
+    size = len(data) - lag
+    if size <= 0:
+        return b''
+
+    if HAVE_NUMPY:
+        array = numpy.frombuffer(data, dtype=numpy.uint8)
+        return (array[lag:] ^ array[:-lag]).tobytes()
+
+    # NumPy is optional, without it we let Python's big integers do the work
+    # in C. Same results, a few times slower.
+    value = to_int(data)
+    delta = (value ^ (value >> (8 * lag))) & ((1 << (8 * size)) - 1)
+    return from_int(delta, size)
+
+
+def add_delta(data):
+    # Same as above for ADD/SUB: data[i + 1] - data[i] doesn't depend on the
+    # key added to every byte.
+    size = len(data) - 1
+    if size <= 0:
+        return b''
+
+    if HAVE_NUMPY:
+        array = numpy.frombuffer(data, dtype=numpy.uint8)
+        return (array[1:] - array[:-1]).tobytes()
+
+    # Bytewise subtraction on big integers, with the high bit of each byte
+    # set beforehand so that borrows don't propagate to the next byte.
+    high = to_int(b'\x80' * size)
+    ones = (1 << (8 * size)) - 1
+    x = to_int(data[1:])
+    y = to_int(data[:-1])
+    delta = ((x | high) - (y & ~high & ones)) ^ ((x ^ (ones ^ y)) & high)
+    return from_int(delta, size)
+
+
+def has_shorter_period(key):
+    for period in range(1, len(key)):
+        if len(key) % period == 0 and key == key[:period] * (len(key) // period):
+            return True
+
+    return False
+
+
+def search_delta(data, terms, lag, delta, recover):
+    # Generic search of the delta streams of the terms in the one of the data.
+    # recover() is given the matching data and term and returns the key.
+    results = set()
+
+    terms = [term for term in terms if len(term) - lag >= MIN_DELTA]
+    if not terms:
+        return results
+
+    term_deltas = [(term, delta(term)) for term in terms]
+    overlap = max(len(term) for term in terms)
+
+    for start, chunk in get_chunks(data, overlap):
+        chunk_delta = delta(chunk)
+        for term, term_delta in term_deltas:
+            for offset in find_all(chunk_delta, term_delta):
+                key = recover(bytearray(chunk[offset:offset + lag]), bytearray(term[:lag]), start + offset)
+                if key:
+                    results.add((term, key))
+
+    return results
+
+
+def xor_search(data, terms, key_size):
+    results = set()
+
+    for lag in range(1, key_size + 1):
+        def recover(data_bytes, term_bytes, position):
+            # Align the key on the beginning of the file.
+            key = bytearray(lag)
+            for i in range(lag):
+                key[(position + i) % lag] = data_bytes[i] ^ term_bytes[i]
+
+            key = bytes(key)
+            # Skip the plain text and the keys already found with a shorter
+            # length.
+            if not key.strip(b'\x00') or has_shorter_period(key):
+                return None
+
+            return key
+
+        results |= search_delta(data, terms, lag, lambda value: xor_delta(value, lag), recover)
+
+    return results
+
+
+def add_search(data, terms):
+    def recover(data_bytes, term_bytes, position):
+        key = (data_bytes[0] - term_bytes[0]) % 256
+        return key or None
+
+    return search_delta(data, terms, 1, add_delta, recover)
+
+
+def search_encoded(data, patterns):
+    # Look for a list of (encoded term, result) in a single pass over the data.
+    results = set()
+    if not patterns:
+        return results
+
+    overlap = max(len(encoded) for encoded, result in patterns)
+    for start, chunk in get_chunks(data, overlap):
+        for encoded, result in patterns:
+            if result not in results and chunk.find(encoded) != -1:
+                results.add(result)
+
+    return results
+
+
+def rol(value, count):
+    return ((value << count) | (value >> (8 - count))) & 0xff
+
+
+def rol_search(data, terms):
+    # There are only seven rotations, so we encode the terms rather than
+    # decoding the data.
+    patterns = []
+    for count in range(1, 8):
+        table = bytes(bytearray(rol(i, count) for i in range(256)))
+        for term in terms:
+            patterns.append((term.translate(table), (term, count)))
+
+    return search_encoded(data, patterns)
+
+
+def rot_table(key):
+    lower = string.ascii_lowercase
+    upper = string.ascii_uppercase
+    return string.maketrans(lower + upper, lower[key:] + lower[:key] + upper[key:] + upper[:key])
+
+
+def rot_search(data, terms):
+    patterns = []
+    for key in range(1, 26):
+        table = rot_table(key)
+        for term in terms:
+            # Terms without letters are left unchanged by ROT.
+            encoded = term.translate(table)
+            if encoded != term:
+                patterns.append((encoded, (term, key)))
+
+    return search_encoded(data, patterns)
+
+
+def decode(data, mode, key):
+    data = bytes(data[:])
+
+    if mode == 'xor':
+        key = bytearray(key)
+        decoded = bytearray(data)
+        for i in range(len(key)):
+            table = bytes(bytearray(j ^ key[i] for j in range(256)))
+            decoded[i::len(key)] = data[i::len(key)].translate(table)
+        return bytes(decoded)
+    elif mode == 'add':
+        return data.translate(bytes(bytearray((i - key) % 256 for i in range(256))))
+    elif mode == 'rol':
+        return data.translate(bytes(bytearray(rol(i, 8 - key) for i in range(256))))
+    elif mode == 'rot':
+        return data.translate(rot_table(26 - key))
+
 
 class XorSearch(Module):
     cmd = 'xor'
     description = 'Search for xor Strings'
     authors = ['Kevin Breen', 'nex']
+    cacheable = True
+    uncached_args = ('output',)
 
     def __init__(self):
         super(XorSearch, self).__init__()
         self.parser.add_argument('-s', '--search', metavar='terms', nargs='+', help='Specify a custom term to search')
         self.parser.add_argument('-x', '--xor', action='store_true', help='Search XOR (default)')
+        self.parser.add_argument('-k', '--key-size', type=int, default=1, help='Maximum length in bytes of the XOR keys (default 1)')
         self.parser.add_argument('-r', '--rot', action='store_true', help='Search ROT')
+        self.parser.add_argument('-l', '--rol', action='store_true', help='Search ROL/ROR')
+        self.parser.add_argument('-d', '--add', action='store_true', help='Search ADD/SUB')
         self.parser.add_argument('-a', '--all', action='store_true', help='Attempt search with all available modes')
         self.parser.add_argument('-o', '--output', metavar='path', help='Save Decoded Data')
 
@@ -29,11 +238,10 @@ class XorSearch(Module):
             'GetSystemDirectory',
             'CreateFile',
             'IsBadReadPtr',
-            'IsBadWritePtr'
+            'IsBadWritePtr',
             'GetProcAddress',
             'LoadLibrary',
             'WinExec',
-            'CreateFile'
             'ShellExecute',
             'CloseHandle',
             'UrlDownloadToFile',
@@ -46,48 +254,21 @@ class XorSearch(Module):
             'http'
         ]
 
-        def xordata(data, key):
-            encoded = bytearray(data)
-            for i in range(len(encoded)):
-                encoded[i] ^= key
-            return encoded
-
-        def rotdata(data, key):
-            encoded = ''
-            for char in data:
-                if char.isalpha():
-                    num = ord(char)
-                    num -= key
-                    if num == ord('z') or num == ord('Z'):
-                        num += 26
-                    elif num == ord('a') or num == ord('A'):
-                        num -= 26
-                    encoded += chr(num)
-            return encoded.lower()
-
-        def xor_search(terms, save_path):
-            for key in range(1, 256):
-                found = False
-                xored = xordata(__sessions__.current.file.data, key)
-                for term in terms:
-                    if term in xored:
-                        found = True
-                        self.log('error', "Matched: {0} with key: {1}".format(term, hex(key)))
-                if found and save_path:
-                    save_output(xored, save_path, key)
-
-        def rot_search(terms, save_path):
-            for key in range(1, 25):
-                found = False
-                roted = rotdata(__sessions__.current.file.data, key)
-                for term in terms:
-                    if term.lower() in roted:
-                        found = True
-                        self.log('error', "Matched: {0} with ROT: {1}".format(term, key))
-                if found and save_path:
-                    save_output(roted, save_path, key)
-
-        def save_output(data, save_path, key):
+        def format_key(mode, key):
+            if mode == 'xor':
+                return '0x' + binascii.hexlify(key)
+
+            return str(key)
+
+        def report(mode, label, results, save_path):
+            for term, key in sorted(results):
+                self.log('error', "Matched: {0} with {1}: {2}".format(term, label, format_key(mode, key)))
+
+            if save_path:
+                for key in sorted(set(key for term, key in results)):
+                    save_output(decode(__sessions__.current.file.buffer, mode, key), save_path, mode, format_key(mode, key))
+
+        def save_output(data, save_path, mode, key):
             # Path Validation
             if not os.path.exists(save_path):
                 try:
@@ -99,7 +280,7 @@ class XorSearch(Module):
                 if not os.path.isdir(save_path):
                     self.log('error', "You need to specify a folder not a file")
                     return
-            save_name = "{0}/{1}_{2}.bin".format(save_path, __sessions__.current.file.name, str(hex(key)))
+            save_name = "{0}/{1}_{2}_{3}.bin".format(save_path, __sessions__.current.file.name, mode, key)
             with open(save_name, 'wb') as output:
                 output.write(data)
             self.log('info', "Saved Output to {0}".format(save_name))
@@ -114,26 +295,51 @@ class XorSearch(Module):
 
         xor = self.args.xor
         rot = self.args.rot
+        rol = self.args.rol
+        add = self.args.add
         save_path = self.args.output
 
-        if not xor and not rot:
+        if not xor and not rot and not rol and not add:
             xor = True
         if self.args.search is not None:
             terms = self.args.search
         if self.args.all:
             xor = True
             rot = True
+            rol = True
+            add = True
 
         self.log('info', "Searching for the following strings:")
         for term in terms:
             self.log('item', term)
 
-        self.log('info', "Hold on, this might take a while...")
+        data = __sessions__.current.file.buffer
 
         if xor:
             self.log('info', "Searching XOR")
-            xor_search(terms, save_path)
+            key_size = max(self.args.key_size, 1)
+            # The search needs a few bytes of the term left once the key is
+            # cancelled out, see MIN_DELTA.
+            for term in terms:
+                if len(term) < key_size + MIN_DELTA:
+                    longest = len(term) - MIN_DELTA
+                    if longest < 1:
+                        self.log('warning', "Term {0} is too short to be searched".format(term))
+                    else:
+                        self.log('warning', "Term {0} is only searched with keys of length up to {1}".format(term, longest))
+            report('xor', 'key', xor_search(data, terms, key_size), save_path)
 
         if rot:
             self.log('info', "Searching ROT")
-            rot_search(terms, save_path)
+            report('rot', 'ROT', rot_search(data, terms), save_path)
+
+        if rol:
+            self.log('info', "Searching ROL")
+            report('rol', 'ROL', rol_search(data, terms), save_path)
+
+        if add:
+            self.log('info', "Searching ADD")
+            for term in terms:
+                if len(term) < 1 + MIN_DELTA:
+                    self.log('warning', "Term {0} is too short to be searched".format(term))
+            report('add', 'ADD', add_search(data, terms), save_path)
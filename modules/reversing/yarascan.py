@@ -2,7 +2,7 @@
 # See the file 'LICENSE' for copying permission.
 
 import os
-import tempfile
+import binascii
 import string as printstring  # string is being used as a var - easier to replace here
 
 try:
@@ -11,16 +11,13 @@ except ImportError:
     from os import walk
 
 from lib.common.abstracts import Module
+from lib.common.out import print_info
 from lib.core.database import Database
 from lib.core.session import __sessions__
-from lib.core.storage import get_sample_path
-from lib.common.constants import CIRTKIT_ROOT
+from lib.core.yararules import HAVE_YARA, RULES_PATH, get_rules, get_matches, scan_samples
 
-try:
-    import yara
-    HAVE_YARA = True
-except ImportError:
-    HAVE_YARA = False
+# Number of scan results committed to the database in a single transaction.
+BATCH_SIZE = 100
 
 
 class YaraScan(Module):
@@ -32,14 +29,16 @@ class YaraScan(Module):
         super(YaraScan, self).__init__()
         subparsers = self.parser.add_subparsers(dest='subname')
         parser_scan = subparsers.add_parser('scan', help='Scan files with Yara signatures')
-        parser_scan.add_argument('-r', '--rule', help='Specify a ruleset file path (default will run CIRTKIT_ROOT/data/yara/index.yara)')
+        parser_scan.add_argument('-r', '--rule', help='Specify a ruleset file path (default will run all the rules in CIRTKIT_ROOT/data/yara)')
         parser_scan.add_argument('-a', '--all', action='store_true', help='Scan all stored files (default if no session is open)')
         parser_scan.add_argument('-t', '--tag', action='store_true', help='Tag Files with Rule Name (default is not to)')
+        parser_scan.add_argument('-j', '--jobs', type=int, help='Number of worker processes when scanning all stored files (default is the number of CPUs)')
+        parser_scan.add_argument('--rescan', action='store_true', help='Scan again the files already scanned with the same rules')
 
         parser_rules = subparsers.add_parser('rules', help='Operate on Yara rules')
         parser_rules.add_argument('-e', '--edit', help='Open an editor to edit the specified rule')
 
-        self.rule_path = os.path.join(CIRTKIT_ROOT, 'data/yara')
+        self.rule_path = RULES_PATH
 
     def scan(self):
 
@@ -53,122 +52,138 @@ class YaraScan(Module):
                     new_line += '\\x' + c.encode('hex')
             return new_line
 
-        # This means users can just drop or remove rule files without
-        # having to worry about maintaining the index.
-        # TODO: make paths absolute.
-        # TODO: this regenerates the file at every run, perhaps we
-        # could find a way to optimize this.
-        def rule_index():
-            tmp_path = os.path.join(tempfile.gettempdir(), 'index.yara')
-            with open(tmp_path, 'w') as rules_index:
-                for rule_file in os.listdir(self.rule_path):
-                    # Skip if the extension is not right, could cause problems.
-                    if not rule_file.endswith('.yar') and not rule_file.endswith('.yara'):
-                        continue
-                    # Skip if it's the index itself.
-                    if rule_file == 'index.yara':
-                        continue
-
-                    # Add the rule to the index.
-                    line = 'include "{0}"\n'.format(os.path.join(self.rule_path, rule_file))
-                    rules_index.write(line)
-
-            return tmp_path
+        def report(name, sha256, matches):
+            rows = []
+            for match in matches:
+                # Add a row for each string matched by the rule.
+                for offset, identifier, data in match['strings']:
+                    rows.append([match['rule'], string_printable(identifier), string_printable(offset), string_printable(binascii.unhexlify(data))])
+
+            if rows:
+                self.log('info', "Matched {0} ({1})".format(name, sha256))
+                header = [
+                    'Rule',
+                    'String',
+                    'Offset',
+                    'Content'
+                ]
+                self.log('table', dict(header=header, rows=rows))
+
+        def get_tags(sha256, matches):
+            # Returns the (sha256, tags) pairs to add for the given matches.
+            pairs = []
+            for match in matches:
+                # Add matching rules to our list of tags.
+                # First it checks if there are tags specified in the metadata
+                # of the Yara rule.
+                match_tags = match['tags']
+                # If not, use the rule name.
+                # TODO: as we add more and more yara rules, we might remove
+                # this option and only tag the file with rules that had
+                # tags specified in them.
+                if not match_tags:
+                    match_tags = match['rule']
+
+                pairs.append((sha256, match_tags))
+
+            return pairs
 
         arg_rule = self.args.rule
         arg_scan_all = self.args.all
         arg_tag = self.args.tag
 
-        # If no custom ruleset is specified, we use the default one.
-        if not arg_rule:
-            arg_rule = rule_index()
-
         # Check if the selected ruleset actually exists.
-        if not os.path.exists(arg_rule):
+        if arg_rule and not os.path.exists(arg_rule):
             self.log('error', "No valid Yara ruleset at {0}".format(arg_rule))
             return
 
-        # Compile all rules from given ruleset.
-        rules = yara.compile(arg_rule)
-        files = []
+        # Load the compiled rules from given ruleset, or all the rules in
+        # data/yara if none is specified. They are only compiled again when
+        # the rule files change.
+        rules, version = get_rules(arg_rule)
 
         # If there is a session open and the user didn't specifically
-        # request to scan the full repository, we just add the currently
-        # opened file's path.
+        # request to scan the full repository, we just scan the currently
+        # opened file.
         if __sessions__.is_set() and not arg_scan_all:
-            files.append(__sessions__.current.file)
-        # Otherwise we loop through all files in the repository and queue
-        # them up for scan.
-        else:
-            self.log('info', "Scanning all stored files...")
-
-            db = Database()
-            samples = db.find(key='all')
-
-            for sample in samples:
-                files.append(sample)
-
-        for entry in files:
+            entry = __sessions__.current.file
             if entry.size == 0:
-                continue
+                return
 
             self.log('info', "Scanning {0} ({1})".format(entry.name, entry.sha256))
 
-            # Check if the entry has a path attribute. This happens when
-            # there is a session open. We need to distinguish this just for
-            # the cases where we're scanning an opened file which has not been
-            # stored yet.
-            if hasattr(entry, 'path'):
-                entry_path = entry.path
-            # This should be triggered only when scanning the full repository.
-            else:
-                entry_path = get_sample_path(entry.sha256)
-
             # Check if the file exists before running the yara scan.
-            if not os.path.exists(entry_path):
-                self.log('error', "The file does not exist at path {0}".format(entry_path))
+            if not os.path.exists(entry.path):
+                self.log('error', "The file does not exist at path {0}".format(entry.path))
                 return
 
-            rows = []
-            tag_list = []
-            for match in rules.match(entry_path):
-                # Add a row for each string matched by the rule.
-                for string in match.strings:
-                    rows.append([match.rule, string_printable(string[1]), string_printable(string[0]), string_printable(string[2])])
+            matches = get_matches(rules.match(entry.path))
+            report(entry.name, entry.sha256, matches)
 
-                # Add matching rules to our list of tags.
-                # First it checks if there are tags specified in the metadata
-                # of the Yara rule.
-                match_tags = match.meta.get('tags')
-                # If not, use the rule name.
-                # TODO: as we add more and more yara rules, we might remove
-                # this option and only tag the file with rules that had
-                # tags specified in them.
-                if not match_tags:
-                    match_tags = match.rule
+            # If we selected to add tags do that now.
+            if matches and arg_tag:
+                Database().add_tags_many(get_tags(entry.sha256, matches))
 
-                # Add the tags to the list.
-                tag_list.append([entry.sha256, match_tags])
+                # Reset the session to see tags.
+                self.log('info', "Refreshing session to update attributes...")
+                __sessions__.new(__sessions__.current.file.path)
 
-            if rows:
-                header = [
-                    'Rule',
-                    'String',
-                    'Offset',
-                    'Content'
-                ]
-                self.log('table', dict(header=header, rows=rows))
+            return
 
-            # If we selected to add tags do that now.
-            if rows and arg_tag:
-                db = Database()
-                for tag in tag_list:
-                    db.add_tags(tag[0], tag[1])
-
-                # If in a session reset the session to see tags.
-                if __sessions__.is_set() and not arg_scan_all:
-                    self.log('info', "Refreshing session to update attributes...")
-                    __sessions__.new(__sessions__.current.file.path)
+        # Otherwise we scan all files in the repository. Results are stored
+        # along with the version of the ruleset, so that only the samples
+        # that haven't been scanned yet with these rules are scanned again.
+        db = Database()
+        samples = [sample for sample in db.find_iter(columns=['sha256', 'name', 'size']) if sample.size != 0]
+        names = dict((sample.sha256, sample.name) for sample in samples)
+
+        if self.args.rescan:
+            scanned = set()
+        else:
+            scanned = db.get_yara_scanned(version)
+
+        # Show the stored results of the samples already scanned.
+        stored = db.get_yara_matches(version)
+        for sample in samples:
+            if sample.sha256 in scanned and sample.sha256 in stored:
+                report(sample.name, sample.sha256, stored[sample.sha256])
+
+        # The workers get the samples from the store themselves.
+        pending = [sample.sha256 for sample in samples if sample.sha256 not in scanned]
+
+        self.log('info', "Scanning {0} stored files ({1} already scanned with this ruleset)...".format(
+            len(pending), len(samples) - len(pending)))
+
+        count = 0
+        results = []
+        for sha256, matches, error in scan_samples(pending, arg_rule, self.args.jobs):
+            count += 1
+            if error:
+                self.log('error', error)
+                continue
+
+            report(names[sha256], sha256, matches)
+            results.append((sha256, matches))
+
+            # Results are committed in batches, so an interrupted scan can be
+            # resumed from where it stopped.
+            if len(results) >= BATCH_SIZE:
+                db.add_yara_results(version, results)
+                results = []
+                print_info("Scanned {0}/{1} files".format(count, len(pending)))
+
+        if results:
+            db.add_yara_results(version, results)
+
+        # If we selected to add tags do that now.
+        # All the tags are added in a single transaction.
+        if arg_tag:
+            pairs = []
+            for sha256, matches in db.get_yara_matches(version).items():
+                if sha256 in names:
+                    pairs.extend(get_tags(sha256, matches))
+
+            db.add_tags_many(pairs)
 
     def rules(self):
         arg_edit = self.args.edit
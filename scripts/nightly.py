@@ -0,0 +1,14 @@
+# This file is part of Viper - https://github.com/viper-framework/viper
+# See the file 'LICENSE' for copying permission.
+
+from lib.common.abstracts import Script
+
+
+class Nightly(Script):
+    cmd = 'nightly'
+    description = 'Re-analyze all the stored files'
+    commands = [
+        'pe imphash',
+        'yara scan',
+        'strings -H'
+    ]
@@ -0,0 +1,17 @@
+# This file is part of Viper - https://github.com/viper-framework/viper
+# See the file 'LICENSE' for copying permission.
+
+import os
+import sys
+import atexit
+import shutil
+import tempfile
+
+# CIRTKIT keeps its databases and storage in the working directory, the tests
+# run in a temporary one. The root of the checkout stays importable.
+_tests_path = os.path.dirname(os.path.abspath(__file__))
+__path__ = [_tests_path]
+sys.path.insert(0, os.path.dirname(_tests_path))
+_work_path = tempfile.mkdtemp(prefix='cirtkit-tests-')
+os.chdir(_work_path)
+atexit.register(shutil.rmtree, _work_path, True)
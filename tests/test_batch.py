@@ -0,0 +1,54 @@
+# This file is part of Viper - https://github.com/viper-framework/viper
+# See the file 'LICENSE' for copying permission.
+
+import os
+import json
+import unittest
+
+from lib.core.batch import get_done
+
+COMMANDS = ['pe sections', 'strings -a']
+
+
+def record(sha256, status, commands=COMMANDS):
+    return json.dumps(dict(sha256=sha256, status=status, commands=commands)) + '\n'
+
+
+class GetDoneTest(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.abspath('results.jsonl')
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def write(self, data):
+        with open(self.path, 'w') as handle:
+            handle.write(data)
+
+    def test_missing_output(self):
+        self.assertEqual(get_done(self.path, COMMANDS), set())
+
+    def test_only_successful_samples(self):
+        self.write(record('a', 'ok') + record('b', 'error') + record('c', 'timeout') + record('d', 'missing'))
+        self.assertEqual(get_done(self.path, COMMANDS), set(['a']))
+
+    def test_failed_then_retried(self):
+        self.write(record('a', 'error') + record('a', 'ok'))
+        self.assertEqual(get_done(self.path, COMMANDS), set(['a']))
+
+    def test_other_commands(self):
+        self.write(record('a', 'ok', ['strings -a']) + record('b', 'ok'))
+        self.assertEqual(get_done(self.path, COMMANDS), set(['b']))
+
+    def test_truncated_record(self):
+        complete = record('a', 'ok')
+        self.write(complete + record('b', 'ok')[:20])
+
+        self.assertEqual(get_done(self.path, COMMANDS), set(['a']))
+        with open(self.path) as handle:
+            self.assertEqual(handle.read(), complete)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+# This file is part of Viper - https://github.com/viper-framework/viper
+# See the file 'LICENSE' for copying permission.
+
+import unittest
+
+from lib.core.ui.console import Console
+
+
+class SplitPipeTest(unittest.TestCase):
+    def setUp(self):
+        self.console = Console()
+
+    def test_pipe(self):
+        self.assertEqual(self.console.split_pipe('strings -a | head -3'), ('strings -a ', ' head -3'))
+
+    def test_no_pipe(self):
+        self.assertEqual(self.console.split_pipe('pe sections > out.txt'), ('pe sections > out.txt', None))
+
+    def test_pager(self):
+        self.assertEqual(self.console.split_pipe('strings -a |'), ('strings -a ', ''))
+
+    def test_quoted_pipe(self):
+        self.assertEqual(self.console.split_pipe('find name "cat|dog"'), ('find name "cat|dog"', None))
+        self.assertEqual(self.console.split_pipe("find name 'cat|dog' | less"), ("find name 'cat|dog' ", ' less'))
+
+    def test_escaped_pipe(self):
+        self.assertEqual(self.console.split_pipe('find name cat\\|dog'), ('find name cat\\|dog', None))
+
+    def test_backslash_in_single_quotes(self):
+        self.assertEqual(self.console.split_pipe("find name 'cat\\'|more"), ("find name 'cat\\'", 'more'))
+
+
+class ParseTest(unittest.TestCase):
+    def setUp(self):
+        self.console = Console()
+
+    def test_words(self):
+        self.assertEqual(self.console.parse('pe  sections'), ('pe', ['sections']))
+
+    def test_quoted_pipe(self):
+        command = self.console.split_pipe('find name "cat|dog"')[0]
+        self.assertEqual(self.console.parse(command), ('find', ['name', 'cat|dog']))
+
+    def test_escaped_pipe(self):
+        command = self.console.split_pipe('find name cat\\|dog')[0]
+        self.assertEqual(self.console.parse(command), ('find', ['name', 'cat|dog']))
+
+    def test_quoted_spaces(self):
+        self.assertEqual(self.console.parse("open -f '/tmp/a b.exe'"), ('open', ['-f', '/tmp/a b.exe']))
+
+    def test_unbalanced_quotes(self):
+        self.assertEqual(self.console.parse('find name "cat'), ('find', ['name', '"cat']))
+
+    def test_system_command(self):
+        self.assertTrue(self.console.is_system_command('echo one two'))
+        self.assertFalse(self.console.is_system_command('find all'))
+        self.assertFalse(self.console.is_system_command('exit'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+# This file is part of Viper - https://github.com/viper-framework/viper
+# See the file 'LICENSE' for copying permission.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from lib.core.database import Database
+
+
+class SyncNotesTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp(dir=os.getcwd())
+        self.notes = os.path.join(self.path, 'notes')
+        os.makedirs(self.notes)
+        self.db = Database(os.path.join(self.path, 'notes.db'))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write_note(self, title, body):
+        with open(os.path.join(self.notes, title), 'w') as handle:
+            handle.write(body)
+
+    def test_existing_notes(self):
+        self.write_note('first', 'alpha')
+        self.write_note('second', 'bravo')
+
+        notes = self.db.sync_notes(self.notes)
+        self.assertEqual([note.title for note in notes], ['first', 'second'])
+        self.assertEqual([note.title for note in self.db.search_notes('bravo')], ['second'])
+
+    def test_edited_and_deleted_notes(self):
+        self.write_note('first', 'alpha')
+        self.write_note('second', 'bravo')
+        ids = dict((note.title, note.id) for note in self.db.sync_notes(self.notes))
+
+        self.write_note('first', 'charlie')
+        os.remove(os.path.join(self.notes, 'second'))
+        notes = self.db.sync_notes(self.notes)
+
+        # Unchanged titles keep their IDs.
+        self.assertEqual([(note.id, note.title) for note in notes], [(ids['first'], 'first')])
+        self.assertEqual(self.db.search_notes('alpha'), [])
+        self.assertEqual(self.db.search_notes('bravo'), [])
+        self.assertEqual([note.id for note in self.db.search_notes('charlie')], [ids['first']])
+
+
+if __name__ == '__main__':
+    unittest.main()
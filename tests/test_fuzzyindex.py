@@ -0,0 +1,66 @@
+# This file is part of Viper - https://github.com/viper-framework/viper
+# See the file 'LICENSE' for copying permission.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from lib.core.database import Database, Malware
+from lib.core.fuzzyindex import get_ngrams, update_index
+
+FIRST = '96:abcdefghijklmn:ABCDEFGHIJ'
+# Shares a single 7-gram of the chunk with FIRST.
+SECOND = '96:zzhijklmnzz:QQQQQ'
+# Has twice the block size, its chunk is compared with the double chunk of
+# FIRST.
+THIRD = '192:xBCDEFGHx:yyy'
+OTHER = '96:opqrstuvwxyz:OPQRSTU'
+
+
+class GetNgramsTest(unittest.TestCase):
+    def test_chunks(self):
+        ngrams = get_ngrams('3:abcdefgh:ABCDEFG')
+        self.assertEqual(ngrams, set([(3, 'abcdefg'), (3, 'bcdefgh'), (6, 'ABCDEFG')]))
+
+    def test_short_chunks(self):
+        self.assertEqual(get_ngrams('3:abc:ab'), set())
+
+    def test_repeats(self):
+        # Like ssdeep, runs of more than three characters count as three.
+        self.assertEqual(get_ngrams('3:aaaaaaaabcd:x'), set())
+        self.assertEqual(get_ngrams('3:aaaaaaaabcde:x'), set([(3, 'aaabcde')]))
+
+    def test_file_name(self):
+        self.assertEqual(get_ngrams('3:x:ABCDEFG,"/tmp/sample.exe"'), set([(6, 'ABCDEFG')]))
+
+    def test_invalid(self):
+        self.assertEqual(get_ngrams(None), set())
+        self.assertEqual(get_ngrams(''), set())
+        self.assertEqual(get_ngrams('abc:def:ghi'), set())
+
+
+class CandidatesTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp(dir=os.getcwd())
+        self.db = Database(os.path.join(self.path, 'index.db'))
+
+        session = self.db.Session()
+        for sha256, ssdeep in (('first', FIRST), ('second', SECOND), ('third', THIRD), ('other', OTHER)):
+            session.add(Malware(sha256, 0, sha256, sha256, sha256, 0, ssdeep=ssdeep, name=sha256))
+        session.commit()
+        session.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_candidates(self):
+        self.assertEqual(update_index(self.db), 4)
+        self.assertEqual(update_index(self.db), 0)
+
+        candidates = self.db.get_ssdeep_candidates(get_ngrams(FIRST), exclude='first')
+        self.assertEqual(sorted(sample.sha256 for sample in candidates), ['second', 'third'])
+
+
+if __name__ == '__main__':
+    unittest.main()
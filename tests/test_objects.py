@@ -0,0 +1,38 @@
+# This file is part of Viper - https://github.com/viper-framework/viper
+# See the file 'LICENSE' for copying permission.
+
+import os
+import time
+import hashlib
+import unittest
+
+from lib.common.objects import File
+
+
+class FileCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.abspath('sample.bin')
+        with open(self.path, 'wb') as handle:
+            handle.write(b'first content')
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_unchanged_file(self):
+        self.assertEqual(File(self.path).sha256, hashlib.sha256(b'first content').hexdigest())
+        self.assertEqual(File(self.path).sha256, hashlib.sha256(b'first content').hexdigest())
+
+    def test_rewritten_in_place(self):
+        File(self.path).sha256
+        stat = os.stat(self.path)
+        # Same size, and the mtime put back, only the ctime tells the change.
+        time.sleep(0.01)
+        with open(self.path, 'r+b') as handle:
+            handle.write(b'other')
+        os.utime(self.path, (stat.st_atime, stat.st_mtime))
+
+        self.assertEqual(File(self.path).sha256, hashlib.sha256(b'other content').hexdigest())
+
+
+if __name__ == '__main__':
+    unittest.main()
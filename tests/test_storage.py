@@ -0,0 +1,160 @@
+# This file is part of Viper - https://github.com/viper-framework/viper
+# See the file 'LICENSE' for copying permission.
+
+import os
+import shutil
+import hashlib
+import tempfile
+import unittest
+
+from lib.core import packstore
+from lib.core.catalog import Catalog
+from lib.core.storage import BlobStore, CHUNK_SIZE
+
+
+def get_sample(size, seed):
+    # Compressible but not trivially so.
+    data = b''
+    counter = 0
+    while len(data) < size:
+        data += hashlib.sha256(seed + str(counter).encode()).hexdigest().encode()
+        counter += 1
+    return data[:size]
+
+
+class BlobStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp(dir=os.getcwd())
+        self.store = self.get_store()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def get_store(self):
+        return BlobStore(os.path.join(self.path, 'storage'), Catalog(os.path.join(self.path, 'catalog.db')))
+
+    def put(self, data):
+        sha256 = hashlib.sha256(data).hexdigest()
+        chunks = [data[start:start + CHUNK_SIZE] for start in range(0, len(data), CHUNK_SIZE)]
+        self.store.put(sha256, chunks, len(data))
+        return sha256
+
+    def read(self, sha256):
+        with self.store.open(sha256) as reader:
+            return reader.read()
+
+    def test_put_and_open(self):
+        data = get_sample(3 * CHUNK_SIZE + 17, b'large')
+        sha256 = self.put(data)
+
+        self.assertTrue(self.store.exists(sha256))
+        self.assertTrue(self.store.find_blob(sha256))
+        self.assertEqual(self.read(sha256), data)
+        self.assertIsNone(self.store.open('0' * 64))
+
+    def test_put_twice(self):
+        sha256 = self.put(b'same content')
+        blob_path = self.store.find_blob(sha256)[0]
+        os.utime(blob_path, (1000, 1000))
+
+        self.put(b'same content')
+        self.assertEqual(os.path.getmtime(blob_path), 1000)
+
+    def test_refcount(self):
+        sha256 = self.put(b'shared sample')
+        self.store.add_ref('first', sha256)
+        self.store.add_ref('second', sha256)
+        self.store.add_ref('second', sha256)
+        self.assertEqual(self.store.get_refcount(sha256), 2)
+
+        self.assertFalse(self.store.release('first', sha256))
+        self.assertFalse(self.store.has_ref('first', sha256))
+        self.assertEqual(self.read(sha256), b'shared sample')
+
+        self.assertTrue(self.store.release('second', sha256))
+        self.assertFalse(self.store.exists(sha256))
+        self.assertEqual(self.store.get_refcount(sha256), 0)
+
+    def test_release_all(self):
+        shared = self.put(b'shared sample')
+        own = self.put(b'own sample')
+        self.store.add_ref('first', shared)
+        self.store.add_ref('first', own)
+        self.store.add_ref('second', shared)
+
+        self.store.release_all('first')
+        self.assertTrue(self.store.exists(shared))
+        self.assertFalse(self.store.exists(own))
+        self.assertEqual(self.store.get_refcount(shared), 1)
+
+    def test_legacy_refs(self):
+        sha256 = self.put(b'old sample')
+        refs_path = os.path.join(self.path, 'storage', 'refs', 'old')
+        os.makedirs(refs_path)
+        open(os.path.join(refs_path, sha256), 'w').close()
+
+        store = self.get_store()
+        self.assertTrue(store.has_ref('old', sha256))
+        self.assertFalse(os.path.exists(refs_path))
+
+    def test_packs(self):
+        self.store.enable_packs()
+        small = get_sample(1000, b'small')
+        large = get_sample(packstore.PACK_THRESHOLD + 1, b'large')
+        small_sha256 = self.put(small)
+        large_sha256 = self.put(large)
+
+        self.assertIsNone(self.store.find_blob(small_sha256))
+        self.assertTrue(self.store.packs.exists(small_sha256))
+        self.assertTrue(self.store.find_blob(large_sha256))
+        self.assertEqual(self.read(small_sha256), small)
+        self.assertEqual(self.store.read_member(small_sha256), small)
+        self.assertIsNone(self.store.read_member(large_sha256))
+
+        self.store.add_ref('first', small_sha256)
+        self.assertTrue(self.store.release('first', small_sha256))
+        self.assertFalse(self.store.exists(small_sha256))
+
+    def test_pack_existing_blobs(self):
+        data = b'stored before the packs'
+        sha256 = self.put(data)
+
+        self.assertEqual(self.store.pack(), 1)
+        self.assertIsNone(self.store.find_blob(sha256))
+        self.assertEqual(self.read(sha256), data)
+
+
+class PackStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp(dir=os.getcwd())
+        self.packs = packstore.PackStore(self.path)
+        self.segment_size = packstore.SEGMENT_SIZE
+        packstore.SEGMENT_SIZE = 100
+
+    def tearDown(self):
+        packstore.SEGMENT_SIZE = self.segment_size
+        shutil.rmtree(self.path)
+
+    def read(self, sha256):
+        reader, codec = self.packs.open(sha256)
+        return reader.read()
+
+    def test_compact(self):
+        # Each member fills a segment of its own.
+        members = dict(('{0:064x}'.format(i), get_sample(150, str(i).encode())) for i in range(3))
+        for sha256, data in sorted(members.items()):
+            self.packs.put(sha256, data, 'zz')
+        self.assertEqual(self.packs.get_segments(), [0, 1, 2])
+
+        deleted = sorted(members)[0]
+        self.packs.delete(deleted)
+        self.assertEqual(self.packs.compact(), 150)
+        self.assertEqual(self.packs.get_segments(), [1, 2])
+
+        self.assertFalse(self.packs.exists(deleted))
+        for sha256 in sorted(members)[1:]:
+            self.assertEqual(self.read(sha256), members[sha256])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+# This file is part of Viper - https://github.com/viper-framework/viper
+# See the file 'LICENSE' for copying permission.
+
+import unittest
+
+from modules.reversing import xor
+
+PLAIN = b'\x00' * 37 + b'MZ header, GetProcAddress and LoadLibrary here' + b'\x90' * 29
+
+
+class XorSearchTest(unittest.TestCase):
+    def test_single_byte_key(self):
+        data = xor.decode(PLAIN, 'xor', b'\x5a')
+        self.assertEqual(xor.xor_search(data, ['GetProcAddress'], 1), set([('GetProcAddress', b'\x5a')]))
+        self.assertEqual(xor.decode(data, 'xor', b'\x5a'), PLAIN)
+
+    def test_multi_byte_key(self):
+        # The key found is aligned on the beginning of the file, whatever
+        # the offset of the term.
+        key = b'\x13\x37\xc0'
+        data = xor.decode(PLAIN, 'xor', key)
+        results = xor.xor_search(data, ['GetProcAddress', 'LoadLibrary'], 4)
+        self.assertEqual(results, set([('GetProcAddress', key), ('LoadLibrary', key)]))
+        self.assertEqual(xor.decode(data, 'xor', key), PLAIN)
+
+    def test_plain_text(self):
+        self.assertEqual(xor.xor_search(PLAIN, ['GetProcAddress'], 2), set())
+
+    def test_short_terms(self):
+        data = xor.decode(PLAIN, 'xor', b'\x13\x37')
+        # Two bytes of key leave a single byte of "here" to compare.
+        self.assertEqual(xor.xor_search(data, ['here'], 2), set())
+        self.assertEqual(xor.xor_search(data, ['MZ header'], 2), set([('MZ header', b'\x13\x37')]))
+
+    def test_without_numpy(self):
+        have_numpy = xor.HAVE_NUMPY
+        xor.HAVE_NUMPY = False
+        try:
+            data = xor.decode(PLAIN, 'xor', b'\xff\x01')
+            self.assertEqual(xor.xor_delta(data, 2), bytes(bytearray(
+                a ^ b for a, b in zip(bytearray(data[2:]), bytearray(data[:-2])))))
+            self.assertEqual(xor.add_delta(data), bytes(bytearray(
+                (a - b) % 256 for a, b in zip(bytearray(data[1:]), bytearray(data[:-1])))))
+            self.assertEqual(xor.xor_search(data, ['LoadLibrary'], 2), set([('LoadLibrary', b'\xff\x01')]))
+        finally:
+            xor.HAVE_NUMPY = have_numpy
+
+
+class OtherModesTest(unittest.TestCase):
+    def test_add(self):
+        data = PLAIN.translate(bytes(bytearray((i + 200) % 256 for i in range(256))))
+        self.assertEqual(xor.add_search(data, ['LoadLibrary']), set([('LoadLibrary', 200)]))
+        self.assertEqual(xor.decode(data, 'add', 200), PLAIN)
+
+    def test_rol(self):
+        data = PLAIN.translate(bytes(bytearray(xor.rol(i, 3) for i in range(256))))
+        self.assertEqual(xor.rol_search(data, ['LoadLibrary']), set([('LoadLibrary', 3)]))
+        self.assertEqual(xor.decode(data, 'rol', 3), PLAIN)
+
+    def test_rot(self):
+        data = PLAIN.translate(xor.rot_table(13))
+        self.assertEqual(xor.rot_search(data, ['LoadLibrary']), set([('LoadLibrary', 13)]))
+        self.assertEqual(xor.decode(data, 'rot', 13), PLAIN)
+
+
+if __name__ == '__main__':
+    unittest.main()